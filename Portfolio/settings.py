@@ -47,9 +47,15 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'django.contrib.humanize',
     # third party apps
+    # benchmark suite (seed_polls and run_benchmarks commands)
+    'benchmarks.apps.BenchmarksConfig',
 ]
 
 MIDDLEWARE = [
+    # first, so it times everything below it (see polls/metrics.py)
+    'polls.middleware.MetricsMiddleware',
+    # keeps reads on the primary database just after a write when there are read replicas (see polls/routers.py)
+    'polls.middleware.ReadYourWritesMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -87,6 +93,16 @@ WSGI_APPLICATION = 'Portfolio.wsgi.application'
 # -> In secrets
 #
 
+# Cache
+# https://docs.djangoproject.com/en/2.0/topics/cache/
+
+#
+# -> In secrets (for production). Every worker process has to share the cache (e.g. memcached), as the polls pages are
+#    cached against versions bumped by whichever process handled a vote or edit (see polls/cache.py). Without CACHES,
+#    each process gets its own local memory cache, which is only right for a single process such as runserver;
+#    `manage.py check --deploy` warns about it.
+#
+
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
 
@@ -124,3 +140,78 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Polls
+# (defaults for all of these are in polls/constants.py)
+
+# Incoming votes are buffered and written in batches. Setting MAX_PENDING to 1 writes every vote straight away. Votes
+# that can't be written are retried by the next MAX_ATTEMPTS flushes, then dropped.
+POLLS_VOTE_BUFFER = {
+    'MAX_PENDING': 100,
+    'FLUSH_INTERVAL': 1.0,
+    'MAX_ATTEMPTS': 5,
+}
+
+# Busy polls spread their votes over SHARDS counter rows per choice. A poll is switched over automatically once it gets
+# more than AUTO_THRESHOLD votes per second, or it can be switched over in the admin.
+POLLS_SHARDED_VOTES = {
+    'SHARDS': 8,
+    'AUTO_THRESHOLD': 50,
+}
+
+# Results pages are cached until the poll gets a new vote. Busy (sharded) polls may be shown results up to
+# MAX_STALENESS seconds old instead.
+POLLS_RESULTS_CACHE = {
+    'TIMEOUT': 300,
+    'MAX_STALENESS': 5,
+}
+
+# With ENABLED, results pages get live vote counts over Server-Sent Events. Votes are sent at most every
+# COALESCE_INTERVAL seconds and each stream is closed after MAX_DURATION seconds, after which the browser reconnects.
+# Each open stream holds a WSGI worker thread the whole time, so only turn it on with a threaded server that has a
+# thread for every viewer watching at once (every voter is sent to the results page).
+POLLS_RESULTS_STREAM = {
+    'ENABLED': False,
+    'COALESCE_INTERVAL': 0.5,
+    'HEARTBEAT': 15,
+    'MAX_DURATION': 300,
+}
+
+# Each user (or anonymous session) gets one vote per question. An in-memory filter sized for FILTER_CAPACITY voters
+# answers most "has this voter voted yet?" checks without a query.
+POLLS_VOTE_DEDUP = {
+    'FILTER_CAPACITY': 1000000,
+    'FILTER_ERROR_RATE': 0.01,
+}
+
+# Votes are counted per minute for the results over time. Minutes older than MINUTES_KEPT_FOR seconds are merged into
+# hours and hours older than HOURS_KEPT_FOR seconds into days by the downsample_vote_rollups command.
+POLLS_VOTE_ROLLUPS = {
+    'MINUTES_KEPT_FOR': 24 * 60 * 60,
+    'HOURS_KEPT_FOR': 30 * 24 * 60 * 60,
+}
+
+# The trending page ranks the SIZE polls with the most votes lately, each vote counting half as much for every
+# HALF_LIFE seconds since it was cast.
+POLLS_TRENDING = {
+    'HALF_LIFE': 6 * 60 * 60,
+    'SIZE': 20,
+}
+
+# Deleted polls are hidden straight away and purged in the background DELAY seconds later (or by the
+# purge_deleted_questions command), BATCH_SIZE rows at a time with PAUSE seconds between batches.
+POLLS_PURGE = {
+    'BATCH_SIZE': 1000,
+    'PAUSE': 0.1,
+    'DELAY': 60,
+}
+
+# Reads of polls pages are spread over the read replica database ALIASES (as well as being in DATABASES), and everything
+# else goes to the default database. After a write, a visitor reads from the default database for STICKY_SECONDS.
+# See polls/routers.py for trying it out locally with two SQLite files.
+DATABASE_ROUTERS = ['polls.routers.PrimaryReplicaRouter']
+POLLS_READ_REPLICAS = {
+    'ALIASES': [],
+    'STICKY_SECONDS': 5,
+}
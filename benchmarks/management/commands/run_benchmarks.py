@@ -0,0 +1,68 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+
+from benchmarks import runner
+from benchmarks.seed import seed
+
+
+class Command(BaseCommand):
+    help = ("Time the polls views and write p50/p95/p99 latency, requests per second and queries per request as JSON. "
+            "By default this runs in a new test database filled by the seeder, which is thrown away afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='benchmark.json', help="JSON file to write the report to.")
+        parser.add_argument('--requests', type=int, default=200, help="Timed requests per scenario.")
+        parser.add_argument('--warmup', type=int, default=10, help="Untimed requests made first per scenario.")
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            help="Only run this scenario (can be given more than once).")
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--questions', type=int, default=1000)
+        parser.add_argument('--choices', type=int, default=4)
+        parser.add_argument('--random-seed', type=int, default=0)
+        parser.add_argument('--use-existing-db', action='store_true',
+                            help="Benchmark the configured database as it is instead of a new seeded one. "
+                                 "Votes and polls made by the benchmark are left in it.")
+
+    def handle(self, *args, **options):
+        if options['use_existing_db']:
+            report = self.benchmark(options)
+        else:
+            old_name = connection.settings_dict['NAME']
+            test_dir = None
+            if connection.vendor == 'sqlite':
+                # an in-memory database can't be shared with the thread that flushes buffered votes, use a file
+                test_dir = tempfile.mkdtemp()
+                connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(test_dir, 'benchmark.sqlite3')
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                seed(options['users'], options['questions'], options['choices'],
+                     rng=random.Random(options['random_seed']))
+                report = self.benchmark(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                if test_dir:
+                    shutil.rmtree(test_dir, ignore_errors=True)
+
+        with open(options['output'], 'w') as file:
+            json.dump(report, file, indent=2)
+        for name, stats in report['scenarios'].items():
+            self.stdout.write("%-16s p50 %8.2fms  p95 %8.2fms  p99 %8.2fms  %8.1f req/s  %5.1f queries" % (
+                name, stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+                stats['requests_per_second'], stats['queries_per_request'],
+            ))
+        self.stdout.write(self.style.SUCCESS("Report written to %s." % options['output']))
+
+    def benchmark(self, options):
+        # log in as whoever has the most polls so my_polls has plenty to show
+        user = get_user_model().objects.annotate(polls=Count('question')).order_by('-polls').first()
+        if user is None:
+            raise CommandError("There are no users to benchmark with, run seed_polls first.")
+        return runner.run(user, options['requests'], options['warmup'], options['scenarios'])
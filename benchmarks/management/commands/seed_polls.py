@@ -0,0 +1,21 @@
+import random
+
+from django.core.management.base import BaseCommand
+
+from benchmarks.seed import seed
+
+
+class Command(BaseCommand):
+    help = "Fill the database with users, polls and votes to benchmark against."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--questions', type=int, default=1000)
+        parser.add_argument('--choices', type=int, default=4, help="Choices per question.")
+        parser.add_argument('--random-seed', type=int, help="Seed for the random numbers, for repeatable data.")
+
+    def handle(self, *args, **options):
+        seed(options['users'], options['questions'], options['choices'], rng=random.Random(options['random_seed']))
+        self.stdout.write(self.style.SUCCESS(
+            "Created %(users)d users and %(questions)d questions with %(choices)d choices each." % options
+        ))
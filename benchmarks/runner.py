@@ -0,0 +1,130 @@
+"""
+Timing the polls views.
+
+Each scenario makes a request with the test client over and over. For every request, the time taken and the number of
+database queries run are recorded. The report has the latency percentiles, requests per second and queries per request
+of each scenario, and can be saved as JSON to compare runs across commits.
+"""
+import itertools
+import math
+import subprocess
+import time
+
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from polls.models import Question
+from polls.pagination import encode_cursor
+from polls.views import IndexView
+from polls.votes import flush_votes
+
+
+def percentile(sorted_values, percent):
+    """
+    Return the nearest-rank percentile of an already sorted list.
+    """
+    rank = max(math.ceil(percent / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def scenarios(deep_page=20):
+    """
+    Return a {name: function} dict of the requests to benchmark. Each function makes one request with the given client.
+    """
+    published = Question.objects.filter(pub_date__lte=timezone.now()).order_by('-pub_date', '-pk')
+    question = published.first()
+    # the last question before the deep page, found once here so the benchmark itself pays no OFFSET
+    offset = deep_page * IndexView.paginate_by - 1
+    before_deep_page = published[offset:offset + 1].first() or question
+    choices = itertools.cycle(question.choice_set.values_list('pk', flat=True))
+    new_poll = itertools.count()
+
+    def create_post_data():
+        return {
+            'question_text': 'Benchmark poll %d' % next(new_poll),
+            'form-TOTAL_FORMS': '2', 'form-INITIAL_FORMS': '0', 'form-MIN_NUM_FORMS': '0',
+            'form-MAX_NUM_FORMS': '1000', 'form-0-choice_text': 'Yes', 'form-1-choice_text': 'No',
+        }
+
+    return {
+        'index': lambda client: client.get(reverse('polls:index')),
+        'index_deep': lambda client: client.get(
+            reverse('polls:index'), {'cursor': encode_cursor('next', before_deep_page)}
+        ),
+        'detail': lambda client: client.get(reverse('polls:detail', args=(question.id,))),
+        'results': lambda client: client.get(reverse('polls:results', args=(question.id,))),
+        # every vote comes from a new anonymous visitor, as each voter only gets one vote per question
+        'vote': lambda client: Client().post(reverse('polls:vote', args=(question.id,)), {'choice': next(choices)}),
+        'create_question': lambda client: client.post(reverse('polls:create'), create_post_data()),
+        'my_polls': lambda client: client.get(reverse('polls:my_polls')),
+    }
+
+
+def run_scenario(client, request, requests, warmup):
+    """
+    Make the request `warmup` times untimed, then `requests` times timed, and return the stats.
+    """
+    for _ in range(warmup):
+        request(client)
+    latencies = []
+    queries = 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            request_started = time.perf_counter()
+            response = request(client)
+            latencies.append(time.perf_counter() - request_started)
+        if response.status_code >= 400:
+            raise RuntimeError("Got a %d response while benchmarking." % response.status_code)
+        queries += counter.count
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': requests,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'requests_per_second': round(requests / elapsed, 1),
+        'queries_per_request': round(queries / requests, 2),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(user, requests=200, warmup=10, only=None):
+    """
+    Benchmark every scenario (or the ones named in `only`) logged in as the given user, and return the report.
+    """
+    client = Client()
+    client.force_login(user)
+    results = {}
+    for name, request in scenarios().items():
+        if only and name not in only:
+            continue
+        results[name] = run_scenario(client, request, requests, warmup)
+    # don't leave votes behind for a database that may be about to be thrown away
+    flush_votes()
+    return {
+        'commit': git_commit(),
+        'date': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'questions': Question.objects.count(),
+        'scenarios': results,
+    }
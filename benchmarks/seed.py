@@ -0,0 +1,42 @@
+"""
+Filling a database with users, polls and votes to benchmark against.
+"""
+import datetime
+import random
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from polls.models import Choice, Question
+
+BATCH_SIZE = 1000
+
+
+def seed(users, questions, choices, max_votes=100, rng=None):
+    """
+    Create `users` users with `questions` questions shared between them, each question with `choices` choices with a
+    random number of votes. Questions are published at random times over the last year. Returns the new users.
+    """
+    rng = rng or random.Random()
+    User = get_user_model()
+    now = timezone.now()
+    first = User.objects.count()
+    User.objects.bulk_create([User(username='benchmark%d' % (first + i)) for i in range(users)])
+    authors = list(User.objects.order_by('-pk')[:users])
+
+    for start in range(0, questions, BATCH_SIZE):
+        with transaction.atomic():
+            new_choices = []
+            for i in range(start, min(start + BATCH_SIZE, questions)):
+                votes = [rng.randrange(max_votes) for _ in range(choices)]
+                question = Question.objects.create(
+                    question_text='Benchmark question %d?' % i,
+                    pub_date=now - datetime.timedelta(seconds=rng.randrange(365 * 24 * 60 * 60)),
+                    author=authors[i % len(authors)],
+                    votes_total=sum(votes),
+                )
+                new_choices.extend(Choice(question=question, choice_text='Choice %d' % c, votes=n)
+                                   for c, n in enumerate(votes))
+            Choice.objects.bulk_create(new_choices)
+    return authors
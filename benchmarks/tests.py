@@ -0,0 +1,59 @@
+import json
+import os
+import random
+import tempfile
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from polls.models import Choice, Question
+
+from .runner import percentile
+from .seed import seed
+
+
+class SeedTests(TestCase):
+    def test_seed(self):
+        """
+        The seeder makes the asked for number of users, questions and choices, with totals matching the choices.
+        """
+        seed(3, 10, 4, rng=random.Random(0))
+        self.assertEqual(User.objects.count(), 3)
+        self.assertEqual(Question.objects.count(), 10)
+        self.assertEqual(Choice.objects.count(), 40)
+        question = Question.objects.first()
+        self.assertEqual(question.votes_total, question.total_votes())
+
+
+class PercentileTests(TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+
+
+@override_settings(POLLS_VOTE_BUFFER={'MAX_PENDING': 1})
+class RunBenchmarksTests(TestCase):
+    def test_report(self):
+        """
+        Benchmarking the existing database writes a JSON report with the stats of every scenario.
+        """
+        seed(2, 30, 3, rng=random.Random(0))
+        handle, path = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        call_command('run_benchmarks', '--use-existing-db', '--requests', '3', '--warmup', '1', '--output', path,
+                     stdout=StringIO())
+        with open(path) as file:
+            report = json.load(file)
+        self.assertEqual(set(report['scenarios']), {
+            'index', 'index_deep', 'detail', 'results', 'vote', 'create_question', 'my_polls',
+        })
+        for stats in report['scenarios'].values():
+            self.assertEqual(stats['requests'], 3)
+            self.assertLessEqual(stats['p50_ms'], stats['p95_ms'])
+            self.assertLessEqual(stats['p95_ms'], stats['p99_ms'])
+            self.assertGreater(stats['queries_per_request'], 0)
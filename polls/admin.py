@@ -1,27 +1,218 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.contrib.admin.models import DELETION, LogEntry
+from django.contrib.admin.utils import model_ngettext
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import connections
+from django.template.response import TemplateResponse
+from django.utils.functional import cached_property
 
-from .models import Choice, Question, AboutSection
+from . import constants
+from .models import Choice, Question, AboutSection, Vote
+from .cache import invalidate_question
+from .purge import soft_delete_questions
+from .votes import reset_votes
+
+def estimate_count(model, using):
+    """
+    Return the database's own estimate of the number of rows in the model's table, or None if it doesn't keep one.
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute('SELECT table_rows FROM information_schema.tables '
+                           'WHERE table_schema = DATABASE() AND table_name = %s', [model._meta.db_table])
+        elif connection.vendor == 'sqlite':
+            # SQLite keeps no row count, but the largest rowid is found straight from the table's b-tree
+            cursor.execute('SELECT MAX(rowid) FROM %s' % table)
+        else:
+            return None
+        row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Pages through a whole table without counting it: once the database estimates it has more than
+    ADMIN_ESTIMATED_COUNT_ABOVE rows, the estimate is used instead of a COUNT(*). Filtered and searched lists are
+    still counted exactly.
+    """
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        # nothing filtered out beyond what the default manager always leaves out (deleted questions)
+        unfiltered = queryset.model._default_manager.all().query.where
+        if len(queryset.query.where.children) == len(unfiltered.children):
+            estimate = estimate_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > constants.ADMIN_ESTIMATED_COUNT_ABOVE:
+                return estimate
+        return super().count
 
 
 class ChoiceInline(admin.TabularInline):
     model = Choice
-    extra = 3
+    extra = 1
+    # counted by the vote path, which a stale number in the form would overwrite
+    readonly_fields = ('votes',)
 
 
 class QuestionAdmin(admin.ModelAdmin):
     # When viewing list of existing questions
-    list_display = ('question_text', 'pub_date', 'was_published_recently')
-    list_filter = ['pub_date']
+    list_display = ('question_text', 'author', 'pub_date', 'unpublished', 'was_published_recently', 'votes')
+    list_select_related = ('author',)
+    list_filter = ['pub_date', 'unpublished']
+    # searched with the full-text index by get_search_results(), but needed for the search box to be shown
     search_fields = ['question_text']
     list_per_page = 20
+    paginator = EstimatedCountPaginator
+    # don't count the whole table again just to show it next to a filtered count
+    show_full_result_count = False
+    actions = ['reset_votes', 'unpublish', 'republish']
 
     # When creating/editing questions
     fieldsets = [
         (None,               {'fields': ['question_text']}),
-        ('Date information', {'fields': ['pub_date']}),
+        ('Date information', {'fields': ['pub_date', 'unpublished']}),
+        ('Vote counting',    {'fields': ['sharded_votes'], 'classes': ['collapse']}),
     ]
     inlines = [ChoiceInline]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_shard_votes()
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Search with the full-text index (see search.py) rather than a LIKE over every question.
+        """
+        if not search_term:
+            return queryset, False
+        return queryset.search(search_term), False
+
+    def votes(self, question):
+        return question.current_votes_total
+    votes.admin_order_field = 'votes_total'
+
+    def save_formset(self, request, form, formset, change):
+        """
+        Only save the text of existing choices, so votes counted while the form was open aren't overwritten.
+        """
+        for choice in formset.save(commit=False):
+            if choice.pk is None:
+                choice.save()
+            else:
+                choice.save(update_fields=['choice_text'])
+        for choice in formset.deleted_objects:
+            choice.delete()
+
+    def delete_model(self, request, obj):
+        """
+        Hide the question straight away and purge it in the background (see purge.py).
+        """
+        soft_delete_questions([obj.pk])
+
+    def delete_queryset(self, request, queryset):
+        """
+        Hide the selected questions straight away and purge them in the background (see purge.py).
+        """
+        soft_delete_questions(queryset.values_list('pk', flat=True))
+
+    def count_deleted_objects(self, question_ids):
+        """
+        Return how many questions, choices and votes deleting the given questions deletes, by verbose name.
+        """
+        return {
+            Question._meta.verbose_name_plural: len(question_ids),
+            Choice._meta.verbose_name_plural: Choice.objects.filter(question__in=question_ids).count(),
+            Vote._meta.verbose_name_plural: Vote.objects.filter(question__in=question_ids).count(),
+        }
+
+    def get_deleted_objects(self, objs, request):
+        """
+        Only count the choices and votes the delete page would otherwise collect into Python and list one by one, as
+        delete_selected() does.
+        """
+        question_ids = [obj.pk for obj in objs]
+        return [], self.count_deleted_objects(question_ids), set(), []
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # the site-wide delete action, which has to keep its name for its confirmation page to post back to it
+        if 'delete_selected' in actions:
+            actions['delete_selected'] = (type(self).delete_selected, 'delete_selected',
+                                          self.delete_selected.short_description)
+        return actions
+
+    def delete_selected(self, request, queryset):
+        """
+        Replaces the admin's own delete action, which collects every choice and vote of the questions into Python to
+        list them and logs each question with its own INSERT. The confirmation page shows how many of each there are
+        instead.
+        """
+        if not self.has_delete_permission(request):
+            raise PermissionDenied
+        questions = list(queryset.values_list('pk', 'question_text'))
+        question_ids = [pk for pk, question_text in questions]
+        if request.POST.get('post'):
+            if questions:
+                content_type = ContentType.objects.get_for_model(Question)
+                LogEntry.objects.bulk_create([
+                    LogEntry(user_id=request.user.pk, content_type=content_type, object_id=str(pk),
+                             object_repr=question_text[:200], action_flag=DELETION)
+                    for pk, question_text in questions
+                ])
+                self.delete_queryset(request, queryset)
+                self.message_user(request, "Successfully deleted %d %s." % (
+                    len(questions), model_ngettext(self.opts, len(questions))
+                ), messages.SUCCESS)
+            return None
+
+        model_count = self.count_deleted_objects(question_ids)
+        context = {
+            **self.admin_site.each_context(request),
+            'title': "Are you sure?",
+            'objects_name': str(model_ngettext(queryset)),
+            'deletable_objects': [],
+            'model_count': model_count.items(),
+            'queryset': queryset,
+            'opts': self.opts,
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+            'media': self.media,
+        }
+        request.current_app = self.admin_site.name
+        return TemplateResponse(request, 'admin/delete_selected_confirmation.html', context)
+    delete_selected.short_description = "Delete selected questions"
+
+    def reset_votes(self, request, queryset):
+        question_ids = list(queryset.values_list('pk', flat=True))
+        reset_votes(question_ids)
+        self.message_user(request, "Reset the votes of %d questions." % len(question_ids), messages.SUCCESS)
+    reset_votes.short_description = "Reset votes of selected questions"
+
+    def set_unpublished(self, queryset, unpublished):
+        """
+        Take the questions off the site or put them back, keeping their pub_date, and return how many there were.
+        """
+        question_ids = list(queryset.values_list('pk', flat=True))
+        updated = Question.objects.filter(pk__in=question_ids).update(unpublished=unpublished)
+        for question_id in question_ids:
+            invalidate_question(question_id)
+        return updated
+
+    def unpublish(self, request, queryset):
+        unpublished = self.set_unpublished(queryset, True)
+        self.message_user(request, "Unpublished %d questions." % unpublished, messages.SUCCESS)
+    unpublish.short_description = "Unpublish selected questions"
+
+    def republish(self, request, queryset):
+        republished = self.set_unpublished(queryset, False)
+        self.message_user(request, "Republished %d questions." % republished, messages.SUCCESS)
+    republish.short_description = "Republish selected questions"
+
 
 class AboutSectionAdmin(admin.ModelAdmin):
     list_display = ('title', 'display_order', 'content')
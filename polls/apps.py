@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class PollsConfig(AppConfig):
     name = 'polls'
+
+    def ready(self):
+        # connect the signal receivers and register the system checks
+        from . import checks, signals  # noqa: F401
@@ -0,0 +1,226 @@
+"""
+Caching of poll pages.
+
+Every question has a version number in the cache which is bumped whenever it gets new votes or is changed. Anything
+cached for a question (its results, its card on the index page) is stored along with the version it was made from, so
+it is thrown away as soon as the question changes. Busy (sharded) questions get so many votes that their results would
+hardly ever be reused, so for those, results up to MAX_STALENESS seconds old are served even if the question has been
+voted on since. Votes don't change a question's voting page, so it has a detail version of its own that is only
+bumped when the question itself changes.
+
+The About page has a version of its own, bumped whenever an AboutSection changes.
+
+Which questions are published depends on the time as well as on the questions, so lists of published questions (the
+pages of the index) are cached against a version bumped whenever any question is changed, and only until the next
+scheduled question goes live (or for PUBLISHED_CACHE_MAX_TTL seconds, if that is sooner). The question pages cache
+each question whether it is published yet or not, and check its pub_date themselves, so a scheduled question still
+appears exactly on time.
+
+All of this relies on every process sharing the cache: a version bumped by the process that handled a vote or edit
+has to be seen by all the others, or they go on serving (and answering 304 Not Modified for) pages that are out of
+date. Django's default local memory cache is per process, so it is only fit for a single process, such as runserver
+or the tests; anything with several workers needs a shared cache such as memcached in CACHES (the polls.W001 deploy
+check warns otherwise).
+
+The summary at the top of an author's My Polls page is cached until one of their polls is voted on, created, changed
+or deleted, when it is simply deleted.
+"""
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import constants, routers
+
+
+def get_results_cache_policy():
+    """
+    Return the (timeout, max_staleness) pair from the POLLS_RESULTS_CACHE setting, falling back to the defaults in
+    constants.py.
+    """
+    policy = getattr(settings, 'POLLS_RESULTS_CACHE', {})
+    return (policy.get('TIMEOUT', constants.RESULTS_CACHE_TIMEOUT),
+            policy.get('MAX_STALENESS', constants.RESULTS_CACHE_MAX_STALENESS))
+
+
+def question_version_key(question_id):
+    return 'polls:question:%d:version' % question_id
+
+
+def results_key(question_id):
+    return 'polls:question:%d:results' % question_id
+
+
+def detail_key(question_id):
+    return 'polls:question:%d:detail' % question_id
+
+
+def detail_version_key(question_id):
+    return 'polls:question:%d:detail-version' % question_id
+
+
+ABOUT_VERSION_KEY = 'polls:about:version'
+PUBLISHED_VERSION_KEY = 'polls:published:version'
+
+
+def new_version():
+    # start from the time rather than 1 so that entries made from an evicted version can't match the new one
+    return int(time.time() * 1000)
+
+
+def get_version(key):
+    """
+    Return the version stored under the given key, starting a new one if the cache doesn't have it.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, new_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # no version yet, so nothing can have been cached against it
+        get_version(key)
+
+
+def get_question_version(question_id):
+    return get_version(question_version_key(question_id))
+
+
+def get_detail_version(question_id):
+    return get_version(detail_version_key(question_id))
+
+
+def get_question_versions(question_ids):
+    """
+    Return a {question_id: version} dict for the given questions, fetching them from the cache all at once.
+    """
+    keys = {question_version_key(question_id): question_id for question_id in question_ids}
+    versions = {keys[key]: version for key, version in cache.get_many(keys).items()}
+    for question_id in set(question_ids) - set(versions):
+        versions[question_id] = get_question_version(question_id)
+    return versions
+
+
+def bump_question_versions(question_ids):
+    """
+    Make anything cached for the given questions out of date.
+    """
+    for question_id in question_ids:
+        bump_version(question_version_key(question_id))
+
+
+def batch_results_key(question_ids):
+    """
+    Return the cache key for the results of the given questions, which changes whenever any of them does.
+    """
+    versions = get_question_versions(question_ids)
+    signature = ','.join('%d:%d' % (question_id, versions[question_id]) for question_id in sorted(question_ids))
+    return 'polls:results-batch:%s' % hashlib.md5(signature.encode()).hexdigest()
+
+
+def invalidate_question(question_id):
+    """
+    Throw away the cached results of the given question straight away, even for busy questions. Used when the
+    question itself is changed rather than voted on.
+    """
+    cache.delete_many([results_key(question_id), detail_key(question_id)])
+    bump_question_versions([question_id])
+    bump_version(detail_version_key(question_id))
+    bump_version(PUBLISHED_VERSION_KEY)
+
+
+def author_summary_key(user_id):
+    return 'polls:author:%d:summary' % user_id
+
+
+def invalidate_author_summaries(user_ids):
+    keys = [author_summary_key(user_id) for user_id in set(user_ids) if user_id is not None]
+    if keys:
+        cache.delete_many(keys)
+
+
+def cached_author_summary(user_id, load_summary):
+    """
+    Return the summary of the given author's polls, from the cache if possible. `load_summary` is called to work it
+    out on a miss.
+    """
+    key = author_summary_key(user_id)
+    summary = cache.get(key)
+    if summary is None:
+        summary = load_summary()
+        cache.set(key, summary, constants.AUTHOR_SUMMARY_TIMEOUT)
+    return summary
+
+
+def cached_results(question_id, load_question):
+    """
+    Return the question to show on the results page, from the cache if possible. `load_question` is called to get it
+    from the database on a miss.
+    """
+    timeout, max_staleness = get_results_cache_policy()
+    version = get_question_version(question_id)
+    entry = cache.get(results_key(question_id))
+    if entry is not None:
+        cached_version, cached_at, question = entry
+        if cached_version == version:
+            return question
+        if question.sharded_votes and time.time() - cached_at < max_staleness:
+            return question
+    question = load_question()
+    cache.set(results_key(question_id), (version, time.time(), question), timeout)
+    return question
+
+
+def cached_detail(question_id, load_question):
+    """
+    Return the question to show on its voting page, from the cache if possible. Votes don't change the page, so it is
+    only thrown away when the question itself changes (see invalidate_question()). `load_question` is called to get
+    it from the database on a miss.
+    """
+    question = cache.get(detail_key(question_id))
+    if question is None:
+        question = load_question()
+        cache.set(detail_key(question_id), question, get_results_cache_policy()[0])
+    return question
+
+
+def cached_published(name, load_questions, next_pub_date):
+    """
+    Return the questions `load_questions` gives (e.g. a page of the index), from the cache if possible. They are
+    reloaded when any question is changed or once one of them is voted on, and no later than `next_pub_date()`, the
+    time the next scheduled question goes live (or None if there is none).
+
+    With read replicas, requests that read from the primary to see their own writes (see routers.py) get entries of
+    their own, so they are never handed questions loaded from a replica that hasn't caught up with those writes.
+    """
+    aliases, sticky_seconds = routers.get_replica_policy()
+    from_replica = bool(aliases) and not routers.reads_from_primary()
+    key = 'polls:published:%d:%s:%s' % (
+        get_version(PUBLISHED_VERSION_KEY), 'replica' if from_replica else 'primary', name
+    )
+    entry = cache.get(key)
+    if entry is not None:
+        expires_at, versions, questions = entry
+        if time.time() < expires_at and get_question_versions(list(versions)) == versions:
+            return questions
+    questions = load_questions()
+    versions = get_question_versions([question.id for question in questions])
+    max_ttl = constants.PUBLISHED_CACHE_MAX_TTL
+    if from_replica:
+        # the replica may not have the latest questions yet
+        max_ttl = min(max_ttl, sticky_seconds)
+    now = time.time()
+    expires_at = now + max_ttl
+    pub_date = next_pub_date()
+    if pub_date is not None:
+        expires_at = min(expires_at, pub_date.timestamp())
+    # the backend may only keep whole seconds, so the entry itself also says when it stops being used
+    cache.set(key, (expires_at, versions, questions), max(1, math.ceil(expires_at - now)))
+    return questions
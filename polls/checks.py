@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    The polls pages are cached against versions bumped by whichever process handled a vote or edit (see cache.py), so
+    with more than one worker process they must share the cache.
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if backend == 'django.core.cache.backends.locmem.LocMemCache':
+        return [Warning(
+            "The default cache is local to each process, so polls pages cached by one worker aren't refreshed when "
+            "a vote or edit is handled by another.",
+            hint="Set CACHES to a cache shared by every worker, such as memcached, unless only one process serves "
+                 "the site.",
+            id='polls.W001',
+        )]
+    return []
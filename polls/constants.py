@@ -3,3 +3,84 @@ QUESTION_TEXT_LENGTH = 200
 
 # Choice Model
 CHOICE_TEXT_LENGTH = 200
+
+# Vote buffer (see polls/votes.py, override with the POLLS_VOTE_BUFFER setting)
+# flush once this many votes are waiting...
+VOTE_BUFFER_MAX_PENDING = 100
+# ...or once the oldest waiting vote is this many seconds old
+VOTE_BUFFER_FLUSH_INTERVAL = 1.0
+# flushes in a row a vote may fail to be written in before it is dropped
+VOTE_BUFFER_MAX_ATTEMPTS = 5
+
+# Sharded vote counting (see polls/votes.py, override with the POLLS_SHARDED_VOTES setting)
+# number of counter rows each choice of a sharded question spreads its votes over
+VOTE_SHARDS = 8
+# a question getting more votes per second than this is switched to sharded counting (None to never switch)
+VOTE_SHARD_AUTO_THRESHOLD = 50
+
+# Results cache (see polls/cache.py, override with the POLLS_RESULTS_CACHE setting)
+# seconds cached results are kept for
+RESULTS_CACHE_TIMEOUT = 300
+# seconds a busy (sharded) question's results may be served after it has been voted on
+RESULTS_CACHE_MAX_STALENESS = 5
+# seconds a list of published questions is cached for at most (it is also refreshed when the next scheduled question
+# goes live, and when any question changes)
+PUBLISHED_CACHE_MAX_TTL = 300
+# most questions the batch results API answers for in one request
+RESULTS_BATCH_MAX_QUESTIONS = 100
+
+# Live results stream (see polls/views.py, override with the POLLS_RESULTS_STREAM setting)
+# whether results pages open the stream at all, off as each open stream holds a worker thread
+RESULTS_STREAM_ENABLED = False
+# least number of seconds between two updates sent to a viewer, votes in between are sent together
+RESULTS_STREAM_COALESCE_INTERVAL = 0.5
+# seconds of no votes after which a keep-alive comment is sent
+RESULTS_STREAM_HEARTBEAT = 15
+# seconds after which the stream is closed (the browser reconnects by itself)
+RESULTS_STREAM_MAX_DURATION = 300
+
+# Vote deduplication (see polls/ledger.py, override with the POLLS_VOTE_DEDUP setting)
+# number of (question, voter) pairs the in-memory filter is sized for, it still works past this but answers "maybe"
+# more often, which costs a query each time
+VOTE_DEDUP_FILTER_CAPACITY = 1000000
+# share of new voters the filter wrongly answers "maybe" for while under capacity
+VOTE_DEDUP_FILTER_ERROR_RATE = 0.01
+
+# Votes over time (see polls/rollups.py, override with the POLLS_VOTE_ROLLUPS setting)
+# seconds per-minute counts are kept before being merged into hours
+ROLLUP_MINUTES_KEPT_FOR = 24 * 60 * 60
+# seconds per-hour counts are kept before being merged into days
+ROLLUP_HOURS_KEPT_FOR = 30 * 24 * 60 * 60
+
+# Trending questions (see polls/trending.py, override with the POLLS_TRENDING setting)
+# seconds after which a vote counts half as much towards a question trending
+TRENDING_HALF_LIFE = 6 * 60 * 60
+# number of questions on the trending page
+TRENDING_SIZE = 20
+# trending_score of a question that has never been voted on (the log of no votes would be minus infinity)
+TRENDING_NO_VOTES = -1e9
+
+# Read replicas (see polls/routers.py, override with the POLLS_READ_REPLICAS setting)
+# database aliases polls reads are spread over, none to read everything from the default database
+READ_REPLICA_ALIASES = ()
+# seconds a visitor's reads stay on the default database after they have written to it
+READ_REPLICA_STICKY_SECONDS = 5
+
+# Purging deleted questions (see polls/purge.py, override with the POLLS_PURGE setting)
+# most rows deleted by one statement
+PURGE_BATCH_SIZE = 1000
+# seconds to wait between two batches, so votes aren't held up behind the deletes
+PURGE_PAUSE = 0.1
+# seconds after a question is deleted before it is purged in the background (so votes for it still buffered have been
+# written), None to only purge with the purge_deleted_questions command
+PURGE_DELAY = 60
+
+# My Polls
+# number of polls per page
+MY_POLLS_PER_PAGE = 20
+# seconds an author's summary is cached for (it is also thrown away whenever one of their polls changes)
+AUTHOR_SUMMARY_TIMEOUT = 24 * 60 * 60
+
+# Admin
+# rows above which the question list shows the database's estimate of the number of questions instead of counting them
+ADMIN_ESTIMATED_COUNT_ABOVE = 10000
@@ -0,0 +1,201 @@
+"""
+One vote per voter per question.
+
+Every accepted vote adds a row to the Vote ledger, whose unique (question, voter) index is what actually stops a voter
+from voting twice. Checking the ledger before every vote would cost a query, so each process keeps a Bloom filter of
+the (question, voter) pairs it knows have voted. The filter never forgets a pair it was given, so when it says a voter
+hasn't voted that is almost always true and no query is needed. When it says a voter may have voted, the ledger is
+asked, as the filter wrongly says "maybe" for about FILTER_ERROR_RATE of new voters.
+
+The filter is built from the ledger in a background thread, started the first time a process checks a vote (not when
+the app is loaded, as management commands and the test runner load it too, before there may be a ledger to read).
+Reading the whole ledger takes a while, so until the filter is ready every check asks the ledger instead, and votes
+taken meanwhile are added to the filter once it is. Other threads can't read an in-memory SQLite database (as the
+tests use), so with one the filter is built straight away in the request instead.
+
+Votes taken by other processes after the filter was built aren't in it, which is why the ledger row is inserted rather
+than assumed: a vote that gets past the filter but has already been cast elsewhere fails on the unique index.
+"""
+import hashlib
+import logging
+import math
+import os
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+
+from . import constants
+from .metrics import registry
+from .models import Vote
+
+logger = logging.getLogger(__name__)
+
+
+def get_dedup_policy():
+    """
+    Return the (filter_capacity, filter_error_rate) pair from the POLLS_VOTE_DEDUP setting, falling back to the
+    defaults in constants.py.
+    """
+    policy = getattr(settings, 'POLLS_VOTE_DEDUP', {})
+    return (policy.get('FILTER_CAPACITY', constants.VOTE_DEDUP_FILTER_CAPACITY),
+            policy.get('FILTER_ERROR_RATE', constants.VOTE_DEDUP_FILTER_ERROR_RATE))
+
+
+class BloomFilter:
+    """
+    A set of strings that can only answer "definitely not in it" or "maybe in it", in a fixed amount of memory.
+    """
+    def __init__(self, capacity, error_rate):
+        # the standard sizes for the best error rate at the given capacity
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        # two halves of one digest stand in for all the hash functions (Kirsch-Mitzenmacher)
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+def voter_identity(request):
+    """
+    Return who is voting: the user if signed in, otherwise the session (which is started if there isn't one yet).
+    """
+    if request.user.is_authenticated:
+        return 'user:%d' % request.user.pk
+    if request.session.session_key is None:
+        request.session.save()
+    return 'session:%s' % request.session.session_key
+
+
+def _key(question_id, voter):
+    return '%d:%s' % (question_id, voter)
+
+
+class VoterIndex:
+    """
+    The per-process filter in front of the Vote ledger.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filter = None
+        self._building = False
+        # keys of votes taken while the filter is being built, added to it once it is ready
+        self._pending = set()
+        self._pid = os.getpid()
+
+    def build(self):
+        """
+        Build the filter from the ledger and start using it. The ledger is read without holding the lock, so votes can
+        still be checked (by the ledger) and taken meanwhile.
+        """
+        with self._lock:
+            self._building = True
+        try:
+            bloom = BloomFilter(*get_dedup_policy())
+            for question_id, voter in Vote.objects.values_list('question_id', 'voter').iterator():
+                bloom.add(_key(question_id, voter))
+        except Exception:
+            with self._lock:
+                self._building = False
+                self._pending = set()
+            raise
+        with self._lock:
+            for key in self._pending:
+                bloom.add(key)
+            self._pending = set()
+            self._filter = bloom
+            self._building = False
+
+    def _build_in_background(self):
+        try:
+            self.build()
+        except Exception:
+            logger.exception("Could not build the voter filter, will retry on the next vote.")
+        finally:
+            # the thread got its own database connection, don't leave it open
+            connections.close_all()
+
+    def _get_filter(self):
+        """
+        Return the filter, or None while it isn't ready yet, in which case building it is started in the background.
+        """
+        if self._pid != os.getpid():
+            # the building thread wasn't copied into this forked worker
+            self._lock = threading.Lock()
+            self._building = False
+            self._pending = set()
+            self._pid = os.getpid()
+        with self._lock:
+            if self._filter is not None or self._building:
+                return self._filter
+            self._building = True
+        self._start_build()
+        return self._filter
+
+    def _start_build(self):
+        connection = connections[Vote.objects.db]
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.build()
+        else:
+            threading.Thread(target=self._build_in_background, daemon=True).start()
+
+    def _add(self, key):
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(key)
+            elif self._building:
+                self._pending.add(key)
+
+    def reset(self):
+        """
+        Forget the filter so it is built from the ledger again on next use.
+        """
+        with self._lock:
+            self._filter = None
+
+    def has_voted(self, question_id, voter):
+        bloom = self._get_filter()
+        if bloom is not None and _key(question_id, voter) not in bloom:
+            registry.inc('polls_vote_dedup_checks_total', (('answered_by', 'filter'),))
+            return False
+        registry.inc('polls_vote_dedup_checks_total', (('answered_by', 'ledger'),))
+        return Vote.objects.filter(question_id=question_id, voter=voter).exists()
+
+    def claim(self, question_id, choice_id, voter):
+        """
+        Record the voter's vote in the ledger. Returns False, recording nothing, if they have already voted on the
+        question.
+        """
+        if self.has_voted(question_id, voter):
+            return False
+        try:
+            with transaction.atomic():
+                Vote.objects.create(question_id=question_id, choice_id=choice_id, voter=voter)
+            claimed = True
+        except IntegrityError:
+            # voted through another process since this process's filter was built
+            claimed = False
+        self._add(_key(question_id, voter))
+        return claimed
+
+
+voter_index = VoterIndex()
+
+
+def claim_vote(request, question_id, choice_id):
+    """
+    Record that whoever made the request has voted for the given choice. Returns False if they already voted on the
+    question, in which case the vote mustn't be counted.
+    """
+    return voter_index.claim(question_id, choice_id, voter_identity(request))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.query_plans import find_full_scans, page_urls
+
+
+class Command(BaseCommand):
+    help = ("EXPLAIN the queries run by each polls page and fail if any of them reads a whole table. "
+            "Run against a database seeded with a realistic amount of polls.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ignore-table', action='append', default=[], dest='ignore_tables',
+                            help="A table that may be scanned in full (can be given more than once).")
+
+    def handle(self, *args, **options):
+        if not page_urls():
+            raise CommandError("There are no published questions to check the pages with.")
+        problems = find_full_scans(options['ignore_tables'])
+        for page, scans in problems.items():
+            for table, sql in scans:
+                self.stderr.write("%s: full scan of %s in\n    %s" % (page, table, sql))
+        if problems:
+            raise CommandError("%d pages read whole tables." % len(problems))
+        self.stdout.write(self.style.SUCCESS("No full table scans found."))
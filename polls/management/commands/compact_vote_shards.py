@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from polls.votes import compact_shards
+
+
+class Command(BaseCommand):
+    help = "Move the votes counted in the shards of sharded questions into the choices and question totals."
+
+    def handle(self, *args, **options):
+        moved = compact_shards()
+        self.stdout.write(self.style.SUCCESS("Compacted %d votes." % moved))
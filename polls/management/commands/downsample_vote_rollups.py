@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from polls.rollups import downsample
+
+
+class Command(BaseCommand):
+    help = "Merge old per-minute vote counts into hours, and old per-hour counts into days."
+
+    def handle(self, *args, **options):
+        merged = downsample()
+        self.stdout.write(self.style.SUCCESS("Downsampled %d buckets." % merged))
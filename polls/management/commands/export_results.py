@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from polls.export import FORMATS, export_lines
+from polls.models import Question
+
+
+class Command(BaseCommand):
+    help = "Export every poll's choices and vote counts as CSV or NDJSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--output', help="File to write to, standard output if not given.")
+
+    def handle(self, *args, **options):
+        lines = export_lines(Question.objects.all(), options['format'])
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
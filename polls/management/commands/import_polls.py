@@ -0,0 +1,132 @@
+import csv
+import itertools
+import json
+import os
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from polls.cache import PUBLISHED_VERSION_KEY, bump_version, invalidate_author_summaries
+from polls.models import Choice, Question
+
+
+def read_jsonl(file):
+    """
+    Yield a poll for each line of a JSON Lines file. Each line looks like
+    {"question_text": "...", "pub_date": "2018-01-01T12:00:00+10:00", "author": "username",
+     "choices": ["choice text", {"choice_text": "...", "votes": 3}, ...]}
+    where pub_date and author are optional and choices can be plain strings or objects.
+    """
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            poll = json.loads(line)
+        except ValueError as e:
+            raise CommandError("Line %d is not valid JSON: %s" % (line_number, e))
+        poll['choices'] = [choice if isinstance(choice, dict) else {'choice_text': choice}
+                           for choice in poll.get('choices', [])]
+        yield poll
+
+
+def read_csv(file):
+    """
+    Yield a poll for each group of rows in a CSV file with the columns
+    question,question_text,pub_date,author,choice_text,votes
+    (the same as export_results writes). There is one row per choice, and the rows of a poll follow each other and
+    share the same value in the question column.
+    """
+    reader = csv.DictReader(file)
+    for _, rows in itertools.groupby(reader, key=lambda row: row['question']):
+        rows = list(rows)
+        yield {
+            'question_text': rows[0]['question_text'],
+            'pub_date': rows[0].get('pub_date'),
+            'author': rows[0].get('author'),
+            'choices': [{'choice_text': row['choice_text'], 'votes': row.get('votes') or 0} for row in rows],
+        }
+
+
+class Command(BaseCommand):
+    help = "Import polls from a JSON Lines or CSV file, writing them to the database in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['jsonl', 'csv'],
+                            help="File format, guessed from the file extension if not given.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Polls written per transaction.")
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if file_format not in ('jsonl', 'csv'):
+            raise CommandError("Can't tell the format of %s, use --format." % options['path'])
+        read = read_jsonl if file_format == 'jsonl' else read_csv
+
+        started = time.monotonic()
+        questions = choices = 0
+        with open(options['path'], newline='', encoding='utf-8') as file:
+            polls = read(file)
+            while True:
+                batch = list(itertools.islice(polls, options['batch_size']))
+                if not batch:
+                    break
+                batch_questions, batch_choices = self.write_batch(batch)
+                questions += batch_questions
+                choices += batch_choices
+                if options['verbosity'] >= 2:
+                    self.stdout.write("%d polls imported..." % questions)
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(self.style.SUCCESS(
+            "Imported %d questions and %d choices in %.2fs (%.0f rows/s)."
+            % (questions, choices, elapsed, (questions + choices) / elapsed)
+        ))
+
+    def write_batch(self, batch):
+        """
+        Write one batch of polls in a single transaction, returning how many questions and choices were made.
+        """
+        usernames = {poll['author'] for poll in batch if poll.get('author')}
+        authors = get_user_model().objects.in_bulk(usernames, field_name='username') if usernames else {}
+        now = timezone.now()
+
+        questions = []
+        for poll in batch:
+            pub_date = parse_datetime(poll['pub_date']) if poll.get('pub_date') else now
+            if pub_date is None:
+                raise CommandError("Invalid pub_date %r." % poll['pub_date'])
+            if timezone.is_naive(pub_date):
+                pub_date = timezone.make_aware(pub_date)
+            questions.append(Question(
+                question_text=poll['question_text'],
+                pub_date=pub_date,
+                author=authors.get(poll.get('author')),
+                votes_total=sum(int(choice.get('votes', 0)) for choice in poll['choices']),
+            ))
+
+        with transaction.atomic():
+            if self.bulk_insert_returns_ids():
+                Question.objects.bulk_create(questions)
+            else:
+                # the choices need the questions' ids, which this database can't give back from a bulk insert
+                for question in questions:
+                    question.save()
+            choices = [
+                Choice(question=question, choice_text=choice['choice_text'], votes=int(choice.get('votes', 0)))
+                for question, poll in zip(questions, batch) for choice in poll['choices']
+            ]
+            Choice.objects.bulk_create(choices)
+        # bulk_create() sends no signals to do this
+        invalidate_author_summaries(author.pk for author in authors.values())
+        bump_version(PUBLISHED_VERSION_KEY)
+        return len(questions), len(choices)
+
+    @staticmethod
+    def bulk_insert_returns_ids():
+        features = connection.features
+        return getattr(features, 'can_return_rows_from_bulk_insert',
+                       getattr(features, 'can_return_ids_from_bulk_insert', False))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from polls.purge import drain_purge_queue
+
+
+class Command(BaseCommand):
+    help = "Purge the deleted questions waiting in the queue, and everything belonging to them."
+
+    def handle(self, *args, **options):
+        purged = drain_purge_queue()
+        self.stdout.write(self.style.SUCCESS("Purged %d rows." % purged))
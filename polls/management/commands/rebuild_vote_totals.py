@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from polls.models import Question
+
+
+class Command(BaseCommand):
+    help = "Recount the stored vote total of every question from its choices."
+
+    def handle(self, *args, **options):
+        updated = Question.objects.rebuild_vote_totals()
+        self.stdout.write(self.style.SUCCESS("Rebuilt vote totals for %d questions." % updated))
@@ -0,0 +1,115 @@
+"""
+Request metrics in Prometheus exposition format.
+
+MetricsMiddleware records how long each request took, how many database queries it ran and how long they took, and
+how long its template took to render, against the name of the URL it went to (e.g. polls:index). The numbers are kept
+in fixed-bucket histograms in memory, so recording a request only costs a few additions under a lock, and are served
+as text at /metrics for Prometheus to scrape.
+
+Each process keeps its own numbers, so with several workers each scrape shows the requests of whichever worker
+answered it (Prometheus adds them up across workers when they are scraped separately).
+"""
+import threading
+from bisect import bisect_left
+
+from django.http import HttpResponse
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # one count per bucket plus one for +Inf, not cumulative (they are added up when exposed)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> (type, help, buckets)
+        self._metrics = {}
+        # name -> {labels: Histogram or count}
+        self._values = {}
+
+    def histogram(self, name, help_text, buckets):
+        self._metrics[name] = ('histogram', help_text, buckets)
+        self._values[name] = {}
+
+    def counter(self, name, help_text):
+        self._metrics[name] = ('counter', help_text, None)
+        self._values[name] = {}
+
+    def observe(self, name, labels, value):
+        """
+        Add a value to the histogram with the given name and labels (a tuple of (label, value) pairs).
+        """
+        with self._lock:
+            values = self._values[name]
+            histogram = values.get(labels)
+            if histogram is None:
+                histogram = values[labels] = Histogram(self._metrics[name][2])
+            histogram.observe(value)
+
+    def inc(self, name, labels, amount=1):
+        with self._lock:
+            values = self._values[name]
+            values[labels] = values.get(labels, 0) + amount
+
+    def clear(self):
+        with self._lock:
+            for values in self._values.values():
+                values.clear()
+
+    def expose(self):
+        """
+        Return every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for name, (metric_type, help_text, buckets) in self._metrics.items():
+                lines.append('# HELP %s %s' % (name, help_text))
+                lines.append('# TYPE %s %s' % (name, metric_type))
+                for labels, value in sorted(self._values[name].items()):
+                    if metric_type == 'counter':
+                        lines.append('%s%s %s' % (name, format_labels(labels), value))
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets + ('+Inf',), value.counts):
+                        cumulative += count
+                        lines.append('%s_bucket%s %d' % (name, format_labels(labels + (('le', bound),)), cumulative))
+                    lines.append('%s_sum%s %s' % (name, format_labels(labels), repr(float(value.sum))))
+                    lines.append('%s_count%s %d' % (name, format_labels(labels), cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{%s}' % ','.join('%s="%s"' % (label, value) for (label, _), value in zip(labels, escaped))
+
+
+registry = Registry()
+registry.counter('polls_requests_total', "Requests answered, by view and status code.")
+registry.histogram('polls_request_duration_seconds', "Time taken to answer a request.", LATENCY_BUCKETS)
+registry.histogram('polls_request_db_queries', "Database queries run by a request.", QUERY_BUCKETS)
+registry.histogram('polls_request_db_duration_seconds', "Time a request spent running database queries.",
+                   LATENCY_BUCKETS)
+registry.histogram('polls_template_render_seconds', "Time taken to render a request's template response.",
+                   LATENCY_BUCKETS)
+registry.counter('polls_vote_dedup_checks_total',
+                 "Checks for an earlier vote by the same voter, by whether the filter or the ledger answered.")
+
+
+def metrics(request):
+    """
+    Serve the collected metrics for Prometheus.
+    """
+    return HttpResponse(registry.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
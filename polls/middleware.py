@@ -0,0 +1,87 @@
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+
+from . import routers
+from .metrics import registry
+
+
+class QueryTimer:
+    """
+    Database execute wrapper counting the queries run and the time they took.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+class MetricsMiddleware:
+    """
+    Records the latency, database queries and template render time of every request (see metrics.py).
+
+    This should be first in MIDDLEWARE so it times everything else, and so its process_template_response() is the
+    last one to run before the template is rendered. Only TemplateResponses (the generic views) have their render
+    time recorded; views using render() render inside the view.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        view = (('view', request.resolver_match.view_name if request.resolver_match else 'unresolved'),)
+        registry.inc('polls_requests_total', view + (('status', response.status_code),))
+        registry.observe('polls_request_duration_seconds', view, duration)
+        registry.observe('polls_request_db_queries', view, timer.count)
+        registry.observe('polls_request_db_duration_seconds', view, timer.duration)
+        render_time = getattr(request, '_metrics_render_time', None)
+        if render_time is not None:
+            registry.observe('polls_template_render_seconds', view, render_time)
+        return response
+
+    def process_template_response(self, request, response):
+        render_started = time.perf_counter()
+
+        def rendered(response):
+            request._metrics_render_time = time.perf_counter() - render_started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+class ReadYourWritesMiddleware:
+    """
+    Keeps a visitor's reads on the primary database for a few seconds after a request of theirs wrote to it, so they
+    see their own changes even if the read replicas haven't caught up yet (see routers.py).
+    """
+    cookie_name = 'polls_recent_write'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routers.start_request(recently_wrote=self.cookie_name in request.COOKIES)
+        try:
+            response = self.get_response(request)
+            aliases, sticky_seconds = routers.get_replica_policy()
+            if aliases and routers.has_written():
+                response.set_cookie(self.cookie_name, '1', max_age=sticky_seconds, httponly=True)
+            return response
+        finally:
+            routers.start_request()
+
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:11
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def count_existing_votes(apps, schema_editor):
+    Question = apps.get_model('polls', 'Question')
+    Choice = apps.get_model('polls', 'Choice')
+    choice_totals = Choice.objects.filter(
+        question=OuterRef('pk')
+    ).order_by().values('question').annotate(total=Sum('votes')).values('total')
+    Question.objects.update(votes_total=Coalesce(Subquery(choice_totals), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0008_auto_20180216_1747'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='votes_total',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_existing_votes, migrations.RunPython.noop),
+    ]
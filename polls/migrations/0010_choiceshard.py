@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0009_question_votes_total'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='sharded_votes',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='ChoiceShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('votes', models.PositiveIntegerField(default=0)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='polls.Choice')),
+            ],
+            options={
+                'unique_together': {('choice', 'shard')},
+            },
+        ),
+    ]
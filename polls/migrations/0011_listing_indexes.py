@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0010_choiceshard'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='choice',
+            index=models.Index(fields=['question', 'votes'], name='choice_question_votes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['pub_date', 'id'], name='question_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['author', 'pub_date'], name='question_author_pub_date_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0012_vote'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('minute', 'Minute'), ('hour', 'Hour'), ('day', 'Day')], max_length=6)),
+                ('bucket', models.DateTimeField()),
+                ('votes', models.PositiveIntegerField(default=0)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='polls.Choice')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='voterollup',
+            index=models.Index(fields=['period', 'bucket'], name='rollup_period_bucket_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='voterollup',
+            unique_together={('choice', 'period', 'bucket')},
+        ),
+    ]
@@ -0,0 +1,144 @@
+from django.db import migrations
+
+# The full-text index of question and choice texts (see polls/search.py), kept up to date by triggers so that
+# bulk_create() and update() are indexed too. Other databases (and SQLite builds without FTS5) have no index and are
+# searched with LIKE instead.
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE polls_question_fts USING fts5(question_text, choice_text, tokenize = 'porter unicode61')",
+    """
+    INSERT INTO polls_question_fts (rowid, question_text, choice_text)
+    SELECT id, question_text, coalesce((SELECT group_concat(choice_text, ' ') FROM polls_choice
+                                        WHERE question_id = polls_question.id), '')
+    FROM polls_question
+    """,
+    # copied rather than imported from polls/search.py, so later changes there can't change what this migration did
+    """
+    CREATE TRIGGER IF NOT EXISTS polls_question_fts_insert AFTER INSERT ON polls_question BEGIN
+        INSERT INTO polls_question_fts (rowid, question_text, choice_text) VALUES (new.id, new.question_text, '');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS polls_question_fts_update AFTER UPDATE OF question_text ON polls_question BEGIN
+        UPDATE polls_question_fts SET question_text = new.question_text WHERE rowid = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS polls_question_fts_delete AFTER DELETE ON polls_question BEGIN
+        DELETE FROM polls_question_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS polls_choice_fts_insert AFTER INSERT ON polls_choice BEGIN
+        UPDATE polls_question_fts SET choice_text = coalesce((SELECT group_concat(choice_text, ' ') FROM polls_choice
+                                                              WHERE question_id = polls_question_fts.rowid), '')
+        WHERE rowid IN (new.question_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS polls_choice_fts_update AFTER UPDATE OF choice_text, question_id ON polls_choice BEGIN
+        UPDATE polls_question_fts SET choice_text = coalesce((SELECT group_concat(choice_text, ' ') FROM polls_choice
+                                                              WHERE question_id = polls_question_fts.rowid), '')
+        WHERE rowid IN (old.question_id, new.question_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS polls_choice_fts_delete AFTER DELETE ON polls_choice BEGIN
+        UPDATE polls_question_fts SET choice_text = coalesce((SELECT group_concat(choice_text, ' ') FROM polls_choice
+                                                              WHERE question_id = polls_question_fts.rowid), '')
+        WHERE rowid IN (old.question_id);
+    END
+    """,
+]
+
+SQLITE_BACKWARD = [
+    'DROP TRIGGER polls_choice_fts_delete',
+    'DROP TRIGGER polls_choice_fts_update',
+    'DROP TRIGGER polls_choice_fts_insert',
+    'DROP TRIGGER polls_question_fts_delete',
+    'DROP TRIGGER polls_question_fts_update',
+    'DROP TRIGGER polls_question_fts_insert',
+    'DROP TABLE polls_question_fts',
+]
+
+POSTGRES_FORWARD = [
+    """
+    CREATE TABLE polls_question_search (
+        question_id integer PRIMARY KEY REFERENCES polls_question (id) ON DELETE CASCADE,
+        document tsvector NOT NULL
+    )
+    """,
+    'CREATE INDEX polls_question_search_document_idx ON polls_question_search USING GIN (document)',
+    """
+    CREATE FUNCTION polls_question_search_refresh(refreshed_id integer) RETURNS void AS $$
+        DELETE FROM polls_question_search WHERE question_id = refreshed_id;
+        INSERT INTO polls_question_search (question_id, document)
+        SELECT q.id, setweight(to_tsvector('english', q.question_text), 'A') ||
+                     setweight(to_tsvector('english', coalesce(string_agg(c.choice_text, ' '), '')), 'B')
+        FROM polls_question q LEFT JOIN polls_choice c ON c.question_id = q.id
+        WHERE q.id = refreshed_id
+        GROUP BY q.id;
+    $$ LANGUAGE sql
+    """,
+    """
+    CREATE FUNCTION polls_question_search_trigger() RETURNS trigger AS $$
+    BEGIN
+        IF TG_TABLE_NAME = 'polls_question' THEN
+            PERFORM polls_question_search_refresh(NEW.id);
+        ELSE
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM polls_question_search_refresh(OLD.question_id);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM polls_question_search_refresh(NEW.question_id);
+            END IF;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER polls_question_search_question AFTER INSERT OR UPDATE OF question_text ON polls_question
+    FOR EACH ROW EXECUTE PROCEDURE polls_question_search_trigger()
+    """,
+    """
+    CREATE TRIGGER polls_question_search_choice AFTER INSERT OR UPDATE OF choice_text, question_id OR DELETE
+    ON polls_choice FOR EACH ROW EXECUTE PROCEDURE polls_question_search_trigger()
+    """,
+    'SELECT polls_question_search_refresh(id) FROM polls_question',
+]
+
+POSTGRES_BACKWARD = [
+    'DROP TRIGGER polls_question_search_choice ON polls_choice',
+    'DROP TRIGGER polls_question_search_question ON polls_question',
+    'DROP FUNCTION polls_question_search_trigger()',
+    'DROP FUNCTION polls_question_search_refresh(integer)',
+    'DROP TABLE polls_question_search',
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        connection = schema_editor.connection
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+                if not cursor.fetchone()[0]:
+                    return
+        for statement in statements.get(connection.vendor, []):
+            schema_editor.execute(statement, params=None)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0013_voterollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            run_for_vendor({'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRES_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0014_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='trending_score',
+            field=models.FloatField(default=-1000000000.0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['-trending_score'], name='question_trending_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0015_question_trending_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['deleted_at'], name='question_deleted_at_idx'),
+        ),
+    ]
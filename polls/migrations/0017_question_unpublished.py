@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0016_question_deleted_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='unpublished',
+            field=models.BooleanField(default=False),
+        ),
+    ]
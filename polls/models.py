@@ -1,24 +1,163 @@
 import datetime
+from collections import defaultdict
 
 from django.conf import settings
 from django.db import models
+from django.db.models import Count, ExpressionWrapper, F, IntegerField, OuterRef, Subquery, Sum, Window
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
-from . import constants
+from . import constants, search
+
+
+class QuestionQuerySet(models.QuerySet):
+    def rebuild_vote_totals(self):
+        """
+        Recount votes_total for every question in this queryset from its choices, in a single UPDATE.
+        """
+        choice_totals = Choice.objects.filter(
+            question=OuterRef('pk')
+        ).order_by().values('question').annotate(total=Sum('votes')).values('total')
+        return self.update(votes_total=Coalesce(Subquery(choice_totals), 0))
+
+    def with_shard_votes(self):
+        """
+        Annotate each question with the votes that are still sitting in its choices' shards.
+        """
+        shard_totals = ChoiceShard.objects.filter(
+            choice__question=OuterRef('pk')
+        ).order_by().values('choice__question').annotate(total=Sum('votes')).values('total')
+        return self.annotate(shard_votes=Coalesce(Subquery(shard_totals), 0))
+
+    def search(self, terms):
+        """
+        Only the questions whose text or choices match the search terms, best matches first (see search.py).
+        """
+        return search.search(self, terms)
+
+    def next_pub_date(self):
+        """
+        The pub_date of the question in this queryset that will be published next, or None if none are scheduled.
+        """
+        return self.filter(
+            pub_date__gt=timezone.now(), unpublished=False
+        ).order_by('pub_date').values_list('pub_date', flat=True).first()
+
+    def summary(self):
+        """
+        Return {'polls': count, 'votes': total votes, 'most_active': (pk, question_text, votes) or None} for the
+        questions in this queryset, from a single query: the totals are taken over all of them with window functions
+        on the same row as the most voted on question.
+        """
+        votes = ExpressionWrapper(F('votes_total') + F('shard_votes'), output_field=IntegerField())
+        row = self.with_shard_votes().annotate(
+            votes=votes,
+            polls_count=Window(Count('pk')),
+            votes_sum=Window(Sum(votes)),
+        ).order_by(votes.desc(), '-pub_date', '-pk').values_list(
+            'polls_count', 'votes_sum', 'pk', 'question_text', 'votes'
+        ).first()
+        if row is None:
+            return {'polls': 0, 'votes': 0, 'most_active': None}
+        polls_count, votes_sum, pk, question_text, question_votes = row
+        return {
+            'polls': polls_count,
+            'votes': votes_sum,
+            'most_active': (pk, question_text, question_votes) if question_votes else None,
+        }
+
+
+class ChoiceQuerySet(models.QuerySet):
+    def with_shard_votes(self):
+        """
+        Annotate each choice with the votes that are still sitting in its shards.
+        """
+        return self.annotate(shard_votes=Coalesce(Sum('shards__votes'), 0))
+
+    def tallies(self):
+        """
+        Return {question_id: {'total': votes, 'choices': [[choice_id, votes, percentage], ...]}} for the choices in
+        this queryset, including the votes in their shards, from a single query.
+        """
+        rows = self.with_shard_votes().order_by('question_id', 'pk').values_list(
+            'question_id', 'pk', 'votes', 'shard_votes'
+        )
+        choices = defaultdict(list)
+        for question_id, choice_id, votes, shard_votes in rows:
+            choices[question_id].append((choice_id, votes + shard_votes))
+        tallies = {}
+        for question_id, question_choices in choices.items():
+            total = sum(votes for choice_id, votes in question_choices)
+            tallies[question_id] = {
+                'total': total,
+                'choices': [[choice_id, votes, round(votes * 100 / total, 1) if total else 0]
+                            for choice_id, votes in question_choices],
+            }
+        return tallies
+
+
+class QuestionManager(models.Manager.from_queryset(QuestionQuerySet)):
+    """
+    Leaves out deleted questions, which are only waiting to be purged (see purge.py).
+    """
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
 
 class Question(models.Model):
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True)
     question_text = models.CharField(max_length=constants.QUESTION_TEXT_LENGTH)
     pub_date = models.DateTimeField('date published')
+    # sum of the votes of all choices, kept up to date by the vote path so pages don't have to add them up
+    votes_total = models.PositiveIntegerField(default=0, editable=False)
+    # spread votes over several ChoiceShard rows per choice so a very busy poll doesn't fight over single rows
+    sharded_votes = models.BooleanField(default=False)
+    # how many votes the question has had lately, kept up to date by the vote path (see trending.py)
+    trending_score = models.FloatField(default=constants.TRENDING_NO_VOTES, editable=False)
+    # set when the question is deleted, after which it is hidden everywhere until it is purged (see purge.py)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # taken off the site by the admin, keeping its pub_date for when it is published again
+    unpublished = models.BooleanField(default=False)
+
+    objects = QuestionManager()
+    # deleted questions too
+    all_objects = QuestionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # published questions newest first, which is also what the index page's cursors follow
+            models.Index(fields=['pub_date', 'id'], name='question_pub_date_idx'),
+            # a user's own questions newest first (my_polls)
+            models.Index(fields=['author', 'pub_date'], name='question_author_pub_date_idx'),
+            # the trending page
+            models.Index(fields=['-trending_score'], name='question_trending_idx'),
+            # the deleted questions waiting to be purged, oldest first
+            models.Index(fields=['deleted_at'], name='question_deleted_at_idx'),
+        ]
 
     def __str__(self):
         return self.question_text
 
     def total_votes(self):
-        votes = 0
-        for choice in self.choice_set.all():
-            votes += choice.votes
-        return votes
+        """
+        Count the votes from the choices (and their shards) themselves. Pages should use current_votes_total instead.
+        """
+        votes = self.choice_set.aggregate(total=Sum('votes'))['total'] or 0
+        return votes + self._shard_votes()
+
+    def _shard_votes(self):
+        if hasattr(self, 'shard_votes'):
+            return self.shard_votes
+        if not self.sharded_votes:
+            return 0
+        return ChoiceShard.objects.filter(choice__question=self).aggregate(total=Sum('votes'))['total'] or 0
+
+    @property
+    def current_votes_total(self):
+        """
+        The stored votes_total plus any votes that haven't been compacted out of the shards yet.
+        """
+        return self.votes_total + self._shard_votes()
 
     def was_published_recently(self):
         now = timezone.now()
@@ -35,9 +174,88 @@ class Choice(models.Model):
     choice_text = models.CharField(max_length=constants.CHOICE_TEXT_LENGTH)
     votes = models.PositiveIntegerField(default=0)
 
+    objects = ChoiceQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['question', 'votes'], name='choice_question_votes_idx'),
+        ]
+
     def __str__(self):
         return self.choice_text
 
+    @property
+    def current_votes(self):
+        """
+        The stored votes plus any votes that haven't been compacted out of the shards yet.
+        """
+        if hasattr(self, 'shard_votes'):
+            return self.votes + self.shard_votes
+        return self.votes + (self.shards.aggregate(total=Sum('votes'))['total'] or 0)
+
+
+class ChoiceShard(models.Model):
+    """
+    One of the counters a choice of a sharded question spreads its votes over. Each vote goes to a random shard and
+    the shards are regularly compacted back into Choice.votes (see votes.py).
+    """
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE, related_name='shards')
+    shard = models.PositiveSmallIntegerField()
+    votes = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('choice', 'shard')
+
+    def __str__(self):
+        return '%s (shard %d)' % (self.choice, self.shard)
+
+
+class VoteRollup(models.Model):
+    """
+    The votes a choice got in one minute, hour or day (see rollups.py).
+    """
+    MINUTE = 'minute'
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIOD_CHOICES = (
+        (MINUTE, 'Minute'),
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+    )
+
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE, related_name='rollups')
+    period = models.CharField(max_length=6, choices=PERIOD_CHOICES)
+    # start of the bucket, in UTC
+    bucket = models.DateTimeField()
+    votes = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('choice', 'period', 'bucket')
+        indexes = [
+            # for finding the buckets old enough to downsample
+            models.Index(fields=['period', 'bucket'], name='rollup_period_bucket_idx'),
+        ]
+
+    def __str__(self):
+        return '%s (%s from %s)' % (self.choice, self.period, self.bucket)
+
+
+class Vote(models.Model):
+    """
+    A record of who has voted on which question, so each voter only gets one vote per question (see ledger.py).
+    `voter` is 'user:<id>' for signed in users and 'session:<session key>' for anyone else.
+    """
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    voter = models.CharField(max_length=64)
+    voted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('question', 'voter')
+
+    def __str__(self):
+        return '%s voted on %s' % (self.voter, self.question)
+
 
 class AboutSection(models.Model):
     title = models.CharField(max_length=50)
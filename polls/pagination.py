@@ -0,0 +1,92 @@
+"""
+Keyset (cursor) pagination.
+
+Rather than counting every row and skipping OFFSET rows to reach a page, each page carries opaque cursors pointing at
+its first and last question. The next page is then just "the questions after the last one of this page" which the
+database can find straight from the index, so every page costs the same to load however deep it is.
+"""
+import base64
+import binascii
+
+from django.db.models import Q
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(direction, question):
+    raw = '%s|%s|%d' % (direction, question.pub_date.isoformat(), question.pk)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Return the (direction, pub_date, pk) a cursor points at. Raises Http404 for a cursor we didn't make.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        direction, pub_date, pk = raw.split('|')
+        pub_date, pk = parse_datetime(pub_date), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        pub_date = None
+    if pub_date is None or direction not in ('next', 'prev'):
+        raise Http404("Invalid page.")
+    return direction, pub_date, pk
+
+
+class KeysetPage:
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def next_cursor(self):
+        return encode_cursor('next', self.object_list[-1]) if self.has_next() else None
+
+    def previous_cursor(self):
+        return encode_cursor('prev', self.object_list[0]) if self.has_previous() else None
+
+
+class KeysetPaginator:
+    """
+    Paginates questions newest first, by (pub_date, pk).
+    """
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+
+    def page(self, cursor=None):
+        """
+        Return the page the given cursor points to, or the first page if there is no cursor.
+        """
+        if not cursor:
+            questions = list(self.queryset.order_by('-pub_date', '-pk')[:self.per_page + 1])
+            return KeysetPage(questions[:self.per_page], len(questions) > self.per_page, False)
+
+        direction, pub_date, pk = decode_cursor(cursor)
+        if direction == 'next':
+            questions = list(self.queryset.filter(
+                Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk)
+            ).order_by('-pub_date', '-pk')[:self.per_page + 1])
+            return KeysetPage(questions[:self.per_page], len(questions) > self.per_page, True)
+
+        # going backwards, so walk the index the other way and put the page back in order afterwards
+        questions = list(self.queryset.filter(
+            Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, pk__gt=pk)
+        ).order_by('pub_date', 'pk')[:self.per_page + 1])
+        has_previous = len(questions) > self.per_page
+        return KeysetPage(questions[:self.per_page][::-1], True, has_previous)
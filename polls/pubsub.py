@@ -0,0 +1,156 @@
+"""
+In-process publish/subscribe for live vote counts.
+
+Every open results stream subscribes to its question here. After a batch of votes has been written, the vote path
+reads the new vote counts of each question that has subscribers once, and every subscriber of that question is handed
+them. A subscriber remembers the counts it has passed on (starting with the snapshot its stream opened with) and is
+only given the difference, so however many batches come in, each viewer is only ever sent one combined update at a
+time, votes already in the snapshot aren't sent again, and no viewer has to ask the database.
+
+Subscribers only hear about batches written by their own process. Each worker flushes its own votes (see votes.py), so
+with several workers the votes counted by the others show up with the next batch of the stream's own worker, or when
+the page reconnects.
+
+The stream is served over WSGI: results_events() is a plain generator that sleeps between updates, so every open
+results page holds one worker thread for up to MAX_DURATION seconds (see POLLS_RESULTS_STREAM). With sync workers a
+handful of viewers would take every worker, so the stream is off unless ENABLED is set, and should only be turned on
+with a server that has enough threads for the viewers expected at once.
+"""
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+from . import constants
+
+
+class Subscription:
+    def __init__(self, question_id):
+        self.question_id = question_id
+        self._condition = threading.Condition()
+        # the newest published votes of each choice, and the votes the subscriber has been given
+        self._votes = {}
+        self._sent = {}
+
+    def publish(self, votes):
+        with self._condition:
+            for choice_id, n in votes.items():
+                # batches can be published out of order, an older count never replaces a newer one
+                if n > self._votes.get(choice_id, 0):
+                    self._votes[choice_id] = n
+            self._condition.notify()
+
+    def start(self, votes):
+        """
+        Record the {choice_id: votes} the subscriber was given to begin with, so they aren't handed over again.
+        """
+        with self._condition:
+            self._sent = dict(votes)
+
+    def _new_votes(self):
+        return Counter({
+            choice_id: n - self._sent.get(choice_id, 0)
+            for choice_id, n in self._votes.items() if n > self._sent.get(choice_id, 0)
+        })
+
+    def get(self, timeout):
+        """
+        Wait up to `timeout` seconds for votes, then return every vote published since the last call as a
+        {choice_id: new_votes} Counter (empty if there were none).
+        """
+        with self._condition:
+            self._condition.wait_for(self._new_votes, timeout)
+            new_votes = self._new_votes()
+            for choice_id in new_votes:
+                self._sent[choice_id] = self._votes[choice_id]
+        return new_votes
+
+
+class Broker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, question_id):
+        subscription = Subscription(question_id)
+        with self._lock:
+            self._subscriptions[question_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.question_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.question_id, None)
+
+    def publish(self, question_id, votes):
+        """
+        Hand the given {choice_id: votes}, the choices' vote counts after a batch was written, to every subscriber of
+        the question.
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(question_id, ()))
+        for subscription in subscriptions:
+            subscription.publish(votes)
+
+    def subscriber_count(self, question_id):
+        with self._lock:
+            return len(self._subscriptions.get(question_id, ()))
+
+
+broker = Broker()
+
+
+def stream_enabled():
+    """
+    Whether results pages stream live votes, from the POLLS_RESULTS_STREAM setting.
+    """
+    return getattr(settings, 'POLLS_RESULTS_STREAM', {}).get('ENABLED', constants.RESULTS_STREAM_ENABLED)
+
+
+def get_stream_policy():
+    """
+    Return the (coalesce_interval, heartbeat, max_duration) from the POLLS_RESULTS_STREAM setting, falling back to the
+    defaults in constants.py.
+    """
+    policy = getattr(settings, 'POLLS_RESULTS_STREAM', {})
+    return (policy.get('COALESCE_INTERVAL', constants.RESULTS_STREAM_COALESCE_INTERVAL),
+            policy.get('HEARTBEAT', constants.RESULTS_STREAM_HEARTBEAT),
+            policy.get('MAX_DURATION', constants.RESULTS_STREAM_MAX_DURATION))
+
+
+def sse_event(event, data):
+    return 'event: %s\ndata: %s\n\n' % (event, json.dumps(data, separators=(',', ':')))
+
+
+def results_events(question):
+    """
+    Yield the Server-Sent Events for a live results page: a 'snapshot' of every choice's votes, then a 'votes' event
+    with the new votes of each choice whenever there are some. Holds the worker thread until the stream is closed.
+    """
+    coalesce_interval, heartbeat, max_duration = get_stream_policy()
+    # subscribe before reading the counts so no votes are missed in between
+    subscription = broker.subscribe(question.id)
+    try:
+        # have the browser wait 3 seconds before reconnecting
+        yield 'retry: 3000\n\n'
+        snapshot = {choice.id: choice.current_votes for choice in question.choice_set.with_shard_votes()}
+        # batches published from here on that were already counted in the snapshot add nothing new
+        subscription.start(snapshot)
+        yield sse_event('snapshot', snapshot)
+        deadline = time.monotonic() + max_duration
+        last_sent = 0
+        while time.monotonic() < deadline:
+            # hold back until the interval is up so votes coming in meanwhile go out as one event
+            time.sleep(max(0, last_sent + coalesce_interval - time.monotonic()))
+            votes = subscription.get(timeout=min(heartbeat, max(0, deadline - time.monotonic())))
+            if votes:
+                last_sent = time.monotonic()
+                yield sse_event('votes', votes)
+            else:
+                yield ': keep-alive\n\n'
+    finally:
+        broker.unsubscribe(subscription)
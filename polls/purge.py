@@ -0,0 +1,164 @@
+"""
+Deleting questions.
+
+Question.delete() and QuerySet.delete() fetch every choice, shard, ledger row and rollup of the questions into Python
+and send signals for each choice, which for a busy question means hundreds of thousands of rows and queries while
+holding locks on the tables votes are written to. So questions deleted on the site or in the admin are only marked
+as deleted by soft_delete_questions(), which hides them from Question.objects (and so from every page) straight
+away, and are purged later in the background:
+
+- purge_batch() deletes at most BATCH_SIZE ledger, rollup or shard rows of the oldest deleted question per statement,
+  and once none are left, the question and its choices with purge_questions(),
+- drain_purge_queue() runs batches until every deleted question is gone, sleeping PAUSE seconds between them so votes
+  can still be written in the meantime,
+- purge_worker runs drain_purge_queue() in a background thread DELAY seconds after a question is deleted (so any
+  votes for it still buffered by a process have been written first). A process restarting in the meantime drops the
+  scheduled purge, which is then done after the next deletion, or by the purge_deleted_questions command.
+
+purge_questions() deletes each table's rows of the questions with one DELETE, children first, and then does what the
+signals would have done: throw away the questions' cached pages and their authors' summaries. The search index is
+kept up to date by its triggers as usual.
+"""
+import datetime
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from . import constants
+from .cache import invalidate_author_summaries, invalidate_question
+from .models import Choice, ChoiceShard, Question, Vote, VoteRollup
+
+logger = logging.getLogger(__name__)
+
+
+def get_purge_policy():
+    """
+    Return the (batch_size, pause, delay) triple from the POLLS_PURGE setting, falling back to the defaults in
+    constants.py.
+    """
+    policy = getattr(settings, 'POLLS_PURGE', {})
+    return (policy.get('BATCH_SIZE', constants.PURGE_BATCH_SIZE),
+            policy.get('PAUSE', constants.PURGE_PAUSE),
+            policy.get('DELAY', constants.PURGE_DELAY))
+
+
+def purge_questions(question_ids):
+    """
+    Delete the questions with the given ids and everything belonging to them, and return how many were deleted.
+    """
+    question_ids = list(question_ids)
+    author_ids = list(Question.all_objects.filter(pk__in=question_ids).values_list('author_id', flat=True))
+    with transaction.atomic():
+        VoteRollup.objects.filter(choice__question__in=question_ids).delete()
+        ChoiceShard.objects.filter(choice__question__in=question_ids).delete()
+        Vote.objects.filter(question__in=question_ids).delete()
+        # these have receivers for their delete signals, so delete() would still go through them one by one
+        Choice.objects.filter(question__in=question_ids)._raw_delete(router.db_for_write(Choice))
+        deleted = Question.all_objects.filter(pk__in=question_ids)._raw_delete(router.db_for_write(Question))
+    for question_id in question_ids:
+        invalidate_question(question_id)
+    invalidate_author_summaries(author_ids)
+    return deleted
+
+
+def soft_delete_questions(question_ids):
+    """
+    Mark the questions with the given ids as deleted, hiding them everywhere, and schedule them to be purged. Returns
+    how many were deleted.
+    """
+    question_ids = list(question_ids)
+    author_ids = list(Question.objects.filter(pk__in=question_ids).values_list('author_id', flat=True))
+    deleted = Question.objects.filter(pk__in=question_ids).update(deleted_at=timezone.now())
+    for question_id in question_ids:
+        invalidate_question(question_id)
+    invalidate_author_summaries(author_ids)
+    purge_worker.schedule()
+    return deleted
+
+
+def purge_queue():
+    """
+    The deleted questions that are ready to be purged, oldest first.
+    """
+    delay = get_purge_policy()[2] or 0
+    return Question.all_objects.filter(
+        deleted_at__lte=timezone.now() - datetime.timedelta(seconds=delay)
+    ).order_by('deleted_at', 'pk')
+
+
+def purge_batch(batch_size):
+    """
+    Delete up to `batch_size` of the rows belonging to the first question in the purge queue, or the question itself
+    (and its choices, of which there are only a few) once there are none left. Returns how many rows were deleted,
+    which is 0 once the queue is empty.
+    """
+    question_id = purge_queue().values_list('pk', flat=True).first()
+    if question_id is None:
+        return 0
+    for model, question_field in ((Vote, 'question'), (VoteRollup, 'choice__question'),
+                                  (ChoiceShard, 'choice__question')):
+        pks = list(model.objects.filter(**{question_field: question_id}).values_list('pk', flat=True)[:batch_size])
+        if pks:
+            model.objects.filter(pk__in=pks).delete()
+            return len(pks)
+    purge_questions([question_id])
+    return 1
+
+
+def drain_purge_queue():
+    """
+    Purge every deleted question in the queue, a batch at a time, and return how many rows were deleted.
+    """
+    batch_size, pause = get_purge_policy()[:2]
+    purged = 0
+    while True:
+        deleted = purge_batch(batch_size)
+        if not deleted:
+            return purged
+        purged += deleted
+        if pause:
+            time.sleep(pause)
+
+
+class PurgeWorker:
+    """
+    Drains the purge queue in a background thread, DELAY seconds after a question is deleted.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timer = None
+        self._pid = os.getpid()
+
+    def schedule(self):
+        delay = get_purge_policy()[2]
+        if delay is None:
+            return
+        if self._pid != os.getpid():
+            # the timer thread wasn't copied into this forked worker
+            self._lock = threading.Lock()
+            self._timer = None
+            self._pid = os.getpid()
+        with self._lock:
+            if self._timer is None:
+                self._timer = threading.Timer(delay, self._run)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _run(self):
+        with self._lock:
+            self._timer = None
+        try:
+            drain_purge_queue()
+        except Exception:
+            logger.exception("Could not purge deleted questions, will retry after the next deletion.")
+        finally:
+            # the timer thread got its own database connection, don't leave it open
+            connections.close_all()
+
+
+purge_worker = PurgeWorker()
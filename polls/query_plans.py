@@ -0,0 +1,125 @@
+"""
+Checking the query plans of the polls pages for full table scans.
+
+Each page is requested with the test client while every query it runs is recorded, then each of those queries is run
+again under EXPLAIN. A page that makes the database read a whole table instead of using an index is reported.
+"""
+import re
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from .cache import invalidate_author_summaries, invalidate_question
+from .models import Question
+
+# SQLite: "SCAN polls_question" (older versions: "SCAN TABLE polls_question") without "USING ... INDEX"
+SQLITE_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)\b(?! USING)')
+# PostgreSQL: "Seq Scan on polls_question"
+POSTGRESQL_FULL_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+
+def explain(sql, params):
+    """
+    Return the lines of the database's query plan for the given query.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+        cursor.execute('EXPLAIN ' + sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def full_table_scans(sql, params):
+    """
+    Return the names of the tables the given query reads in full.
+    """
+    pattern = SQLITE_FULL_SCAN if connection.vendor == 'sqlite' else POSTGRESQL_FULL_SCAN
+    tables = []
+    for line in explain(sql, params):
+        match = pattern.search(line.strip())
+        if match:
+            tables.append(match.group(1))
+    return tables
+
+
+def record_queries(func):
+    """
+    Call func() and return the (sql, params) of every query it ran.
+    """
+    queries = []
+
+    def recorder(execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith('SELECT'):
+            queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(recorder):
+        func()
+    return queries
+
+
+def newest_question():
+    return Question.objects.filter(
+        pub_date__lte=timezone.now(), unpublished=False
+    ).order_by('-pub_date', '-pk').first()
+
+
+def page_urls():
+    """
+    Return (name, url, user) for each polls page worth checking, using the newest published question and its author.
+    """
+    question = newest_question()
+    if question is None:
+        return []
+    user = question.author or get_user_model().objects.first()
+    index = reverse('polls:index')
+    pages = [
+        ('index', index, None),
+        ('trending', reverse('polls:trending'), None),
+        ('detail', reverse('polls:detail', args=(question.id,)), None),
+        ('results', reverse('polls:results', args=(question.id,)), None),
+    ]
+    if user is not None:
+        pages.append(('my_polls', reverse('polls:my_polls'), user))
+    # a page further on, reached by the index page's own next link
+    next_cursor = Client().get(index).context['page_obj'].next_cursor()
+    if next_cursor:
+        pages.insert(1, ('index (next page)', index + '?cursor=' + next_cursor, None))
+    return pages
+
+
+def page_queries():
+    """
+    Request every polls page and return a {page name: [(sql, params), ...]} dict of the queries each ran.
+
+    The cached copies of the pages (see cache.py) are thrown away before each request, as a page served from the cache
+    runs none of the queries worth checking.
+    """
+    question = newest_question()
+    queries = {}
+    for name, url, user in page_urls():
+        invalidate_question(question.id)
+        if user is not None:
+            invalidate_author_summaries([user.pk])
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+        queries[name] = record_queries(lambda: client.get(url))
+    return queries
+
+
+def find_full_scans(ignore_tables=()):
+    """
+    Request every polls page and return a {page name: [(table, sql), ...]} dict of the full table scans they caused.
+    """
+    problems = {}
+    for name, queries in page_queries().items():
+        for sql, params in queries:
+            for table in full_table_scans(sql, params):
+                if table not in ignore_tables:
+                    problems.setdefault(name, []).append((table, sql))
+    return problems
@@ -0,0 +1,114 @@
+"""
+Votes over time.
+
+Every flush of the vote buffer also adds its votes to a VoteRollup row per choice for the current minute, in the same
+transaction, so the rollups always agree with the counts. A vote is only ever in one rollup row: downsample() later
+merges minute rows older than MINUTES_KEPT_FOR into hour rows, and hour rows older than HOURS_KEPT_FOR into day rows.
+A timeseries therefore reads a few hundred rows per choice at most, however many votes a question has had.
+
+Buckets are in UTC. Votes counted before the rollups existed (or imported with a count) aren't in any bucket.
+"""
+import datetime
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import constants
+from .models import VoteRollup
+
+PERIODS = (VoteRollup.MINUTE, VoteRollup.HOUR, VoteRollup.DAY)
+
+
+def get_rollup_policy():
+    """
+    Return the (minutes_kept_for, hours_kept_for) pair of timedeltas from the POLLS_VOTE_ROLLUPS setting, falling
+    back to the defaults in constants.py.
+    """
+    policy = getattr(settings, 'POLLS_VOTE_ROLLUPS', {})
+    return (datetime.timedelta(seconds=policy.get('MINUTES_KEPT_FOR', constants.ROLLUP_MINUTES_KEPT_FOR)),
+            datetime.timedelta(seconds=policy.get('HOURS_KEPT_FOR', constants.ROLLUP_HOURS_KEPT_FOR)))
+
+
+def truncate(moment, period):
+    """
+    Return the start of the bucket of the given period that the (aware) datetime falls in.
+    """
+    moment = moment.astimezone(datetime.timezone.utc).replace(second=0, microsecond=0)
+    if period in (VoteRollup.HOUR, VoteRollup.DAY):
+        moment = moment.replace(minute=0)
+    if period == VoteRollup.DAY:
+        moment = moment.replace(hour=0)
+    return moment
+
+
+def add_to_bucket(choice_id, period, bucket, count):
+    """
+    Add `count` votes to the given bucket of a choice, creating the bucket if it doesn't exist yet.
+    """
+    rollups = VoteRollup.objects.filter(choice_id=choice_id, period=period, bucket=bucket)
+    if rollups.update(votes=F('votes') + count):
+        return
+    try:
+        with transaction.atomic():
+            VoteRollup.objects.create(choice_id=choice_id, period=period, bucket=bucket, votes=count)
+    except IntegrityError:
+        # another process created the bucket first
+        rollups.update(votes=F('votes') + count)
+
+
+def add_votes(counts, now=None):
+    """
+    Add the given {(question_id, choice_id): votes} counts to the current minute. Called by apply_votes() within its
+    transaction, so the buckets are updated in the same order as its other rows.
+    """
+    bucket = truncate(now or timezone.now(), VoteRollup.MINUTE)
+    for (question_id, choice_id), n in sorted(counts.items()):
+        add_to_bucket(choice_id, VoteRollup.MINUTE, bucket, n)
+
+
+def _merge(period, into, older_than):
+    """
+    Move the votes of every `period` bucket starting before `older_than` into `into` buckets, and return how many
+    buckets were merged.
+    """
+    with transaction.atomic():
+        rollups = list(VoteRollup.objects.select_for_update().filter(
+            period=period, bucket__lt=older_than
+        ).values_list('pk', 'choice_id', 'bucket', 'votes'))
+        merged = Counter()
+        for pk, choice_id, bucket, votes in rollups:
+            merged[(choice_id, truncate(bucket, into))] += votes
+        for (choice_id, bucket), votes in merged.items():
+            add_to_bucket(choice_id, into, bucket, votes)
+        VoteRollup.objects.filter(pk__in=[rollup[0] for rollup in rollups]).delete()
+    return len(rollups)
+
+
+def downsample(now=None):
+    """
+    Merge minute buckets older than MINUTES_KEPT_FOR into hours and hour buckets older than HOURS_KEPT_FOR into days.
+    Returns how many buckets were merged.
+    """
+    now = now or timezone.now()
+    minutes_kept_for, hours_kept_for = get_rollup_policy()
+    # minutes first, so hours made from them can be merged into days straight away if they are old enough
+    merged = _merge(VoteRollup.MINUTE, VoteRollup.HOUR, now - minutes_kept_for)
+    return merged + _merge(VoteRollup.HOUR, VoteRollup.DAY, now - hours_kept_for)
+
+
+def timeseries(question, period):
+    """
+    Return the question's votes per `period` bucket as a list of (bucket, {choice_id: votes}) pairs in time order.
+    Buckets that have been downsampled to a longer period than asked for are returned at that longer period.
+    """
+    series = defaultdict(Counter)
+    rollups = VoteRollup.objects.filter(choice__question=question).values_list('choice_id', 'period', 'bucket',
+                                                                               'votes')
+    for choice_id, rollup_period, bucket, votes in rollups:
+        if PERIODS.index(rollup_period) < PERIODS.index(period):
+            bucket = truncate(bucket, period)
+        series[bucket][choice_id] += votes
+    return sorted(series.items())
@@ -0,0 +1,85 @@
+"""
+Sending polls reads to read replicas.
+
+With replica database aliases listed in the POLLS_READ_REPLICAS setting, reads of polls models go to a random replica
+and writes go to the default (primary) database. Replicas lag behind the primary, so reads go to the primary instead:
+
+- for the rest of a request (or thread) once it has written anything, so it sees its own writes, including ones made
+  earlier in a transaction (select_for_update() counts as a write, so it is always run on the primary),
+- for STICKY_SECONDS after a request that wrote, through a cookie set by ReadYourWritesMiddleware, so e.g. an author
+  redirected to the index page after creating a question sees it there.
+
+Other apps (users, sessions, admin) always use the primary. Without any replicas the router does nothing.
+
+Pages cached from a replica (see cache.py) may show counts as old as the replica's lag until the question next changes.
+Pages of the index read from a replica are only cached for STICKY_SECONDS, so new questions missing from them soon
+appear.
+
+To try it out locally with two SQLite files, copy a migrated db.sqlite3 to replica.sqlite3 (real replicas get their
+schema and data from the primary, so nothing is ever migrated on them), then add to the settings:
+
+    DATABASES['replica'] = dict(DATABASES['default'], NAME=os.path.join(BASE_DIR, 'replica.sqlite3'),
+                                TEST={'MIRROR': 'default'})
+    POLLS_READ_REPLICAS = {'ALIASES': ['replica']}
+"""
+import random
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from . import constants
+
+# what the current request (or thread) has done: wrote to the primary, or came with the cookie of a recent write
+_state = threading.local()
+
+
+def get_replica_policy():
+    """
+    Return the (aliases, sticky_seconds) pair from the POLLS_READ_REPLICAS setting, falling back to the defaults in
+    constants.py.
+    """
+    policy = getattr(settings, 'POLLS_READ_REPLICAS', {})
+    return (policy.get('ALIASES', constants.READ_REPLICA_ALIASES),
+            policy.get('STICKY_SECONDS', constants.READ_REPLICA_STICKY_SECONDS))
+
+
+def start_request(recently_wrote=False):
+    _state.wrote = False
+    _state.recently_wrote = recently_wrote
+
+
+def has_written():
+    return getattr(_state, 'wrote', False)
+
+
+def reads_from_primary():
+    return has_written() or getattr(_state, 'recently_wrote', False)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        aliases = get_replica_policy()[0]
+        if not aliases or model._meta.app_label != 'polls':
+            return None
+        if reads_from_primary():
+            return DEFAULT_DB_ALIAS
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != 'polls':
+            return None
+        _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same data as the primary
+        databases = {DEFAULT_DB_ALIAS, *get_replica_policy()[0]}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in get_replica_policy()[0]:
+            return False
+        return None
@@ -0,0 +1,129 @@
+"""
+Full-text search of questions by their text and the text of their choices.
+
+The search index is kept up to date by database triggers rather than signals, so questions and choices created with
+bulk_create() or changed with update() are indexed too. Each database has its own index behind the same interface:
+
+- SQLite: an FTS5 table, polls_question_fts, with one row per question (rowid = question id), ranked by bm25.
+- PostgreSQL: polls_question_search, a tsvector per question with a GIN index, ranked by ts_rank with question text
+  weighted above choice text.
+- Anything else (or an SQLite without FTS5): no index, every word has to appear in the question or one of its choices.
+
+The SQLite triggers are created again after every migrate, as SQLite drops them whenever a migration has to rebuild
+the polls_question or polls_choice table.
+"""
+import re
+
+from django.db import connections
+from django.db.models import Q
+
+SQLITE_TABLE = 'polls_question_fts'
+
+SQLITE_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS polls_question_fts_insert AFTER INSERT ON polls_question BEGIN
+        INSERT INTO polls_question_fts (rowid, question_text, choice_text) VALUES (new.id, new.question_text, '');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS polls_question_fts_update AFTER UPDATE OF question_text ON polls_question BEGIN
+        UPDATE polls_question_fts SET question_text = new.question_text WHERE rowid = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS polls_question_fts_delete AFTER DELETE ON polls_question BEGIN
+        DELETE FROM polls_question_fts WHERE rowid = old.id;
+    END
+    """,
+] + [
+    # every change to a choice rebuilds the choice text of its question (both questions, if it was moved)
+    """
+    CREATE TRIGGER IF NOT EXISTS polls_choice_fts_%s AFTER %s ON polls_choice BEGIN
+        UPDATE polls_question_fts SET choice_text = coalesce((SELECT group_concat(choice_text, ' ') FROM polls_choice
+                                                              WHERE question_id = polls_question_fts.rowid), '')
+        WHERE rowid IN (%s);
+    END
+    """ % trigger for trigger in (
+        ('insert', 'INSERT', 'new.question_id'),
+        ('update', 'UPDATE OF choice_text, question_id', 'old.question_id, new.question_id'),
+        ('delete', 'DELETE', 'old.question_id'),
+    )
+]
+
+
+def words(terms):
+    return re.findall(r'\w+', terms)
+
+
+def has_sqlite_index(connection):
+    return SQLITE_TABLE in connection.introspection.table_names()
+
+
+def install_sqlite_triggers(connection):
+    """
+    Create any of the SQLite index's triggers that are missing.
+    """
+    if connection.vendor == 'sqlite' and has_sqlite_index(connection):
+        with connection.cursor() as cursor:
+            for trigger in SQLITE_TRIGGERS:
+                cursor.execute(trigger)
+
+
+class SqliteSearch:
+    def filter(self, queryset, terms):
+        # each word quoted, so nothing typed in is taken as FTS5 query syntax
+        match = ' '.join('"%s"' % word for word in words(terms))
+        return queryset.extra(
+            tables=[SQLITE_TABLE],
+            where=['%s.rowid = polls_question.id' % SQLITE_TABLE, '%s MATCH %%s' % SQLITE_TABLE],
+            params=[match],
+            # bm25 is lower for better matches
+            select={'rank': '%s.rank' % SQLITE_TABLE},
+            order_by=['rank', '-pub_date'],
+        )
+
+
+class PostgresSearch:
+    def filter(self, queryset, terms):
+        query = "plainto_tsquery('english', %s)"
+        return queryset.extra(
+            tables=['polls_question_search'],
+            where=['polls_question_search.question_id = polls_question.id',
+                   'polls_question_search.document @@ ' + query],
+            params=[terms],
+            select={'rank': 'ts_rank(polls_question_search.document, %s)' % query},
+            select_params=[terms],
+            order_by=['-rank', '-pub_date'],
+        )
+
+
+class SubstringSearch:
+    def filter(self, queryset, terms):
+        for word in words(terms):
+            queryset = queryset.filter(Q(question_text__icontains=word) | Q(choice__choice_text__icontains=word))
+        return queryset.distinct().order_by('-pub_date')
+
+
+# database alias -> search backend, worked out on first use
+_backends = {}
+
+
+def get_backend(using):
+    if using not in _backends:
+        connection = connections[using]
+        if connection.vendor == 'postgresql':
+            _backends[using] = PostgresSearch()
+        elif connection.vendor == 'sqlite' and has_sqlite_index(connection):
+            _backends[using] = SqliteSearch()
+        else:
+            _backends[using] = SubstringSearch()
+    return _backends[using]
+
+
+def search(queryset, terms):
+    """
+    Narrow a Question queryset down to the questions matching the search terms, best matches first.
+    """
+    if not words(terms):
+        return queryset.none()
+    return get_backend(queryset.db).filter(queryset, terms)
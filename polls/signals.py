@@ -0,0 +1,76 @@
+from collections import defaultdict
+
+from django.db import connections
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import Signal, receiver
+
+from .cache import (
+    ABOUT_VERSION_KEY, bump_question_versions, bump_version, invalidate_author_summaries, invalidate_question,
+)
+from .models import AboutSection, Choice, Question
+from .pubsub import broker
+from .search import install_sqlite_triggers
+
+# Sent after a batch of votes has been written to the database. `counts` is a {(question_id, choice_id): votes} dict.
+votes_applied = Signal(providing_args=['counts'])
+
+
+def invalidate_authors_of(question_ids):
+    invalidate_author_summaries(Question.objects.filter(pk__in=question_ids).values_list('author_id', flat=True))
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def recount_question_votes(sender, instance, **kwargs):
+    """
+    Choices added, edited or removed outside of the vote path (e.g. in the admin) change the question's total, so
+    recount it.
+    """
+    Question.objects.filter(pk=instance.question_id).rebuild_vote_totals()
+    invalidate_question(instance.question_id)
+    invalidate_authors_of([instance.question_id])
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, **kwargs):
+    invalidate_question(instance.pk)
+    invalidate_author_summaries([instance.author_id])
+
+
+@receiver(post_save, sender=AboutSection)
+@receiver(post_delete, sender=AboutSection)
+def about_changed(sender, instance, **kwargs):
+    bump_version(ABOUT_VERSION_KEY)
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, **kwargs):
+    """
+    SQLite drops a table's triggers when a migration rebuilds it, which would leave the search index behind.
+    """
+    if sender.name == 'polls':
+        install_sqlite_triggers(connections[using])
+
+
+@receiver(votes_applied)
+def votes_changed_results(sender, counts, **kwargs):
+    question_ids = {question_id for question_id, choice_id in counts}
+    bump_question_versions(question_ids)
+    invalidate_authors_of(question_ids)
+
+
+@receiver(votes_applied)
+def publish_votes(sender, counts, **kwargs):
+    """
+    Send the new vote counts of the questions to anyone watching their results live.
+    """
+    question_ids = {question_id for question_id, choice_id in counts if broker.subscriber_count(question_id)}
+    if not question_ids:
+        return
+    # read after the commit, so each count includes this batch and every batch committed before it
+    votes_by_question = defaultdict(dict)
+    for choice in Choice.objects.filter(question__in=question_ids).with_shard_votes():
+        votes_by_question[choice.question_id][choice.id] = choice.current_votes
+    for question_id, votes in votes_by_question.items():
+        broker.publish(question_id, votes)
@@ -0,0 +1,46 @@
+// Voting without leaving the page. The vote is sent to the JSON vote API and the results are shown in place of the
+// form. If that doesn't work, the form is posted the normal way instead.
+
+$(function() {
+
+    var $form = $('form.voting-choices');
+
+    $form.on('submit', function(e) {
+        // with nothing selected, let the normal form post show the error
+        if (!$form.find('input[name="choice"]:checked').length) {
+            return;
+        }
+        e.preventDefault();
+        $.ajax({
+            url: $form.attr('data-api-url') + '?counts=1',
+            method: 'POST',
+            data: $form.serialize(),
+            dataType: 'json'
+        }).done(function(data) {
+            show_results(data.votes);
+        }).fail(function() {
+            $form.off('submit');
+            $form.get(0).submit();
+        });
+    });
+
+    /* Replace the form with a bar for each choice, like on the results page. */
+    function show_results(votes) {
+        var total_votes = 0;
+        $.each(votes, function(choice_id, num_votes) {
+            total_votes += num_votes;
+        });
+        var $results = $('<div class="voting-results"></div>');
+        $form.find('input[name="choice"]').each(function() {
+            var num_votes = votes[$(this).val()] || 0;
+            var percentage = Math.round(num_votes/total_votes * 100).toFixed(2);
+            $results.append($('<h4></h4>').text($(this).next('label').text().trim()));
+            $results.append($('<div class="result"></div>').text(num_votes).css('width', percentage + '%'));
+        });
+        $results.append('<hr />');
+        $results.append($('<button class="btn">See results</button>').click(function() {
+            location.href = $form.attr('data-results-url');
+        }));
+        $form.replaceWith($results);
+    }
+});
@@ -1,15 +1,36 @@
 import datetime
+import json
+import os
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
 
 from django.contrib.auth.models import AnonymousUser, User
 from django.contrib.staticfiles.testing import StaticLiveServerTestCase
-from django.test import TestCase, RequestFactory
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, connections
+from django.test import Client, TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 
 from selenium.webdriver.firefox.webdriver import WebDriver
 
-from .models import Question, Choice
+from .checks import check_shared_cache
+from .metrics import registry
+from .middleware import ReadYourWritesMiddleware
+from .ledger import BloomFilter, VoterIndex, voter_index
+from .models import Question, Choice, ChoiceShard, AboutSection, Vote, VoteRollup
+from .pubsub import Broker, broker
+from .purge import drain_purge_queue, purge_batch, purge_worker
+from . import constants, routers, trending
+from .query_plans import full_table_scans, page_queries
+from .routers import PrimaryReplicaRouter
+from .rollups import downsample, truncate
 from .views import create_question
+from .votes import VoteBuffer, apply_votes, compact_shards, vote_buffer
 
 # Every function/method with a comment that starts with a '*' was copied from the official Django tutorial.
 # The others I created by myself.
@@ -37,6 +58,25 @@ def create_test_choice(question, choice_text, votes):
     return Choice.objects.create(question=question, choice_text=choice_text, votes=votes)
 
 
+class QueryBudgetMixin:
+    """
+    Lets a TestCase check that a page is loaded within a fixed number of database queries.
+    """
+    def assertQueryBudget(self, budget, url):
+        """
+        GET the url and fail if it took more than `budget` queries. Returns the response.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        executed = [query['sql'] for query in queries.captured_queries]
+        self.assertLessEqual(
+            len(executed), budget,
+            "%s ran %d queries (budget is %d):\n%s" % (url, len(executed), budget, '\n'.join(executed))
+        )
+        return response
+
+
 class QuestionModelTests(TestCase):
 
     def test_total_votes_two_choices(self):
@@ -59,6 +99,38 @@ class QuestionModelTests(TestCase):
         create_test_choice(question, "choice4", 7)
         self.assertEqual(question.total_votes(), 18)
 
+    def test_votes_total_follows_choices(self):
+        """
+        The stored votes_total is kept in step with choices that are created, edited and deleted.
+        """
+        question = create_test_question("question", 0)
+        choice1 = create_test_choice(question, "choice1", 7)
+        create_test_choice(question, "choice2", 5)
+        question.refresh_from_db()
+        self.assertEqual(question.votes_total, 12)
+        choice1.votes = 1
+        choice1.save()
+        question.refresh_from_db()
+        self.assertEqual(question.votes_total, 6)
+        choice1.delete()
+        question.refresh_from_db()
+        self.assertEqual(question.votes_total, 5)
+
+    def test_rebuild_vote_totals_command(self):
+        """
+        The rebuild_vote_totals command fixes stored totals that have drifted from the choices.
+        """
+        question = create_test_question("question", 0)
+        create_test_choice(question, "choice1", 7)
+        create_test_choice(question, "choice2", 5)
+        empty_question = create_test_question("empty question", 0)
+        Question.objects.update(votes_total=100)
+        call_command('rebuild_vote_totals', stdout=StringIO())
+        question.refresh_from_db()
+        empty_question.refresh_from_db()
+        self.assertEqual(question.votes_total, 12)
+        self.assertEqual(empty_question.votes_total, 0)
+
     def test_was_published_recently_with_future_question(self):
         """
         *was_published_recently() returns False for questions whose pub_date
@@ -88,6 +160,9 @@ class QuestionModelTests(TestCase):
 
 
 class QuestionIndexViewTests(TestCase):
+    def setUp(self):
+        # pages of the index cached by an earlier test, as nothing here changes a question to make them out of date
+        cache.clear()
 
     def test_no_questions(self):
         """
@@ -156,6 +231,66 @@ class QuestionIndexViewTests(TestCase):
         self.assertContains(response, '39')
 
 
+class QuestionIndexPaginationTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        # 12 questions, the first three published at the same time to check ties are broken by id
+        now = timezone.now()
+        self.questions = [
+            Question.objects.create(question_text="question %d" % i,
+                                    pub_date=now - datetime.timedelta(hours=max(i, 2)))
+            for i in range(12)
+        ]
+
+    def walk(self, cursor=None, direction='next_cursor'):
+        """
+        Follow the cursors from the given page to the end, returning the pages' question texts and the final page.
+        """
+        pages = []
+        while True:
+            response = self.client.get(reverse('polls:index'), {'cursor': cursor} if cursor else {})
+            page = response.context['page_obj']
+            pages.append([question.question_text for question in page])
+            cursor = getattr(page, direction)()
+            if cursor is None:
+                return pages, page
+
+    def test_pages_cover_every_question_once(self):
+        """
+        Following the next links shows every published question exactly once, newest first.
+        """
+        pages, last_page = self.walk()
+        self.assertEqual([len(page) for page in pages], [5, 5, 2])
+        shown = [text for page in pages for text in page]
+        expected = [question.question_text for question in
+                    sorted(self.questions, key=lambda question: (question.pub_date, question.id), reverse=True)]
+        self.assertEqual(shown, expected)
+
+    def test_previous_pages(self):
+        """
+        Following the previous links from the last page shows the same pages in reverse.
+        """
+        forward, last_page = self.walk()
+        backward, first_page = self.walk(last_page.previous_cursor(), 'previous_cursor')
+        self.assertEqual(backward, forward[-2::-1])
+        self.assertFalse(first_page.has_previous())
+
+    def test_deep_page_query_count(self):
+        """
+        A later page takes no more queries than the first, and nothing counts the whole table.
+        """
+        cursor = self.client.get(reverse('polls:index')).context['page_obj'].next_cursor()
+        # questions with authors, choices, and the next scheduled question for how long to cache the page
+        response = self.assertQueryBudget(3, reverse('polls:index') + '?cursor=' + cursor)
+        self.assertEqual(len(response.context['latest_question_list']), 5)
+
+    def test_invalid_cursor(self):
+        """
+        A cursor we didn't make gives a 404.
+        """
+        response = self.client.get(reverse('polls:index'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
 class QuestionDetailViewTests(TestCase):
     def test_future_question(self):
         """
@@ -200,6 +335,1385 @@ class QuestionResultsViewTests(TestCase):
         self.assertContains(response, past_question.question_text)
 
 
+@override_settings(POLLS_VOTE_BUFFER={'MAX_PENDING': 1})
+class QuestionVoteViewTests(TestCase):
+    def test_vote_counted(self):
+        """
+        Voting for a choice adds one vote to it and redirects to the results page.
+        """
+        question = create_test_question("question", -1)
+        choice = create_test_choice(question, "choice1", 3)
+        response = self.client.post(reverse('polls:vote', args=(question.id,)), {'choice': choice.id})
+        self.assertRedirects(response, reverse('polls:results', args=(question.id,)))
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes, 4)
+
+    def test_vote_counted_in_question_total(self):
+        """
+        Voting also adds one to the question's stored votes_total.
+        """
+        question = create_test_question("question", -1)
+        choice = create_test_choice(question, "choice1", 3)
+        self.client.post(reverse('polls:vote', args=(question.id,)), {'choice': choice.id})
+        question.refresh_from_db()
+        self.assertEqual(question.votes_total, 4)
+
+    def test_no_choice_selected(self):
+        """
+        Posting without a choice redisplays the form with an error and counts nothing.
+        """
+        question = create_test_question("question", -1)
+        choice = create_test_choice(question, "choice1", 3)
+        response = self.client.post(reverse('polls:vote', args=(question.id,)))
+        self.assertContains(response, "You didn&#39;t select a choice.")
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes, 3)
+
+
+@override_settings(POLLS_VOTE_BUFFER={'MAX_PENDING': 1})
+class VoteApiTests(TestCase):
+    def setUp(self):
+        self.question = create_test_question("question", -1)
+        self.choice1 = create_test_choice(self.question, "choice1", 3)
+        self.choice2 = create_test_choice(self.question, "choice2", 1)
+        self.url = reverse('polls:vote_api', args=(self.question.id,))
+
+    def test_vote_no_content(self):
+        """
+        A vote is counted and answered with 204 No Content.
+        """
+        response = self.client.post(self.url, {'choice': self.choice1.id})
+        self.assertEqual(response.status_code, 204)
+        self.choice1.refresh_from_db()
+        self.assertEqual(self.choice1.votes, 4)
+
+    def test_vote_with_counts(self):
+        """
+        With ?counts=1 the answer has the votes of every choice, including the new one.
+        """
+        response = self.client.post(self.url + '?counts=1', {'choice': self.choice2.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'accepted': True,
+            'votes': {str(self.choice1.id): 3, str(self.choice2.id): 2},
+        })
+
+    def test_no_choice(self):
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['accepted'], False)
+
+    def test_choice_of_other_question(self):
+        """
+        A choice that belongs to another question is refused and nothing is counted.
+        """
+        other_choice = create_test_choice(create_test_question("other", -1), "other choice", 0)
+        response = self.client.post(self.url, {'choice': other_choice.id})
+        self.assertEqual(response.status_code, 400)
+        other_choice.refresh_from_db()
+        self.assertEqual(other_choice.votes, 0)
+
+    def test_future_question(self):
+        """
+        Unpublished questions can't be voted on.
+        """
+        question = create_test_question("future", 5)
+        choice = create_test_choice(question, "choice", 0)
+        response = self.client.post(reverse('polls:vote_api', args=(question.id,)), {'choice': choice.id})
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_not_allowed(self):
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+    def test_detail_page_uses_api(self):
+        """
+        The detail page's form posts to the old vote view but tells the script about the API.
+        """
+        response = self.client.get(reverse('polls:detail', args=(self.question.id,)))
+        self.assertContains(response, 'action="%s"' % reverse('polls:vote', args=(self.question.id,)))
+        self.assertContains(response, 'data-api-url="%s"' % self.url)
+
+
+@override_settings(POLLS_VOTE_BUFFER={'MAX_PENDING': 1})
+class VoteLedgerTests(TestCase):
+    def setUp(self):
+        self.question = create_test_question("question", -1)
+        self.choice = create_test_choice(self.question, "choice1", 0)
+        self.url = reverse('polls:vote', args=(self.question.id,))
+
+    def assertVotes(self, votes):
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.votes, votes)
+
+    def test_second_vote_refused(self):
+        """
+        Posting the same vote again redisplays the form with an error and isn't counted.
+        """
+        self.client.post(self.url, {'choice': self.choice.id})
+        response = self.client.post(self.url, {'choice': self.choice.id})
+        self.assertContains(response, "You have already voted on this question.")
+        self.assertVotes(1)
+        self.assertEqual(Vote.objects.get().voter, 'session:%s' % self.client.session.session_key)
+
+    def test_second_api_vote_conflicts(self):
+        api_url = reverse('polls:vote_api', args=(self.question.id,))
+        self.client.post(api_url, {'choice': self.choice.id})
+        response = self.client.post(api_url, {'choice': self.choice.id})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['accepted'], False)
+        self.assertVotes(1)
+
+    def test_one_vote_per_user(self):
+        """
+        Signed in users are told apart by their account, not their session, so each gets one vote.
+        """
+        user = User.objects.create_user(username='voter')
+        for _ in range(2):
+            client = Client()
+            client.force_login(user)
+            client.post(self.url, {'choice': self.choice.id})
+        other_user = User.objects.create_user(username='other voter')
+        client = Client()
+        client.force_login(other_user)
+        client.post(self.url, {'choice': self.choice.id})
+        self.assertVotes(2)
+        self.assertEqual(list(Vote.objects.order_by('pk').values_list('voter', flat=True)),
+                         ['user:%d' % user.pk, 'user:%d' % other_user.pk])
+
+    def test_new_voter_needs_no_ledger_query(self):
+        """
+        The filter answers for a voter it hasn't seen, so only the insert into the ledger touches it.
+        """
+        voter_index.build()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(voter_index.claim(self.question.id, self.choice.id, 'new voter'))
+        self.assertEqual([query['sql'].split()[0] for query in queries.captured_queries
+                          if 'polls_vote' in query['sql']], ['INSERT'])
+
+    def test_false_positive_asks_ledger(self):
+        """
+        When the filter wrongly says "maybe", the ledger has the final say.
+        """
+        voter_index.build()
+        bloom = voter_index._get_filter()
+        saved_bits = bloom.bits[:]
+        bloom.bits[:] = b'\xff' * len(bloom.bits)
+        try:
+            self.assertTrue(voter_index.claim(self.question.id, self.choice.id, 'new voter'))
+            self.assertFalse(voter_index.claim(self.question.id, self.choice.id, 'new voter'))
+        finally:
+            bloom.bits[:] = saved_bits
+
+    def test_vote_from_other_process_refused(self):
+        """
+        A vote this process's filter never heard of is still caught by the ledger's unique index.
+        """
+        voter_index.build()
+        Vote.objects.create(question=self.question, choice=self.choice, voter='elsewhere')
+        self.assertFalse(voter_index.claim(self.question.id, self.choice.id, 'elsewhere'))
+
+    def test_ledger_asked_until_filter_built(self):
+        """
+        Checking a vote doesn't wait for the filter to be built, and votes taken meanwhile end up in the filter.
+        """
+        voter_index.reset()
+        with mock.patch.object(VoterIndex, '_start_build') as start_build:
+            with CaptureQueriesContext(connection) as queries:
+                self.assertTrue(voter_index.claim(self.question.id, self.choice.id, 'early voter'))
+            start_build.assert_called_once_with()
+            self.assertFalse(voter_index.claim(self.question.id, self.choice.id, 'early voter'))
+        self.assertEqual([query['sql'].split()[0] for query in queries.captured_queries
+                          if 'polls_vote' in query['sql']], ['SELECT', 'INSERT'])
+        Vote.objects.all().delete()
+        voter_index.build()
+        self.assertIn('%d:early voter' % self.question.id, voter_index._get_filter())
+
+    def test_bloom_filter(self):
+        """
+        The filter never forgets a key and rarely claims to have one it wasn't given.
+        """
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add('voter%d' % i)
+        self.assertTrue(all('voter%d' % i in bloom for i in range(1000)))
+        false_positives = sum('stranger%d' % i in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class VoteBufferTests(TestCase):
+    def tearDown(self):
+        vote_buffer.flush()
+
+    @override_settings(POLLS_VOTE_BUFFER={'MAX_PENDING': 10, 'FLUSH_INTERVAL': 60})
+    def test_votes_held_until_flush(self):
+        """
+        Buffered votes aren't written until the buffer is flushed, then they are written as one increment.
+        """
+        question = create_test_question("question", -1)
+        choice = create_test_choice(question, "choice1", 0)
+        buffer = VoteBuffer()
+        for _ in range(3):
+            buffer.add(question.id, choice.id)
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes, 0)
+        self.assertEqual(buffer.flush(), 3)
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes, 3)
+        self.assertEqual(len(buffer), 0)
+
+    @override_settings(POLLS_VOTE_BUFFER={'MAX_PENDING': 2, 'FLUSH_INTERVAL': 60})
+    def test_flush_when_full(self):
+        """
+        The buffer flushes itself once MAX_PENDING votes are waiting.
+        """
+        question = create_test_question("question", -1)
+        choice1 = create_test_choice(question, "choice1", 0)
+        choice2 = create_test_choice(question, "choice2", 5)
+        buffer = VoteBuffer()
+        buffer.add(question.id, choice1.id)
+        buffer.add(question.id, choice2.id)
+        choice1.refresh_from_db()
+        choice2.refresh_from_db()
+        self.assertEqual((choice1.votes, choice2.votes), (1, 6))
+
+    def test_rows_written_in_key_order(self):
+        """
+        However the votes were buffered, the choices and questions are updated in primary key order, so concurrent
+        flushes can't deadlock.
+        """
+        question1 = create_test_question("question1", -1)
+        question2 = create_test_question("question2", -1)
+        choice1 = create_test_choice(question1, "choice1", 0)
+        choice2 = create_test_choice(question2, "choice2", 0)
+        with CaptureQueriesContext(connection) as queries:
+            apply_votes({(question2.id, choice2.id): 1, (question1.id, choice1.id): 1})
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        choice_updates = [sql for sql in updates if sql.startswith('UPDATE "polls_choice"')]
+        question_updates = [sql for sql in updates if sql.startswith('UPDATE "polls_question"')]
+        self.assertRegex(choice_updates[0], r'"id" = %d\b' % choice1.id)
+        self.assertRegex(question_updates[0], r'"id" = %d\b' % question1.id)
+
+    @override_settings(POLLS_VOTE_BUFFER={'MAX_PENDING': 10, 'FLUSH_INTERVAL': 60})
+    def test_votes_for_deleted_choice_dropped(self):
+        """
+        A vote buffered for a choice that is then deleted is dropped, rather than failing the flush of other votes.
+        """
+        question = create_test_question("question", -1)
+        deleted_choice = create_test_choice(question, "deleted", 0)
+        choice = create_test_choice(question, "choice", 0)
+        sharded_question = create_test_question("sharded question", -1)
+        Question.objects.filter(pk=sharded_question.pk).update(sharded_votes=True)
+        deleted_sharded_choice = create_test_choice(sharded_question, "deleted", 0)
+        buffer = VoteBuffer()
+        buffer.add(question.id, deleted_choice.id)
+        buffer.add(sharded_question.id, deleted_sharded_choice.id)
+        deleted_choice.delete()
+        deleted_sharded_choice.delete()
+        buffer.add(question.id, choice.id)
+        buffer.flush()
+        self.assertEqual(len(buffer), 0)
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes, 1)
+        self.assertEqual(VoteRollup.objects.get().choice, choice)
+        self.assertFalse(ChoiceShard.objects.exists())
+
+    @override_settings(POLLS_VOTE_BUFFER={'MAX_PENDING': 10, 'FLUSH_INTERVAL': 60, 'MAX_ATTEMPTS': 2})
+    def test_failing_votes_retried_then_dropped(self):
+        """
+        A vote that can't be written doesn't hold up the others, and is only retried MAX_ATTEMPTS times.
+        """
+        question = create_test_question("question", -1)
+        good = create_test_choice(question, "good", 0)
+        bad = create_test_choice(question, "bad", 0)
+
+        def apply_or_fail(counts):
+            if (question.id, bad.id) in counts:
+                raise DatabaseError("bad vote")
+            apply_votes(counts)
+
+        buffer = VoteBuffer()
+        buffer.add(question.id, good.id)
+        buffer.add(question.id, bad.id)
+        with mock.patch('polls.votes.apply_votes', side_effect=apply_or_fail):
+            with self.assertRaises(DatabaseError):
+                buffer.flush()
+            good.refresh_from_db()
+            self.assertEqual(good.votes, 1)
+            self.assertEqual(len(buffer), 1)
+            with self.assertRaises(DatabaseError), self.assertLogs('polls.votes', 'ERROR'):
+                buffer.flush()
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(buffer.flush(), 0)
+
+    @override_settings(POLLS_VOTE_BUFFER={'MAX_PENDING': 1, 'FLUSH_INTERVAL': 60})
+    def test_failed_flush_not_raised_into_vote(self):
+        """
+        A vote whose flush fails is still accepted, and stays buffered with a flush scheduled to retry it.
+        """
+        question = create_test_question("question", -1)
+        choice = create_test_choice(question, "choice", 0)
+        with mock.patch('polls.votes.apply_votes', side_effect=DatabaseError("database down")):
+            with self.assertLogs('polls.votes', 'ERROR'):
+                response = self.client.post(reverse('polls:vote', args=(question.id,)), {'choice': choice.id})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(vote_buffer), 1)
+        self.assertIsNotNone(vote_buffer._timer)
+        response = self.client.post(reverse('polls:vote', args=(question.id,)), {'choice': choice.id})
+        self.assertContains(response, "You have already voted on this question.")
+        self.assertEqual(vote_buffer.flush(), 1)
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes, 1)
+
+    def test_forked_buffer_drops_parent_votes(self):
+        """
+        A buffer inherited by a forked worker doesn't write the votes that belong to the parent process.
+        """
+        question = create_test_question("question", -1)
+        choice = create_test_choice(question, "choice1", 0)
+        buffer = VoteBuffer()
+        with override_settings(POLLS_VOTE_BUFFER={'MAX_PENDING': 10, 'FLUSH_INTERVAL': 60}):
+            buffer.add(question.id, choice.id)
+        buffer._pid = -1  # pretend we are now in a child process
+        self.assertEqual(buffer.flush(), 0)
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes, 0)
+
+
+class TrendingTests(QueryBudgetMixin, TestCase):
+    def add_votes(self, question, votes, when):
+        Question.objects.filter(pk=question.pk).update(trending_score=trending.add_votes(votes, when))
+        question.refresh_from_db()
+
+    def test_score_decays(self):
+        """
+        Votes add up, and count half as much after each half-life.
+        """
+        now = timezone.now()
+        half_life = datetime.timedelta(seconds=constants.TRENDING_HALF_LIFE)
+        question = create_test_question("question", -1)
+        self.assertEqual(trending.recent_votes(question.trending_score, now), 0)
+        self.add_votes(question, 3, now - half_life)
+        self.add_votes(question, 1, now)
+        self.assertAlmostEqual(question.trending_score, trending.log_weight(2.5, now))
+        self.assertAlmostEqual(trending.recent_votes(question.trending_score, now), 2.5)
+        self.assertAlmostEqual(trending.recent_votes(question.trending_score, now + half_life), 1.25)
+
+    def test_votes_update_score(self):
+        question = create_test_question("question", -1)
+        sharded_question = create_test_question("sharded question", -1)
+        Question.objects.filter(pk=sharded_question.pk).update(sharded_votes=True)
+        apply_votes({(question.id, create_test_choice(question, "choice", 0).id): 2,
+                     (sharded_question.id, create_test_choice(sharded_question, "choice", 0).id): 1})
+        now = timezone.now()
+        question.refresh_from_db()
+        sharded_question.refresh_from_db()
+        self.assertAlmostEqual(trending.recent_votes(question.trending_score, now), 2, places=3)
+        self.assertAlmostEqual(trending.recent_votes(sharded_question.trending_score, now), 1, places=3)
+
+    def test_trending_page(self):
+        """
+        Questions with recent votes rank above those with more but older votes, and questions never voted on or not
+        yet published aren't listed.
+        """
+        now = timezone.now()
+        old_favourite = create_test_question("old favourite", -30)
+        self.add_votes(old_favourite, 100, now - datetime.timedelta(days=7))
+        new_hit = create_test_question("new hit", -1)
+        self.add_votes(new_hit, 5, now)
+        create_test_question("never voted on", -1)
+        future_question = create_test_question("future question", 5)
+        self.add_votes(future_question, 50, now)
+        response = self.assertQueryBudget(2, reverse('polls:trending'))
+        self.assertEqual([question.question_text for question in response.context['question_list']],
+                         ["new hit", "old favourite"])
+        self.assertEqual([question.recent_votes for question in response.context['question_list']], [5, 0])
+        self.assertContains(response, "about 5 lately")
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    """
+    Every page should take the same number of queries no matter how many polls or choices it shows.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        for i in range(5):
+            question = create_test_question_owned("question %d" % i, self.user)
+            for j in range(4):
+                create_test_choice(question, "choice %d" % j, j)
+        self.question = question
+
+    def test_index(self):
+        # questions with authors, choices, and the next scheduled question for how long to cache the page
+        self.assertQueryBudget(3, reverse('polls:index'))
+        self.assertQueryBudget(0, reverse('polls:index'))
+
+    def test_detail(self):
+        # question, choices
+        self.assertQueryBudget(2, reverse('polls:detail', args=(self.question.id,)))
+
+    def test_results(self):
+        # question, choices
+        self.assertQueryBudget(2, reverse('polls:results', args=(self.question.id,)))
+
+    def test_my_polls(self):
+        # session, user, summary (until it is cached), questions, choices
+        cache.clear()
+        self.client.force_login(self.user)
+        self.assertQueryBudget(5, reverse('polls:my_polls'))
+        self.assertQueryBudget(4, reverse('polls:my_polls'))
+
+
+@override_settings(POLLS_VOTE_BUFFER={'MAX_PENDING': 1}, POLLS_SHARDED_VOTES={'SHARDS': 4, 'AUTO_THRESHOLD': None})
+class ShardedVoteTests(TestCase):
+    def setUp(self):
+        self.question = create_test_question("question", -1)
+        self.question.sharded_votes = True
+        self.question.save()
+        self.choice1 = create_test_choice(self.question, "choice1", 2)
+        self.choice2 = create_test_choice(self.question, "choice2", 1)
+
+    def vote(self, choice, times=1):
+        # a new visitor each time, as each one only gets one vote
+        for _ in range(times):
+            Client().post(reverse('polls:vote', args=(self.question.id,)), {'choice': choice.id})
+
+    def test_votes_go_to_shards(self):
+        """
+        Votes for a sharded question are counted in shards, not on the choice or question rows.
+        """
+        self.vote(self.choice1, 5)
+        self.choice1.refresh_from_db()
+        self.question.refresh_from_db()
+        self.assertEqual(self.choice1.votes, 2)
+        self.assertEqual(self.question.votes_total, 3)
+        self.assertEqual(sum(ChoiceShard.objects.values_list('votes', flat=True)), 5)
+        self.assertLessEqual(ChoiceShard.objects.count(), 4)
+
+    def test_counts_include_shards(self):
+        """
+        The results page and total_votes() count the votes in shards too.
+        """
+        self.vote(self.choice1, 3)
+        self.vote(self.choice2, 2)
+        response = self.client.get(reverse('polls:results', args=(self.question.id,)))
+        self.assertContains(response, 'data-choice-id="%d">5</div>' % self.choice1.id)
+        self.assertContains(response, 'data-choice-id="%d">3</div>' % self.choice2.id)
+        self.assertContains(response, 'var total_votes = 8;')
+        self.assertEqual(self.question.total_votes(), 8)
+        response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, '8 votes')
+
+    def test_compaction(self):
+        """
+        Compacting moves the shard votes into the choice and question rows without changing what is displayed.
+        """
+        self.vote(self.choice1, 3)
+        self.vote(self.choice2, 2)
+        self.assertEqual(compact_shards(), 5)
+        self.choice1.refresh_from_db()
+        self.question.refresh_from_db()
+        self.assertEqual(self.choice1.votes, 5)
+        self.assertEqual(self.question.votes_total, 8)
+        self.assertEqual(self.question.current_votes_total, 8)
+        self.assertFalse(ChoiceShard.objects.filter(votes__gt=0).exists())
+
+    def test_switched_on_above_threshold(self):
+        """
+        A question getting more votes per second than AUTO_THRESHOLD is switched to sharded counting.
+        """
+        question = create_test_question("busy question", -1)
+        choice = create_test_choice(question, "choice", 0)
+        with override_settings(POLLS_SHARDED_VOTES={'SHARDS': 4, 'AUTO_THRESHOLD': 2}):
+            apply_votes({(question.id, choice.id): 5})
+            apply_votes({(question.id, choice.id): 5})
+        question.refresh_from_db()
+        self.assertTrue(question.sharded_votes)
+        self.assertEqual(question.total_votes(), 10)
+
+
+@override_settings(POLLS_VOTE_BUFFER={'MAX_PENDING': 1}, POLLS_SHARDED_VOTES={'SHARDS': 4, 'AUTO_THRESHOLD': None})
+class ResultsCacheTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.question = create_test_question("question", -1)
+        self.choice = create_test_choice(self.question, "choice1", 2)
+        self.url = reverse('polls:results', args=(self.question.id,))
+
+    def vote(self):
+        self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.choice.id})
+
+    def test_cached_results_need_no_queries(self):
+        """
+        The second view of an unchanged results page is served from the cache.
+        """
+        self.client.get(self.url)
+        self.assertQueryBudget(0, self.url)
+
+    def test_vote_invalidates_results(self):
+        """
+        A vote makes the cached results out of date.
+        """
+        self.client.get(self.url)
+        self.vote()
+        response = self.client.get(self.url)
+        self.assertContains(response, 'data-choice-id="%d">3</div>' % self.choice.id)
+
+    def test_edit_invalidates_results(self):
+        """
+        Editing the question in the admin makes the cached results out of date.
+        """
+        self.client.get(self.url)
+        self.question.question_text = "edited question"
+        self.question.save()
+        self.assertContains(self.client.get(self.url), "edited question")
+
+    @override_settings(POLLS_RESULTS_CACHE={'MAX_STALENESS': 60})
+    def test_busy_question_served_stale(self):
+        """
+        A sharded question's cached results are still served for MAX_STALENESS seconds after a vote.
+        """
+        Question.objects.filter(pk=self.question.pk).update(sharded_votes=True)
+        self.client.get(self.url)
+        self.vote()
+        self.assertContains(self.client.get(self.url), 'data-choice-id="%d">2</div>' % self.choice.id)
+        with override_settings(POLLS_RESULTS_CACHE={'MAX_STALENESS': 0}):
+            self.assertContains(self.client.get(self.url), 'data-choice-id="%d">3</div>' % self.choice.id)
+
+
+@override_settings(POLLS_VOTE_BUFFER={'MAX_PENDING': 1}, POLLS_SHARDED_VOTES={'SHARDS': 4, 'AUTO_THRESHOLD': None})
+class ResultsBatchTests(TestCase):
+    def setUp(self):
+        self.question1 = create_test_question("question1", -1)
+        self.choice1 = create_test_choice(self.question1, "choice1", 1)
+        self.choice2 = create_test_choice(self.question1, "choice2", 2)
+        self.question2 = create_test_question("question2", -1)
+        self.choice3 = create_test_choice(self.question2, "choice3", 0)
+        self.url = reverse('polls:results_batch')
+        self.ids = '%d,%d' % (self.question2.id, self.question1.id)
+
+    def test_tallies_in_one_query(self):
+        """
+        Every question's counts and percentages come from a single query (plus one for when any of them that are
+        scheduled go live), and then from the cache.
+        """
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {'ids': self.ids})
+        self.assertEqual(response.json(), {
+            str(self.question1.id): {'total': 3, 'choices': [[self.choice1.id, 1, 33.3], [self.choice2.id, 2, 66.7]]},
+            str(self.question2.id): {'total': 0, 'choices': [[self.choice3.id, 0, 0]]},
+        })
+        with self.assertNumQueries(0):
+            self.client.get(self.url, {'ids': self.ids})
+
+    def test_includes_shard_votes(self):
+        Question.objects.filter(pk=self.question1.pk).update(sharded_votes=True)
+        apply_votes({(self.question1.id, self.choice1.id): 1})
+        response = self.client.get(self.url, {'ids': self.question1.id})
+        self.assertEqual(response.json()[str(self.question1.id)]['choices'][0], [self.choice1.id, 2, 50.0])
+
+    def test_etag_changes_with_votes(self):
+        etag = self.client.get(self.url, {'ids': self.ids})['ETag']
+        self.assertEqual(self.client.get(self.url, {'ids': self.ids}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # the same questions in another order are the same request
+        reordered = '%d,%d' % (self.question1.id, self.question2.id)
+        self.assertEqual(self.client.get(self.url, {'ids': reordered}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.client.post(reverse('polls:vote', args=(self.question1.id,)), {'choice': self.choice1.id})
+        response = self.client.get(self.url, {'ids': self.ids}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[str(self.question1.id)]['total'], 4)
+
+    def test_unpublished_and_missing_left_out(self):
+        future_question = create_test_question("future", 5)
+        create_test_choice(future_question, "choice", 0)
+        response = self.client.get(self.url, {'ids': '%d,%d,0' % (self.question2.id, future_question.id)})
+        self.assertEqual(list(response.json()), [str(self.question2.id)])
+
+    def test_scheduled_question_shown_once_published(self):
+        """
+        The answer leaving out a scheduled question isn't cached (or 304'd) past the time it goes live.
+        """
+        future_question = create_test_question("future", 1)
+        create_test_choice(future_question, "choice", 0)
+        ids = '%d,%d' % (self.question2.id, future_question.id)
+        response = self.client.get(self.url, {'ids': ids})
+        self.assertEqual(list(response.json()), [str(self.question2.id)])
+        self.assertFalse(response.has_header('ETag'))
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + datetime.timedelta(days=2)):
+            response = self.client.get(self.url, {'ids': ids})
+        self.assertEqual(sorted(response.json()), sorted([str(self.question2.id), str(future_question.id)]))
+        self.assertTrue(response.has_header('ETag'))
+
+    def test_bad_ids(self):
+        for ids in ('', '1,a', ','.join(str(i) for i in range(101))):
+            self.assertEqual(self.client.get(self.url, {'ids': ids}).status_code, 400)
+
+
+@override_settings(POLLS_VOTE_BUFFER={'MAX_PENDING': 1})
+class PageCacheTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.question = create_test_question("question", -1)
+        self.choice = create_test_choice(self.question, "choice1", 2)
+
+    def test_index_card_cached_until_question_changes(self):
+        """
+        A question's card on the index page is cached until the question is changed or voted on.
+        """
+        url = reverse('polls:index')
+        self.client.get(url)
+        # a change that doesn't send signals isn't noticed...
+        Choice.objects.filter(pk=self.choice.pk).update(choice_text="renamed")
+        self.assertNotContains(self.client.get(url), "renamed")
+        # ...but saving it is
+        self.choice.choice_text = "renamed"
+        self.choice.save()
+        self.assertContains(self.client.get(url), "renamed")
+        self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.choice.id})
+        self.assertContains(self.client.get(url), "3 votes")
+
+    def test_about_page_cached_until_section_changes(self):
+        """
+        The About page's sections are only queried again once one of them has changed.
+        """
+        url = reverse('polls:about')
+        section = AboutSection.objects.create(title="About", content="first", display_order=1)
+        self.client.get(url)
+        self.assertContains(self.assertQueryBudget(0, url), "first")
+        section.content = "second"
+        section.save()
+        self.assertContains(self.client.get(url), "second")
+        section.delete()
+        self.assertContains(self.client.get(url), "Cannot find 'About' information.")
+
+
+@override_settings(POLLS_VOTE_BUFFER={'MAX_PENDING': 1}, POLLS_PURGE={'DELAY': None})
+class PublishedCacheTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.question = create_test_question("question", -1)
+        self.choice = create_test_choice(self.question, "choice1", 2)
+        self.index_url = reverse('polls:index')
+
+    def index_questions(self):
+        return [question.question_text for question in self.client.get(self.index_url).context['latest_question_list']]
+
+    def test_index_cached(self):
+        self.client.get(self.index_url)
+        self.assertContains(self.assertQueryBudget(0, self.index_url), "question")
+
+    def test_index_refreshed_when_questions_change(self):
+        self.client.get(self.index_url)
+        create_test_question("new question", -1)
+        self.assertEqual(self.index_questions(), ["new question", "question"])
+        self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.choice.id})
+        self.assertContains(self.client.get(self.index_url), "3 votes")
+
+    def test_scheduled_question_published_on_time(self):
+        """
+        A cached page is only used until the next scheduled question's pub_date, however long it could be cached for.
+        """
+        scheduled = Question.objects.create(question_text="scheduled",
+                                            pub_date=timezone.now() + datetime.timedelta(seconds=0.5))
+        create_test_question("much later", 30)
+        detail_url = reverse('polls:detail', args=(scheduled.id,))
+        self.assertEqual(self.index_questions(), ["question"])
+        self.assertEqual(self.client.get(detail_url).status_code, 404)
+        self.assertEqual(self.client.get(reverse('polls:results', args=(scheduled.id,))).status_code, 404)
+        time.sleep(0.5)
+        self.assertEqual(self.index_questions(), ["scheduled", "question"])
+        self.assertEqual(self.client.get(detail_url).status_code, 200)
+        self.assertEqual(self.client.get(reverse('polls:results', args=(scheduled.id,))).status_code, 200)
+
+    def test_detail_cached_until_question_changes(self):
+        url = reverse('polls:detail', args=(self.question.id,))
+        self.client.get(url)
+        # votes don't change the page
+        Client().post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.choice.id})
+        self.assertQueryBudget(0, url)
+        self.choice.choice_text = "renamed"
+        self.choice.save()
+        self.assertContains(self.client.get(url), "renamed")
+
+    def test_deleted_question_gone_at_once(self):
+        user = User.objects.create_user(username='testuser', password='testpass')
+        Question.objects.filter(pk=self.question.pk).update(author=user)
+        self.client.get(self.index_url)
+        self.client.get(reverse('polls:detail', args=(self.question.id,)))
+        self.client.force_login(user)
+        self.client.get(reverse('polls:delete', args=(self.question.id,)))
+        self.assertEqual(self.index_questions(), [])
+        self.assertEqual(self.client.get(reverse('polls:detail', args=(self.question.id,))).status_code, 404)
+
+
+@override_settings(POLLS_VOTE_BUFFER={'MAX_PENDING': 1})
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.question = create_test_question("question", -1)
+        self.choice = create_test_choice(self.question, "choice1", 2)
+
+    def revalidate(self, url, etag):
+        """
+        GET the url as a browser that already has the page with the given ETag, counting the queries run.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        return response, len(queries.captured_queries)
+
+    def test_unchanged_pages_not_modified(self):
+        """
+        Revalidating an unchanged detail or results page answers 304 without touching the database.
+        """
+        for name in ('polls:detail', 'polls:results'):
+            url = reverse(name, args=(self.question.id,))
+            etag = self.client.get(url)['ETag']
+            response, queries = self.revalidate(url, etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(queries, 0)
+
+    def test_vote_changes_etag(self):
+        """
+        After a vote the results page is sent again in full.
+        """
+        url = reverse('polls:results', args=(self.question.id,))
+        etag = self.client.get(url)['ETag']
+        self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.choice.id})
+        response, _ = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_vote_keeps_detail_etag(self):
+        """
+        Votes don't change the voting page, so it is still revalidated after one, but not after the question changes.
+        """
+        url = reverse('polls:detail', args=(self.question.id,))
+        etag = self.client.get(url)['ETag']
+        Client().post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.choice.id})
+        self.assertEqual(self.revalidate(url, etag)[0].status_code, 304)
+        self.question.question_text = "renamed"
+        self.question.save()
+        self.assertEqual(self.revalidate(url, etag)[0].status_code, 200)
+
+    def test_etag_depends_on_user(self):
+        """
+        A page fetched by one user isn't revalidated for another, as the navigation bar shows who is signed in.
+        """
+        url = reverse('polls:results', args=(self.question.id,))
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(User.objects.create_user(username='voter'))
+        response, _ = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_unpublished_question_has_no_etag(self):
+        """
+        A 404 for a question that isn't published yet isn't given an ETag, so it can't be revalidated later.
+        """
+        future_question = create_test_question("future question", 5)
+        response = self.client.get(reverse('polls:detail', args=(future_question.id,)))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+
+@override_settings(POLLS_READ_REPLICAS={'ALIASES': ['replica'], 'STICKY_SECONDS': 5})
+class ReadReplicaTests(TestCase):
+    """
+    Runs with a second, empty SQLite database as the replica, so anything read from it is plainly missing.
+    """
+    databases = {'default', 'replica'}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.replica_file = tempfile.NamedTemporaryFile(suffix='.sqlite3', delete=False)
+        connections.databases['replica'] = dict(connections.databases['default'], NAME=cls.replica_file.name)
+        with connections['replica'].schema_editor() as schema_editor:
+            for model in (User, Question, Choice, ChoiceShard):
+                schema_editor.create_model(model)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections.databases['replica']
+        del connections._connections.replica
+        os.remove(cls.replica_file.name)
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.user = User.objects.create_user(username='author', password='password')
+        routers.start_request()
+
+    def tearDown(self):
+        routers.start_request()
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.router.db_for_read(Question), 'replica')
+        self.assertIsNone(self.router.db_for_read(User))
+        self.assertFalse(self.router.allow_migrate('replica', 'polls'))
+        create_test_question("question", -1)
+        self.assertContains(self.client.get(reverse('polls:index')), "No polls are available.")
+
+    def test_reads_after_write_go_to_primary(self):
+        self.assertEqual(self.router.db_for_write(Question), 'default')
+        self.assertEqual(self.router.db_for_read(Question), 'default')
+
+    def test_read_your_writes(self):
+        """
+        An author sees their new question on the index page they are redirected to, though the replica hasn't got it.
+        """
+        self.client.login(username='author', password='password')
+        response = self.client.post(reverse('polls:create'), {
+            'question_text': 'New question', 'form-TOTAL_FORMS': '2', 'form-INITIAL_FORMS': '0',
+            'form-MIN_NUM_FORMS': '0', 'form-MAX_NUM_FORMS': '1000',
+            'form-0-choice_text': 'Yes', 'form-1-choice_text': 'No',
+        }, follow=True)
+        self.assertContains(response, "New question")
+        self.assertEqual(response.redirect_chain[0][1], 302)
+        self.assertEqual(self.client.cookies[ReadYourWritesMiddleware.cookie_name]['max-age'], 5)
+        # once the cookie has expired, reads go back to the replica (and not to the index page cached from the primary)
+        del self.client.cookies[ReadYourWritesMiddleware.cookie_name]
+        self.assertNotContains(self.client.get(reverse('polls:index')), "New question")
+
+    def test_read_your_writes_not_served_from_replica_cache(self):
+        """
+        An index page cached from the replica isn't shown to an author who has just created a question.
+        """
+        self.client.login(username='author', password='password')
+        self.client.post(reverse('polls:create'), {
+            'question_text': 'New question', 'form-TOTAL_FORMS': '2', 'form-INITIAL_FORMS': '0',
+            'form-MIN_NUM_FORMS': '0', 'form-MAX_NUM_FORMS': '1000',
+            'form-0-choice_text': 'Yes', 'form-1-choice_text': 'No',
+        })
+        self.assertNotContains(Client().get(reverse('polls:index')), "New question")
+        self.assertContains(self.client.get(reverse('polls:index')), "New question")
+
+    def test_compaction_reads_primary(self):
+        """
+        Compacting takes the shard votes from the primary, not from a replica that may be behind it.
+        """
+        question = create_test_question("question", -1)
+        choice = create_test_choice(question, "choice", 0)
+        ChoiceShard.objects.create(choice=choice, shard=0, votes=3)
+        routers.start_request()
+        self.assertEqual(compact_shards(), 3)
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes, 3)
+
+    def test_no_cookie_without_replicas(self):
+        self.client.login(username='author', password='password')
+        with override_settings(POLLS_READ_REPLICAS={'ALIASES': []}):
+            self.client.post(reverse('polls:create'), {
+                'question_text': 'New question', 'form-TOTAL_FORMS': '1', 'form-INITIAL_FORMS': '0',
+                'form-MIN_NUM_FORMS': '0', 'form-MAX_NUM_FORMS': '1000', 'form-0-choice_text': 'Yes',
+            })
+        self.assertNotIn(ReadYourWritesMiddleware.cookie_name, self.client.cookies)
+
+
+class QueryPlanTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='testuser', password='testpass')
+        for i in range(20):
+            question = Question.objects.create(question_text="question %d" % i, author=user,
+                                               pub_date=timezone.now() - datetime.timedelta(hours=i))
+            for j in range(3):
+                create_test_choice(question, "choice %d" % j, j)
+
+    def test_pages_use_indexes(self):
+        """
+        None of the polls pages make the database read a whole table.
+        """
+        out = StringIO()
+        call_command('check_query_plans', stdout=out, stderr=StringIO())
+        self.assertIn("No full table scans found.", out.getvalue())
+
+    def test_pages_not_served_from_cache(self):
+        """
+        Every page is checked by the queries it really runs, even when the check has just requested it.
+        """
+        page_queries()
+        for name, queries in page_queries().items():
+            with self.subTest(page=name):
+                self.assertTrue([sql for sql, params in queries if 'polls_' in sql])
+
+    def test_full_scan_detected(self):
+        """
+        A query that can't use an index is reported as a full table scan.
+        """
+        sql, params = Choice.objects.filter(choice_text='choice 1').query.sql_with_params()
+        self.assertEqual(full_table_scans(sql, params), ['polls_choice'])
+
+    def test_no_questions(self):
+        """
+        The check refuses to pass when there is nothing to check the pages with.
+        """
+        Question.objects.all().delete()
+        with self.assertRaises(CommandError):
+            call_command('check_query_plans', stdout=StringIO(), stderr=StringIO())
+
+
+class SearchTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.url = reverse('polls:search')
+
+    def search(self, terms):
+        return [question.question_text for question in Question.objects.search(terms)]
+
+    def test_matches_question_and_choice_text(self):
+        """
+        Questions are found by their own words and their choices' words, including choices made with bulk_create().
+        """
+        question = create_test_question("Favourite cheese?", -1)
+        other = create_test_question("Best pet?", -1)
+        Choice.objects.bulk_create([Choice(question=other, choice_text="Cat"),
+                                    Choice(question=other, choice_text="Dog")])
+        self.assertEqual(self.search("cheese"), ["Favourite cheese?"])
+        self.assertEqual(self.search("dog"), ["Best pet?"])
+        self.assertEqual(self.search("cheese dog"), [])
+        Question.objects.filter(pk=question.pk).update(question_text="Favourite bread?")
+        Choice.objects.filter(question=other, choice_text="Dog").delete()
+        self.assertEqual(self.search("cheese"), [])
+        self.assertEqual(self.search("dog"), [])
+        self.assertEqual(self.search("bread"), ["Favourite bread?"])
+        question.delete()
+        self.assertEqual(self.search("bread"), [])
+
+    def test_ranked_and_stemmed(self):
+        create_test_choice(create_test_question("Lunch?", -1), "Running late, skip it", 0)
+        create_test_question("Run or walk? Running is faster", -1)
+        self.assertEqual(self.search("runs"), ["Run or walk? Running is faster", "Lunch?"])
+
+    def test_query_syntax_is_not_interpreted(self):
+        create_test_question("Cats OR dogs?", -1)
+        self.assertEqual(self.search('"cats OR -* ('), ["Cats OR dogs?"])
+        self.assertEqual(self.search('"*'), [])
+
+    def test_search_page(self):
+        """
+        The search page shows published matches only, a page at a time.
+        """
+        for i in range(7):
+            create_test_choice(create_test_question("Poll %d" % i, -1), "shared choice", 0)
+        create_test_choice(create_test_question("Future poll", 5), "shared choice", 0)
+        response = self.assertQueryBudget(3, self.url + '?q=shared')
+        self.assertEqual(len(response.context['question_list']), 5)
+        self.assertNotContains(response, "Future poll")
+        response = self.client.get(self.url, {'q': 'shared', 'page': 2})
+        self.assertEqual(len(response.context['question_list']), 2)
+        self.assertContains(self.client.get(self.url, {'q': 'nothing'}), "No polls match")
+        self.assertQueryBudget(0, self.url)
+
+    def test_admin_search(self):
+        create_test_choice(create_test_question("Favourite cheese?", -1), "Brie", 0)
+        create_test_question("Best pet?", -1)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get(reverse('admin:polls_question_changelist'), {'q': 'brie'})
+        self.assertEqual([question.question_text for question in response.context['cl'].result_list],
+                         ["Favourite cheese?"])
+
+
+class BrokerTests(TestCase):
+    def test_votes_coalesced(self):
+        """
+        Counts published before a subscriber reads them are handed over as one set of new votes.
+        """
+        broker = Broker()
+        subscription = broker.subscribe(1)
+        other_question = broker.subscribe(2)
+        subscription.start({10: 5, 11: 0})
+        broker.publish(1, {10: 6, 11: 0})
+        broker.publish(1, {10: 8, 11: 1})
+        self.assertEqual(subscription.get(timeout=0), {10: 3, 11: 1})
+        self.assertEqual(subscription.get(timeout=0), {})
+        self.assertEqual(other_question.get(timeout=0), {})
+
+    def test_counts_already_sent_ignored(self):
+        """
+        Counts the subscriber started with, or older than ones already published, add no votes.
+        """
+        broker = Broker()
+        subscription = broker.subscribe(1)
+        broker.publish(1, {10: 4})
+        subscription.start({10: 4})
+        broker.publish(1, {10: 3})
+        self.assertEqual(subscription.get(timeout=0), {})
+
+    def test_unsubscribe(self):
+        broker = Broker()
+        subscription = broker.subscribe(1)
+        self.assertEqual(broker.subscriber_count(1), 1)
+        broker.unsubscribe(subscription)
+        self.assertEqual(broker.subscriber_count(1), 0)
+
+
+@override_settings(POLLS_PURGE={'DELAY': None})
+class MyPollsTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        # user ids are reused from test to test, but the summaries cached for them aren't rolled back
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_login(self.user)
+        self.url = reverse('polls:my_polls')
+
+    def create_question(self, question_text, votes, days=0):
+        question = Question.objects.create(question_text=question_text, author=self.user,
+                                           pub_date=timezone.now() + datetime.timedelta(days=days))
+        create_test_choice(question, "choice", votes)
+        return question
+
+    def test_summary(self):
+        self.create_question("quiet", 2, days=-2)
+        self.create_question("busy", 7, days=-1)
+        self.create_question("new", 0)
+        create_test_choice(create_test_question("someone else's", -1), "choice", 100)
+        summary = self.client.get(self.url).context['summary']
+        self.assertEqual(summary['polls'], 3)
+        self.assertEqual(summary['votes'], 9)
+        self.assertEqual(summary['most_active'][1:], ("busy", 7))
+
+    def test_summary_no_polls(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['summary'], {'polls': 0, 'votes': 0, 'most_active': None})
+        self.assertContains(response, "You have no polls!")
+
+    def test_summary_counts_sharded_votes(self):
+        question = self.create_question("sharded", 1)
+        ChoiceShard.objects.create(choice=question.choice_set.get(), shard=0, votes=4)
+        self.assertEqual(self.client.get(self.url).context['summary']['votes'], 5)
+
+    @override_settings(POLLS_VOTE_BUFFER={'MAX_PENDING': 1})
+    def test_summary_updated_by_votes(self):
+        question = self.create_question("question", 0)
+        self.assertIsNone(self.client.get(self.url).context['summary']['most_active'])
+        # cached from now on
+        self.assertQueryBudget(4, self.url)
+        Client().post(reverse('polls:vote', args=(question.id,)), {'choice': question.choice_set.get().id})
+        self.assertEqual(self.client.get(self.url).context['summary']['most_active'], (question.id, "question", 1))
+
+    def test_summary_updated_by_delete(self):
+        question = self.create_question("question", 3)
+        self.assertEqual(self.client.get(self.url).context['summary']['polls'], 1)
+        self.client.get(reverse('polls:delete', args=(question.id,)))
+        self.assertEqual(self.client.get(self.url).context['summary'], {'polls': 0, 'votes': 0, 'most_active': None})
+
+    def test_paginated(self):
+        per_page = constants.MY_POLLS_PER_PAGE
+        questions = [self.create_question("question %d" % i, i, days=-i) for i in range(per_page + 3)]
+        response = self.client.get(self.url)
+        self.assertEqual(list(response.context['questions']), questions[:per_page])
+        self.assertEqual(response.context['summary']['polls'], len(questions))
+        response = self.client.get(self.url, {'cursor': response.context['page_obj'].next_cursor()})
+        self.assertEqual(list(response.context['questions']), questions[per_page:])
+        self.assertFalse(response.context['page_obj'].has_next())
+
+
+@override_settings(POLLS_PURGE={'DELAY': None, 'PAUSE': 0})
+class QuestionAdminTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.admin)
+        self.changelist_url = reverse('admin:polls_question_changelist')
+
+    def create_questions(self, number):
+        questions = []
+        for i in range(number):
+            question = create_test_question_owned("question %d" % i, self.admin)
+            create_test_choice(question, "choice1", i)
+            create_test_choice(question, "choice2", 1)
+            questions.append(question)
+        return questions
+
+    def test_changelist_queries_dont_grow_with_questions(self):
+        """
+        The changelist shows each question's author and votes without a query per question.
+        """
+        self.create_questions(2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(self.changelist_url)
+        self.create_questions(10)
+        response = self.assertQueryBudget(len(few.captured_queries), self.changelist_url)
+        self.assertContains(response, '<td class="field-votes">10</td>', html=True)
+        self.assertContains(response, '<td class="field-author nowrap">admin</td>', html=True)
+
+    def test_changelist_uses_estimated_count(self):
+        """
+        Past ADMIN_ESTIMATED_COUNT_ABOVE the changelist doesn't count the questions.
+        """
+        self.create_questions(3)
+        with mock.patch.object(constants, 'ADMIN_ESTIMATED_COUNT_ABOVE', 0):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.changelist_url)
+        self.assertEqual(response.context['cl'].result_count, 3)
+        self.assertFalse([query for query in queries.captured_queries if 'COUNT(' in query['sql']])
+
+    def test_filtered_changelist_counted_exactly(self):
+        self.create_questions(3)
+        create_test_question("future question", 30)
+        with mock.patch.object(constants, 'ADMIN_ESTIMATED_COUNT_ABOVE', 0):
+            response = self.client.get(self.changelist_url, {'q': "question"})
+        self.assertEqual(response.context['cl'].result_count, 4)
+
+    def run_action(self, action, questions):
+        return self.client.post(self.changelist_url, {
+            'action': action, '_selected_action': [question.pk for question in questions], 'post': 'yes',
+        })
+
+    def test_actions_queries_dont_grow_with_questions(self):
+        for action in ('reset_votes', 'unpublish', 'republish', 'delete_selected'):
+            with self.subTest(action=action):
+                few_questions, many_questions = self.create_questions(2), self.create_questions(10)
+                with CaptureQueriesContext(connection) as few:
+                    self.run_action(action, few_questions)
+                with CaptureQueriesContext(connection) as many:
+                    self.run_action(action, many_questions)
+                self.assertLessEqual(len(many.captured_queries), len(few.captured_queries))
+
+    def test_reset_votes(self):
+        question, other = self.create_questions(2)
+        Vote.objects.create(question=question, choice=question.choice_set.first(), voter='session:abc')
+        apply_votes({(question.id, question.choice_set.first().id): 2})
+        self.run_action('reset_votes', [question])
+        question.refresh_from_db()
+        self.assertEqual(question.votes_total, 0)
+        self.assertEqual(question.trending_score, constants.TRENDING_NO_VOTES)
+        self.assertEqual([choice.votes for choice in question.choice_set.all()], [0, 0])
+        self.assertFalse(Vote.objects.filter(question=question).exists())
+        self.assertFalse(VoteRollup.objects.filter(choice__question=question).exists())
+        other.refresh_from_db()
+        self.assertEqual(other.votes_total, 2)
+
+    def test_unpublish(self):
+        """
+        Unpublished questions are hidden until they are republished, and keep their pub_date meanwhile.
+        """
+        question, other = self.create_questions(2)
+        pub_date = question.pub_date
+        self.run_action('unpublish', [question])
+        self.assertEqual(self.client.get(reverse('polls:detail', args=(question.id,))).status_code, 404)
+        self.assertEqual(self.client.get(reverse('polls:detail', args=(other.id,))).status_code, 200)
+        self.assertEqual(list(self.client.get(reverse('polls:index')).context['latest_question_list']), [other])
+        question.refresh_from_db()
+        self.assertEqual(question.pub_date, pub_date)
+        self.run_action('republish', [question])
+        self.assertEqual(self.client.get(reverse('polls:detail', args=(question.id,))).status_code, 200)
+
+    def test_unpublished_question_not_scheduled(self):
+        """
+        An unpublished question due to be published later doesn't count as the next one to go live.
+        """
+        question = create_test_question("future question", 5)
+        self.run_action('unpublish', [question])
+        self.assertIsNone(Question.objects.next_pub_date())
+
+    def test_delete_selected(self):
+        question, other = self.create_questions(2)
+        Vote.objects.create(question=question, choice=question.choice_set.first(), voter='session:abc')
+        confirmation = self.client.post(self.changelist_url, {
+            'action': 'delete_selected', '_selected_action': [question.pk],
+        })
+        self.assertContains(confirmation, "<li>Choices: 2</li>", html=True)
+        self.assertContains(confirmation, "<li>Votes: 1</li>", html=True)
+        self.assertTrue(Question.objects.filter(pk=question.pk).exists())
+        self.run_action('delete_selected', [question])
+        self.assertFalse(Question.objects.filter(pk=question.pk).exists())
+        drain_purge_queue()
+        self.assertFalse(Question.all_objects.filter(pk=question.pk).exists())
+        self.assertFalse(Choice.objects.filter(question_id=question.pk).exists())
+        self.assertFalse(Vote.objects.filter(question_id=question.pk).exists())
+        self.assertTrue(Question.objects.filter(pk=other.pk).exists())
+
+    def test_delete_question(self):
+        """
+        Deleting one question from its change page soft deletes it, and the confirmation only counts its votes.
+        """
+        question = self.create_questions(1)[0]
+        Vote.objects.create(question=question, choice=question.choice_set.first(), voter='session:abc')
+        delete_url = reverse('admin:polls_question_delete', args=(question.pk,))
+        confirmation = self.client.get(delete_url)
+        self.assertContains(confirmation, "<li>Votes: 1</li>", html=True)
+        self.assertNotContains(confirmation, "session:abc")
+        self.client.post(delete_url, {'post': 'yes'})
+        self.assertFalse(Question.objects.filter(pk=question.pk).exists())
+        self.assertTrue(Question.all_objects.filter(pk=question.pk).exists())
+        self.assertTrue(Vote.objects.filter(question_id=question.pk).exists())
+
+    def test_editing_choices_keeps_votes(self):
+        """
+        Saving a question in the admin doesn't overwrite votes counted since the form was loaded.
+        """
+        question = self.create_questions(1)[0]
+        choice1, choice2 = question.choice_set.order_by('pk')
+        Choice.objects.filter(pk=choice1.pk).update(votes=5)
+        self.client.post(reverse('admin:polls_question_change', args=(question.pk,)), {
+            'question_text': "renamed", 'pub_date_0': '2018-01-01', 'pub_date_1': '00:00:00', 'sharded_votes': '',
+            'choice_set-TOTAL_FORMS': 3, 'choice_set-INITIAL_FORMS': 2, 'choice_set-MAX_NUM_FORMS': 1000,
+            'choice_set-0-id': choice1.pk, 'choice_set-0-question': question.pk, 'choice_set-0-choice_text': "one",
+            'choice_set-1-id': choice2.pk, 'choice_set-1-question': question.pk, 'choice_set-1-choice_text': "two",
+            'choice_set-2-question': question.pk, 'choice_set-2-choice_text': "three",
+        })
+        self.assertEqual(list(question.choice_set.order_by('pk').values_list('choice_text', 'votes')),
+                         [("one", 5), ("two", 1), ("three", 0)])
+
+
+class VoteRollupTests(TestCase):
+    def setUp(self):
+        self.question = create_test_question("question", -1)
+        self.choice1 = create_test_choice(self.question, "choice1", 0)
+        self.choice2 = create_test_choice(self.question, "choice2", 0)
+        self.url = reverse('polls:results_timeseries', args=(self.question.id,))
+
+    def test_votes_counted_in_current_minute(self):
+        apply_votes({(self.question.id, self.choice1.id): 3, (self.question.id, self.choice2.id): 1})
+        apply_votes({(self.question.id, self.choice1.id): 2})
+        rollup = VoteRollup.objects.get(choice=self.choice1)
+        self.assertEqual(rollup.period, VoteRollup.MINUTE)
+        self.assertEqual(rollup.bucket, truncate(timezone.now(), VoteRollup.MINUTE))
+        self.assertEqual(rollup.votes, 5)
+
+    def test_downsample(self):
+        """
+        Old minutes are merged into hours and old hours into days, without losing any votes.
+        """
+        apply_votes({(self.question.id, self.choice1.id): 3, (self.question.id, self.choice2.id): 1})
+        self.assertEqual(downsample(), 0)
+        downsample(now=timezone.now() + datetime.timedelta(days=2))
+        self.assertEqual(set(VoteRollup.objects.values_list('period', flat=True)), {VoteRollup.HOUR})
+        call_command('downsample_vote_rollups', stdout=StringIO())
+        downsample(now=timezone.now() + datetime.timedelta(days=60))
+        self.assertEqual(dict(VoteRollup.objects.values_list('choice', 'votes')),
+                         {self.choice1.id: 3, self.choice2.id: 1})
+        self.assertEqual(set(VoteRollup.objects.values_list('period', flat=True)), {VoteRollup.DAY})
+
+    def test_timeseries(self):
+        """
+        The timeseries adds up the buckets into the asked for period, and leaves coarser buckets as they are.
+        """
+        day = datetime.datetime(2018, 2, 1, tzinfo=datetime.timezone.utc)
+        VoteRollup.objects.create(choice=self.choice1, period=VoteRollup.DAY, bucket=day, votes=4)
+        for minute in (1, 2):
+            VoteRollup.objects.create(choice=self.choice1, period=VoteRollup.MINUTE,
+                                      bucket=day + datetime.timedelta(days=1, minutes=minute), votes=1)
+        VoteRollup.objects.create(choice=self.choice2, period=VoteRollup.MINUTE,
+                                  bucket=day + datetime.timedelta(days=1), votes=5)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(response.json(), {'period': 'hour', 'series': [
+            {'time': '2018-02-01T00:00:00+00:00', 'votes': {str(self.choice1.id): 4}},
+            {'time': '2018-02-02T00:00:00+00:00', 'votes': {str(self.choice1.id): 2, str(self.choice2.id): 5}},
+        ]})
+        minutes = self.client.get(self.url, {'period': 'minute'}).json()['series']
+        self.assertEqual([point['time'] for point in minutes], [
+            '2018-02-01T00:00:00+00:00', '2018-02-02T00:00:00+00:00', '2018-02-02T00:01:00+00:00',
+            '2018-02-02T00:02:00+00:00',
+        ])
+
+    def test_bad_period(self):
+        self.assertEqual(self.client.get(self.url, {'period': 'week'}).status_code, 400)
+
+    def test_future_question(self):
+        question = create_test_question("future", 5)
+        response = self.client.get(reverse('polls:results_timeseries', args=(question.id,)))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(POLLS_VOTE_BUFFER={'MAX_PENDING': 1},
+                   POLLS_RESULTS_STREAM={'ENABLED': True, 'COALESCE_INTERVAL': 0, 'HEARTBEAT': 0, 'MAX_DURATION': 60})
+class ResultsStreamTests(TestCase):
+    def test_snapshot_then_votes(self):
+        """
+        The stream starts with every choice's votes, then sends the new votes as they are written.
+        """
+        question = create_test_question("question", -1)
+        choice1 = create_test_choice(question, "choice1", 2)
+        choice2 = create_test_choice(question, "choice2", 0)
+        response = self.client.get(reverse('polls:results_stream', args=(question.id,)))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = iter(response.streaming_content)
+        self.assertEqual(next(events), b'retry: 3000\n\n')
+        self.assertEqual(next(events),
+                         ('event: snapshot\ndata: {"%d":2,"%d":0}\n\n' % (choice1.id, choice2.id)).encode())
+        self.assertEqual(broker.subscriber_count(question.id), 1)
+        Client().post(reverse('polls:vote', args=(question.id,)), {'choice': choice2.id})
+        Client().post(reverse('polls:vote', args=(question.id,)), {'choice': choice2.id})
+        self.assertEqual(next(events), ('event: votes\ndata: {"%d":2}\n\n' % choice2.id).encode())
+        self.assertEqual(next(events), b': keep-alive\n\n')
+        response.close()
+        self.assertEqual(broker.subscriber_count(question.id), 0)
+
+    def test_votes_in_snapshot_not_sent_again(self):
+        """
+        Votes written after the stream subscribed but before it read the snapshot are only counted once.
+        """
+        question = create_test_question("question", -1)
+        choice = create_test_choice(question, "choice", 0)
+        response = self.client.get(reverse('polls:results_stream', args=(question.id,)))
+        events = iter(response.streaming_content)
+        self.assertEqual(next(events), b'retry: 3000\n\n')
+        Client().post(reverse('polls:vote', args=(question.id,)), {'choice': choice.id})
+        self.assertEqual(next(events), ('event: snapshot\ndata: {"%d":1}\n\n' % choice.id).encode())
+        self.assertEqual(next(events), b': keep-alive\n\n')
+        response.close()
+
+    def test_future_question(self):
+        """
+        Unpublished questions can't be streamed.
+        """
+        question = create_test_question("question", 5)
+        response = self.client.get(reverse('polls:results_stream', args=(question.id,)))
+        self.assertEqual(response.status_code, 404)
+
+    def test_off_by_default(self):
+        """
+        Unless turned on, results pages don't open the stream and it can't be opened.
+        """
+        question = create_test_question("question", -1)
+        with override_settings(POLLS_RESULTS_STREAM={}):
+            self.assertNotContains(self.client.get(reverse('polls:results', args=(question.id,))), "EventSource(")
+            response = self.client.get(reverse('polls:results_stream', args=(question.id,)))
+            self.assertEqual(response.status_code, 404)
+        cache.clear()
+        self.assertContains(self.client.get(reverse('polls:results', args=(question.id,))), "EventSource(")
+
+
+class SharedCacheCheckTests(TestCase):
+    def test_local_memory_cache_warned_about(self):
+        caches = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=caches):
+            self.assertEqual([warning.id for warning in check_shared_cache(None)], ['polls.W001'])
+
+    def test_shared_cache_not_warned_about(self):
+        caches = {'default': {'BACKEND': 'django.core.cache.backends.memcached.PyLibMCCache'}}
+        with override_settings(CACHES=caches):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        registry.clear()
+
+    def test_requests_recorded_by_view(self):
+        """
+        Each request's latency, queries and render time are recorded against its URL name.
+        """
+        question = create_test_question("question", -1)
+        create_test_choice(question, "choice", 0)
+        self.client.get(reverse('polls:index'))
+        self.client.get(reverse('polls:index'))
+        self.client.get(reverse('polls:detail', args=(question.id,)))
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        text = response.content.decode()
+        self.assertIn('polls_requests_total{view="polls:index",status="200"} 2', text)
+        self.assertIn('polls_request_duration_seconds_count{view="polls:index"} 2', text)
+        self.assertIn('polls_request_duration_seconds_bucket{view="polls:index",le="+Inf"} 2', text)
+        self.assertIn('polls_template_render_seconds_count{view="polls:detail"} 1', text)
+        # the index page runs 3 queries and is then cached, so one request is in the le="0" bucket and both in le="3"
+        self.assertIn('polls_request_db_queries_bucket{view="polls:index",le="0"} 1', text)
+        self.assertIn('polls_request_db_queries_bucket{view="polls:index",le="2"} 1', text)
+        self.assertIn('polls_request_db_queries_bucket{view="polls:index",le="3"} 2', text)
+        self.assertIn('polls_request_db_queries_sum{view="polls:index"} 3.0', text)
+
+    def test_unresolved(self):
+        self.client.get('/no/such/page/')
+        text = self.client.get('/metrics').content.decode()
+        self.assertIn('polls_requests_total{view="unresolved",status="404"} 1', text)
+
+
 class QuestionCreateViewTests(TestCase):
     # === Sample post data ===
     # <QueryDict: {'csrfmiddlewaretoken': ['TRM5CNKVnb4pZrAwkhklBTW04bR9u0TGnegpWlS4euta8CNMOomDb06hhNoqoYXE'],
@@ -269,6 +1783,22 @@ class QuestionCreateViewTests(TestCase):
         response = self.client.post(self.url, post_data)
         self.assertRedirects(response, '/polls/')
 
+    def test_question_and_choices_created(self):
+        """
+        The question and its filled in choices are saved, with the choices written in one query.
+        """
+        post_data = self.default_post_data
+        post_data.update({'question_text': ['Question'], 'form-TOTAL_FORMS': ['3'], 'form-0-choice_text': ['Choice 1'],
+                          'form-1-choice_text': ['Choice 2'], 'form-2-choice_text': ['']})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.url, post_data)
+        question = Question.objects.get(question_text='Question')
+        self.assertEqual(question.author, self.user)
+        self.assertEqual(sorted(question.choice_set.values_list('choice_text', flat=True)), ['Choice 1', 'Choice 2'])
+        choice_inserts = [query for query in queries.captured_queries
+                          if query['sql'].startswith('INSERT INTO "polls_choice"')]
+        self.assertEqual(len(choice_inserts), 1)
+
     def test_cannot_access_when_not_authorized(self):
         """
         Redirect (shown by 302 status_code) when not logged in.
@@ -312,6 +1842,109 @@ class QuestionCreateViewTests(TestCase):
         self.assertEqual(response.status_code, 302)
 
 
+class ImportPollsCommandTests(TestCase):
+    def import_file(self, suffix, content, *args):
+        """
+        Write the content to a temporary file with the given suffix and run import_polls on it.
+        """
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        self.addCleanup(os.remove, path)
+        with os.fdopen(handle, 'w') as file:
+            file.write(content)
+        out = StringIO()
+        call_command('import_polls', path, *args, stdout=out)
+        return out.getvalue()
+
+    def test_import_jsonl(self):
+        """
+        Each line of a JSON Lines file becomes a question with its choices, authors looked up by username.
+        """
+        user = User.objects.create_user(username='testuser', password='testpass')
+        out = self.import_file('.jsonl', '\n'.join([
+            '{"question_text": "q1", "author": "testuser", "choices": ["a", {"choice_text": "b", "votes": 4}]}',
+            '',
+            '{"question_text": "q2", "pub_date": "2018-01-01T12:00:00", "choices": ["c", "d", "e"]}',
+            '{"question_text": "q3", "choices": ["f", "g"]}',
+        ]), '--batch-size', '2')
+        self.assertIn("Imported 3 questions and 7 choices", out)
+        self.assertIn("rows/s", out)
+        q1 = Question.objects.get(question_text="q1")
+        self.assertEqual(q1.author, user)
+        self.assertEqual(q1.votes_total, 4)
+        self.assertEqual(sorted(q1.choice_set.values_list('choice_text', 'votes')), [('a', 0), ('b', 4)])
+        q2 = Question.objects.get(question_text="q2")
+        self.assertIsNone(q2.author)
+        self.assertEqual(q2.pub_date.year, 2018)
+        self.assertEqual(q2.choice_set.count(), 3)
+
+    def test_import_csv(self):
+        """
+        Consecutive CSV rows with the same question column are one question.
+        """
+        self.import_file('.csv', "question,question_text,pub_date,author,choice_text,votes\n"
+                                 "1,q1,,,a,1\n"
+                                 "1,q1,,,b,2\n"
+                                 "2,q2,,,c,0\n"
+                                 "2,q2,,,d,5\n")
+        self.assertEqual(Question.objects.count(), 2)
+        q1 = Question.objects.get(question_text="q1")
+        self.assertEqual(q1.votes_total, 3)
+        self.assertEqual(sorted(q1.choice_set.values_list('choice_text', flat=True)), ['a', 'b'])
+
+    def test_invalid_json(self):
+        with self.assertRaises(CommandError):
+            self.import_file('.jsonl', '{"question_text": ')
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.question = create_test_question_owned("my question", self.user)
+        create_test_choice(self.question, "choice1", 2)
+        create_test_choice(self.question, "choice2", 5)
+        other_question = create_test_question_owned("not my question", User.objects.create_user(username='other'))
+        create_test_choice(other_question, "other choice", 1)
+
+    def test_export_my_polls_csv(self):
+        """
+        Authors can download their own polls (and only theirs) as CSV, one row per choice.
+        """
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('polls:export_my_polls'))
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'question,question_text,pub_date,author,choice_text,votes')
+        self.assertEqual([line.split(',')[4:] for line in lines[1:]], [['choice1', '2'], ['choice2', '5']])
+
+    def test_export_my_polls_ndjson(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('polls:export_my_polls'), {'format': 'ndjson'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row['question_text'], row['choice_text'], row['votes'], row['author']) for row in rows],
+                         [("my question", "choice1", 2, 'testuser'), ("my question", "choice2", 5, 'testuser')])
+
+    def test_export_needs_login(self):
+        response = self.client.get(reverse('polls:export_my_polls'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_export_command_round_trip(self):
+        """
+        The export_results command exports every poll, in a form import_polls can read back.
+        """
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        call_command('export_results', '--output', path)
+        with open(path) as file:
+            self.assertEqual(len(file.read().splitlines()), 4)
+        call_command('import_polls', path, stdout=StringIO())
+        self.assertEqual(Question.objects.filter(question_text="my question").count(), 2)
+        copy = Question.objects.filter(question_text="my question").latest('pk')
+        self.assertEqual(copy.author, self.user)
+        self.assertEqual(copy.votes_total, 7)
+
+
+@override_settings(POLLS_PURGE={'DELAY': None})
 class QuestionDeleteViewTests(TestCase):
     """
     Testing the delete view itself. i.e. AFTER the user presses the "yes" button when asked to delete the Question or
@@ -376,6 +2009,71 @@ class QuestionDeleteViewTests(TestCase):
         self.assertEquals(response.status_code, 403)
 
 
+@override_settings(POLLS_PURGE={'BATCH_SIZE': 2, 'PAUSE': 0, 'DELAY': None})
+class PurgeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_login(self.user)
+        self.question = create_test_question_owned("question", self.user)
+        self.choice = create_test_choice(self.question, "choice", 0)
+        for i in range(5):
+            Vote.objects.create(question=self.question, choice=self.choice, voter='session:%d' % i)
+        self.other = create_test_question_owned("other question", self.user)
+        create_test_choice(self.other, "choice", 0)
+
+    def delete(self, question):
+        return self.client.get(reverse('polls:delete', args=(question.id,)))
+
+    def test_deleted_question_hidden(self):
+        self.delete(self.question)
+        self.assertFalse(Question.objects.filter(pk=self.question.pk).exists())
+        self.assertTrue(Question.all_objects.filter(pk=self.question.pk).exists())
+        self.assertEqual(self.client.get(reverse('polls:detail', args=(self.question.id,))).status_code, 404)
+        self.assertEqual(list(self.client.get(reverse('polls:index')).context['latest_question_list']), [self.other])
+        self.assertEqual(list(self.client.get(reverse('polls:my_polls')).context['questions']), [self.other])
+        response = self.client.get(reverse('polls:results_batch'), {'ids': '%d,%d' % (self.question.id, self.other.id)})
+        self.assertEqual(list(response.json()), [str(self.other.id)])
+        response = Client().post(reverse('polls:vote_api', args=(self.question.id,)), {'choice': self.choice.id})
+        self.assertEqual(response.status_code, 400)
+
+    def test_deleting_leaves_rows_for_purge(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.delete(self.question)
+        self.assertFalse([query for query in queries.captured_queries if query['sql'].startswith('DELETE')])
+        self.assertEqual(Vote.objects.filter(question=self.question).count(), 5)
+
+    def test_purge_in_batches(self):
+        self.delete(self.question)
+        # the votes two at a time, then the question and its choice
+        self.assertEqual([purge_batch(2) for _ in range(5)], [2, 2, 1, 1, 0])
+        self.assertFalse(Question.all_objects.filter(pk=self.question.pk).exists())
+        self.assertFalse(Choice.objects.filter(pk=self.choice.pk).exists())
+        self.assertFalse(Vote.objects.exists())
+        self.assertTrue(Question.objects.filter(pk=self.other.pk).exists())
+
+    def test_purge_waits_for_delay(self):
+        self.delete(self.question)
+        with override_settings(POLLS_PURGE={'DELAY': 60}), mock.patch.object(purge_worker, 'schedule'):
+            self.assertEqual(drain_purge_queue(), 0)
+        self.assertTrue(Question.all_objects.filter(pk=self.question.pk).exists())
+
+    def test_command_drains_queue(self):
+        self.delete(self.question)
+        self.delete(self.other)
+        out = StringIO()
+        call_command('purge_deleted_questions', stdout=out)
+        # 5 votes in three batches, then each question
+        self.assertIn("Purged 7 rows.", out.getvalue())
+        self.assertFalse(Question.all_objects.exists())
+
+    def test_worker_scheduled(self):
+        with override_settings(POLLS_PURGE={'DELAY': 60}), mock.patch('threading.Timer') as timer:
+            self.delete(self.question)
+            self.delete(self.other)
+            purge_worker._timer = None
+        timer.assert_called_once_with(60, purge_worker._run)
+
+
 class SeleniumTests(StaticLiveServerTestCase):
     """ Selenium tests for Firefox """
     @classmethod
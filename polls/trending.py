@@ -0,0 +1,64 @@
+"""
+Trending questions: the ones getting the most votes lately, with every vote counting half as much for each HALF_LIFE
+that has passed since it was cast.
+
+Decaying every question's score as time passes would mean rewriting every row. Instead each vote is weighted by how
+far after a fixed EPOCH it was cast (a vote one HALF_LIFE later is worth twice as much), which ranks questions exactly
+as decaying them all would, so scores only change when a question gets votes. The weights grow exponentially, so the
+score stored is their natural log:
+
+    trending_score = ln(sum of 2 ** ((time of vote - EPOCH) / HALF_LIFE) over the question's votes)
+
+which only grows by about 0.7 per HALF_LIFE, and is added to in SQL by each vote flush (see votes.py). The index on
+trending_score lets the trending page read the top questions straight off it.
+
+Changing HALF_LIFE only changes the weight of votes cast from then on, so scores from before and after aren't
+comparable until the older votes have decayed away.
+"""
+import datetime
+import math
+
+from django.conf import settings
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Abs, Exp, Greatest, Ln
+
+from . import constants
+
+EPOCH = datetime.datetime(2018, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def get_trending_policy():
+    """
+    Return the (half_life, size) pair from the POLLS_TRENDING setting, falling back to the defaults in constants.py.
+    """
+    policy = getattr(settings, 'POLLS_TRENDING', {})
+    return (policy.get('HALF_LIFE', constants.TRENDING_HALF_LIFE),
+            policy.get('SIZE', constants.TRENDING_SIZE))
+
+
+def log_weight(votes, when):
+    """
+    The natural log of the weight of `votes` votes cast at `when`.
+    """
+    half_life = get_trending_policy()[0]
+    return math.log(votes) + (when - EPOCH).total_seconds() / half_life * math.log(2)
+
+
+def add_votes(votes, when):
+    """
+    Return an expression for a question's trending_score with `votes` more votes cast at `when`.
+    """
+    score = F('trending_score')
+    weight = Value(log_weight(votes, when), output_field=FloatField())
+    # ln(e ** score + e ** weight), worked out without ever raising e to a large power (or, with the clamp at -700,
+    # to a very negative one, which some databases reject)
+    return Greatest(score, weight) + Ln(1 + Exp(Greatest(-Abs(score - weight), -700.0)))
+
+
+def recent_votes(score, now):
+    """
+    How many votes a question with the given trending_score has had, with the older ones counting for less.
+    """
+    if score <= constants.TRENDING_NO_VOTES:
+        return 0
+    return math.exp(score - log_weight(1, now))
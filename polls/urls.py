@@ -6,14 +6,21 @@ from . import views
 app_name = 'polls'
 urlpatterns = [
     path('', views.IndexView.as_view(), name='index'),
+    path('trending/', views.TrendingView.as_view(), name='trending'),
     path('<int:pk>/', views.DetailView.as_view(), name='detail'),
+    path('results/', views.results_batch, name='results_batch'),
     path('<int:pk>/results/', views.ResultsView.as_view(), name='results'),
+    path('<int:pk>/results/stream/', views.results_stream, name='results_stream'),
+    path('<int:pk>/results/timeseries/', views.results_timeseries, name='results_timeseries'),
     path('<int:question_id>/vote/', views.vote, name='vote'),
+    path('<int:question_id>/vote/api/', views.vote_api, name='vote_api'),
     path('create/', views.create_question, name='create'),
     # path('<int:pk>/delete/', views.QuestionDelete.as_view(), name='delete'),
     path('<int:question_id>/delete/', views.delete_question, name='delete'),
+    path('search/', views.search, name='search'),
     path('about/', views.AboutView.as_view(), name='about'),
     path('my_polls/', views.my_polls, name='my_polls'),
+    path('my_polls/export/', views.export_my_polls, name='export_my_polls'),
     path('login/', auth_views.LoginView.as_view(), name='login'),
     path('logout/', auth_views.LogoutView.as_view(), name='logout'),
 ]
\ No newline at end of file
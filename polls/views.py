@@ -1,14 +1,38 @@
+import hashlib
+import json
+import math
+
 from django.contrib.auth.decorators import login_required
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Prefetch
 from django.forms import formset_factory
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.middleware.csrf import get_token
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse, reverse_lazy
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django.views import generic
+from django.views.decorators.http import require_GET, require_POST
 
+from . import constants, trending
+from .cache import (
+    ABOUT_VERSION_KEY, batch_results_key, cached_author_summary, cached_detail, cached_published, cached_results,
+    get_detail_version, get_question_version, get_question_versions, get_results_cache_policy, get_version,
+)
+from .export import FORMATS, export_lines
 from .forms import QuestionForm, ChoiceForm, BaseChoiceFormSet
-from .models import Question, Choice, AboutSection
+from .ledger import claim_vote
+from .models import Question, Choice, AboutSection, VoteRollup
+from .pagination import KeysetPaginator
+from .pubsub import results_events, stream_enabled
+from .purge import soft_delete_questions
+from .rollups import PERIODS, timeseries
+from .votes import record_vote
 
 class IndexView(generic.ListView):
     template_name = 'polls/index.html'
@@ -21,30 +45,222 @@ class IndexView(generic.ListView):
         published in the future).
         """
         return Question.objects.filter(
-            pub_date__lte=timezone.now()
-        ).order_by('-pub_date')
+            pub_date__lte=timezone.now(), unpublished=False
+        ).order_by('-pub_date').select_related('author').prefetch_related('choice_set').with_shard_votes()
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Page through the questions with cursors rather than page numbers (see pagination.py). Pages are cached until
+        the next scheduled question is published (see cache.py).
+        """
+        cursor = self.request.GET.get('cursor') or ''
+        page = cached_published(
+            'index:%d:%s' % (page_size, hashlib.md5(cursor.encode()).hexdigest()),
+            lambda: KeysetPaginator(queryset, page_size).page(cursor),
+            Question.objects.next_pub_date,
+        )
+        return (None, page, page.object_list, page.has_other_pages())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # each question's card is cached against the question's version (see cache.py)
+        versions = get_question_versions([question.id for question in context['latest_question_list']])
+        for question in context['latest_question_list']:
+            question.cache_version = versions[question.id]
+        return context
+
+
+class TrendingView(generic.ListView):
+    template_name = 'polls/trending.html'
+    context_object_name = 'question_list'
+
+    def get_queryset(self):
+        """
+        The published questions with the most votes lately, read straight off the trending_score index (see
+        trending.py).
+        """
+        return Question.objects.filter(
+            pub_date__lte=timezone.now(), unpublished=False, trending_score__gt=constants.TRENDING_NO_VOTES
+        ).order_by('-trending_score').select_related('author').prefetch_related(
+            'choice_set'
+        ).with_shard_votes()[:trending.get_trending_policy()[1]]
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # worked out from the score each question already has, so no query is needed for it
+        now = timezone.now()
+        for question in context['question_list']:
+            question.recent_votes = round(trending.recent_votes(question.trending_score, now))
+        return context
+
 
+class ConditionalQuestionMixin:
+    """
+    Answers 304 Not Modified when the browser already has the page, without loading the question or rendering
+    anything.
+
+    The ETag is made from the question's cache version (see cache.py), which is bumped on every vote and change (or
+    for pages that don't show votes, the one only bumped on changes), and from whatever else the page shows that
+    differs between requests: the user in the navigation bar and, for pages with a form, the CSRF cookie. Only 200
+    responses get an ETag, so a page that 404s (e.g. a question that is not published yet) is never revalidated into
+    a 304.
+    """
+    uses_csrf_token = False
+    shows_votes = True
+
+    def get_etag(self, request):
+        question_id = self.kwargs['pk']
+        version = get_question_version(question_id) if self.shows_votes else get_detail_version(question_id)
+        parts = [version, request.user.pk, request.user.get_username()]
+        if self.uses_csrf_token:
+            get_token(request)
+            parts.append(request.META['CSRF_COOKIE'])
+        return quote_etag(hashlib.md5(':'.join(map(str, parts)).encode()).hexdigest())
 
-class DetailView(generic.DetailView):
+    def get(self, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            response['ETag'] = etag
+        return response
+
+
+class DetailView(ConditionalQuestionMixin, generic.DetailView):
     model = Question
     template_name = 'polls/detail.html'
+    uses_csrf_token = True
+    shows_votes = False
 
     def get_queryset(self):
+        return Question.objects.prefetch_related('choice_set')
+
+    def get_object(self, queryset=None):
         """
-        Excludes any questions that aren't published yet.
+        Served from the cache until the question is changed (see cache.py). Excludes any questions that aren't
+        published yet or have been unpublished.
         """
-        return Question.objects.filter(pub_date__lte=timezone.now())
+        question = cached_detail(self.kwargs['pk'], lambda: super(DetailView, self).get_object(queryset))
+        if question.pub_date > timezone.now() or question.unpublished:
+            raise Http404("No question found matching the query")
+        return question
 
 
-class ResultsView(generic.DetailView):
+class ResultsView(ConditionalQuestionMixin, generic.DetailView):
     model = Question
     template_name = 'polls/results.html'
 
     def get_queryset(self):
         """
-        Excludes any questions that aren't published yet.
+        Vote counts include any votes still in shards.
         """
-        return Question.objects.filter(pub_date__lte=timezone.now())
+        return Question.objects.prefetch_related(
+            Prefetch('choice_set', queryset=Choice.objects.with_shard_votes())
+        ).with_shard_votes()
+
+    def get_object(self, queryset=None):
+        """
+        Served from the results cache until the question gets new votes (see cache.py). Excludes any questions that
+        aren't published yet or have been unpublished.
+        """
+        question = cached_results(self.kwargs['pk'], lambda: super(ResultsView, self).get_object(queryset))
+        if question.pub_date > timezone.now() or question.unpublished:
+            raise Http404("No question found matching the query")
+        return question
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['stream_enabled'] = stream_enabled()
+        return context
+
+
+def search(request):
+    """
+    Published questions whose text or choices match ?q=, best matches first (see search.py).
+    """
+    terms = request.GET.get('q', '').strip()
+    questions = Question.objects.filter(
+        pub_date__lte=timezone.now(), unpublished=False
+    ).select_related('author').prefetch_related('choice_set').with_shard_votes().search(terms)
+    page = Paginator(questions, IndexView.paginate_by).get_page(request.GET.get('page'))
+    return render(request, 'polls/search.html', {
+        'terms': terms,
+        'page_obj': page,
+        'question_list': page.object_list,
+    })
+
+
+@require_GET
+def results_batch(request):
+    """
+    The votes and percentage of every choice of several questions at once, as compact JSON from a single query:
+    {"<question id>": {"total": votes, "choices": [[choice id, votes, percentage], ...]}}. The questions are given as
+    ?ids=1,2,3, and any that don't exist or aren't published are left out. The answer is cached, and has an ETag,
+    until one of the questions changes. A question going live changes nothing else, so an answer leaving out a
+    question scheduled for later is only cached until then, and has no ETag.
+    """
+    try:
+        question_ids = sorted({int(question_id) for question_id in request.GET.get('ids', '').split(',')})
+    except ValueError:
+        return JsonResponse({'error': "ids must be a comma separated list of question ids."}, status=400)
+    if len(question_ids) > constants.RESULTS_BATCH_MAX_QUESTIONS:
+        return JsonResponse({'error': "At most %d questions can be asked for at once."
+                                      % constants.RESULTS_BATCH_MAX_QUESTIONS}, status=400)
+
+    key = batch_results_key(question_ids)
+    etag = quote_etag(key.rsplit(':', 1)[1])
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    entry = cache.get(key)
+    if entry is None or (entry[0] is not None and timezone.now() >= entry[0]):
+        now = timezone.now()
+        tallies = Choice.objects.filter(
+            question_id__in=question_ids, question__pub_date__lte=now, question__unpublished=False,
+            question__deleted_at__isnull=True,
+        ).tallies()
+        pub_date = Question.objects.filter(pk__in=question_ids).next_pub_date()
+        entry = (pub_date, json.dumps(tallies, separators=(',', ':')))
+        timeout = get_results_cache_policy()[0]
+        if pub_date is not None:
+            timeout = min(timeout, max(1, math.ceil((pub_date - now).total_seconds())))
+        cache.set(key, entry, timeout)
+    pub_date, content = entry
+    response = HttpResponse(content, content_type='application/json')
+    if pub_date is None:
+        response['ETag'] = etag
+    return response
+
+
+def results_stream(request, pk):
+    """
+    Stream live vote counts to the results page as Server-Sent Events (see pubsub.py), if turned on.
+    """
+    if not stream_enabled():
+        raise Http404("Live results are turned off")
+    question = get_object_or_404(Question, pk=pk, pub_date__lte=timezone.now(), unpublished=False)
+    response = StreamingHttpResponse(results_events(question), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # stop nginx from holding the events back in its buffer
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def results_timeseries(request, pk):
+    """
+    The question's votes over time as JSON, read from the vote rollups (see rollups.py). ?period= is minute, hour
+    (the default) or day.
+    """
+    question = get_object_or_404(Question, pk=pk, pub_date__lte=timezone.now(), unpublished=False)
+    period = request.GET.get('period', VoteRollup.HOUR)
+    if period not in PERIODS:
+        return JsonResponse({'error': "The period must be one of %s." % ', '.join(PERIODS)}, status=400)
+    return JsonResponse({
+        'period': period,
+        'series': [{'time': bucket.isoformat(), 'votes': votes} for bucket, votes in timeseries(question, period)],
+    })
 
 
 class AboutView(generic.ListView):
@@ -57,6 +273,12 @@ class AboutView(generic.ListView):
         """
         return AboutSection.objects.all().order_by('display_order')
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # the sections are cached against this, so they are only queried when one has changed
+        context['about_version'] = get_version(ABOUT_VERSION_KEY)
+        return context
+
 
 def vote(request, question_id):
     question = get_object_or_404(Question, pk=question_id)
@@ -69,14 +291,53 @@ def vote(request, question_id):
             'error_message': "You didn't select a choice.",
         })
     else:
-        selected_choice.votes += 1
-        selected_choice.save()
+        if not claim_vote(request, question.id, selected_choice.id):
+            return render(request, 'polls/detail.html', {
+                'question': question,
+                'error_message': "You have already voted on this question.",
+            })
+        # the vote is buffered and written to the database in a batch with others (see votes.py)
+        record_vote(question.id, selected_choice.id)
         # Always return an HttpResponseRedirect after successfully dealing
         # with POST data. This prevents data from being posted twice if a
         # user hits the Back button.
         return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
 
 
+@require_POST
+def vote_api(request, question_id):
+    """
+    Vote without the redirect and page render of vote(). Answers 204 No Content, or with ?counts=1 a JSON object with
+    the votes of every choice (as of this vote, not counting other votes still waiting to be written). A second vote
+    on the same question is answered with 409 Conflict.
+    """
+    choice_id = request.POST.get('choice', '')
+    if not choice_id.isdigit():
+        return JsonResponse({'accepted': False, 'error': "You didn't select a choice."}, status=400)
+    choice_id = int(choice_id)
+    # checking the choice belongs to a published question and getting the counts is one query either way
+    choices = Choice.objects.filter(
+        question_id=question_id, question__pub_date__lte=timezone.now(), question__unpublished=False,
+        question__deleted_at__isnull=True,
+    )
+    include_counts = request.GET.get('counts') == '1'
+    if include_counts:
+        votes = {choice.id: choice.current_votes for choice in choices.with_shard_votes()}
+        valid = choice_id in votes
+    else:
+        valid = choices.filter(pk=choice_id).exists()
+    if not valid:
+        return JsonResponse({'accepted': False, 'error': "That isn't a choice of this poll."}, status=400)
+    if not claim_vote(request, question_id, choice_id):
+        return JsonResponse({'accepted': False, 'error': "You have already voted on this question."}, status=409)
+
+    record_vote(question_id, choice_id)
+    if not include_counts:
+        return HttpResponse(status=204)
+    votes[choice_id] += 1
+    return JsonResponse({'accepted': True, 'votes': votes})
+
+
 @login_required(login_url='/polls/login/')
 def create_question(request):
     """
@@ -92,13 +353,16 @@ def create_question(request):
         new_question = q_form.save(commit=False)
         new_question.author = request.user
         new_question.pub_date = timezone.now()
-        new_question.save()
         # make a choice for this question for each filled in choice form
-        for choice in c_formset.cleaned_data:
-            choice_text = choice.get('choice_text')
-            # any unfilled choice has no 'choice_text' key, so ignore these
-            if choice_text is not None:
-                Choice.objects.create(question=new_question, choice_text=choice_text, votes=0)
+        # (any unfilled choice has no 'choice_text' key, so ignore these)
+        choices = [Choice(choice_text=choice['choice_text'], votes=0)
+                   for choice in c_formset.cleaned_data if choice.get('choice_text') is not None]
+        # save the question and all its choices together, so there are never half-made polls
+        with transaction.atomic():
+            new_question.save()
+            for choice in choices:
+                choice.question = new_question
+            Choice.objects.bulk_create(choices)
         return HttpResponseRedirect(reverse('polls:index'))
 
     # send the form/formset objects to the template
@@ -116,7 +380,8 @@ def delete_question(request, question_id):
     """
     question = get_object_or_404(Question, pk=question_id)
     if request.user == question.author:
-        question.delete()
+        # hidden straight away, and purged in the background (see purge.py)
+        soft_delete_questions([question.pk])
         success_url = reverse_lazy('polls:my_polls')
         return HttpResponseRedirect(success_url)
     else:
@@ -125,12 +390,31 @@ def delete_question(request, question_id):
 
 def my_polls(request):
     """
-    Show all the polls that the user created.
+    Show the polls that the user created, a page at a time, under a summary of all of them.
     If the user is not signed in, redirect to the login screen.
     """
     if request.user.is_authenticated:
-        questions = Question.objects.filter(author=request.user).order_by('-pub_date')
-        context = {'questions': questions}
+        questions = Question.objects.filter(author=request.user)
+        summary = cached_author_summary(request.user.pk, questions.summary)
+        page = KeysetPaginator(
+            questions.prefetch_related('choice_set').with_shard_votes(), constants.MY_POLLS_PER_PAGE
+        ).page(request.GET.get('cursor'))
+        context = {'questions': page.object_list, 'page_obj': page, 'is_paginated': page.has_other_pages(),
+                   'summary': summary}
         return render(request, 'polls/my_polls.html', context)
     else:
         return HttpResponseRedirect(reverse('polls:login')+'?next=/polls/my_polls/')
+
+
+@login_required(login_url='/polls/login/')
+def export_my_polls(request):
+    """
+    Download the choices and vote counts of all the user's polls, as CSV or (with ?format=ndjson) NDJSON.
+    """
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in FORMATS:
+        raise Http404("Unknown export format.")
+    questions = Question.objects.filter(author=request.user)
+    response = StreamingHttpResponse(export_lines(questions, export_format), content_type=FORMATS[export_format])
+    response['Content-Disposition'] = 'attachment; filename="my_polls.%s"' % export_format
+    return response
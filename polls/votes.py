@@ -0,0 +1,340 @@
+"""
+Write-behind buffering for incoming votes.
+
+Votes are counted in memory and written to the database in batches: every flush turns the waiting votes into a
+single `votes = votes + n` UPDATE per choice, all inside one transaction. A flush happens when MAX_PENDING votes are
+waiting, when the oldest waiting vote is FLUSH_INTERVAL seconds old, or when the process exits.
+
+Each WSGI worker process has its own buffer. Because flushes only ever add to the stored counts (and never write a
+value computed in Python), any number of workers can flush at the same time without losing votes.
+
+Questions with sharded_votes set don't have their Choice and Question rows updated by a flush. Their votes go to a
+random ChoiceShard of each choice instead, so concurrent flushes rarely wait on the same row. compact_shards() later
+moves those votes into Choice.votes and Question.votes_total. A question is switched to sharded counting
+automatically when it gets more than AUTO_THRESHOLD votes per second (as seen by one process).
+"""
+import atexit
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import constants, rollups, trending
+from .models import Choice, ChoiceShard, Question, Vote, VoteRollup
+from .cache import invalidate_author_summaries, invalidate_question
+from .signals import votes_applied
+
+logger = logging.getLogger(__name__)
+
+
+def get_flush_policy():
+    """
+    Return the (max_pending, flush_interval, max_attempts) triple from the POLLS_VOTE_BUFFER setting, falling back to
+    the defaults in constants.py.
+    """
+    policy = getattr(settings, 'POLLS_VOTE_BUFFER', {})
+    return (policy.get('MAX_PENDING', constants.VOTE_BUFFER_MAX_PENDING),
+            policy.get('FLUSH_INTERVAL', constants.VOTE_BUFFER_FLUSH_INTERVAL),
+            policy.get('MAX_ATTEMPTS', constants.VOTE_BUFFER_MAX_ATTEMPTS))
+
+
+def get_shard_policy():
+    """
+    Return the (shards, auto_threshold) pair from the POLLS_SHARDED_VOTES setting, falling back to the defaults in
+    constants.py.
+    """
+    policy = getattr(settings, 'POLLS_SHARDED_VOTES', {})
+    return (policy.get('SHARDS', constants.VOTE_SHARDS),
+            policy.get('AUTO_THRESHOLD', constants.VOTE_SHARD_AUTO_THRESHOLD))
+
+
+# when votes were last applied, for working out how many votes per second each question is getting
+_last_applied = None
+
+
+def _hot_questions(question_counts):
+    """
+    Return the ids of the questions getting more votes per second than the AUTO_THRESHOLD setting.
+    """
+    global _last_applied
+    now = time.monotonic()
+    elapsed = None if _last_applied is None else now - _last_applied
+    _last_applied = now
+    threshold = get_shard_policy()[1]
+    if threshold is None or elapsed is None:
+        return set()
+    # measure over at least a second so a couple of votes close together don't look like a flood
+    elapsed = max(elapsed, 1.0)
+    return {question_id for question_id, n in question_counts.items() if n / elapsed > threshold}
+
+
+def add_to_shard(choice_id, count):
+    """
+    Add `count` votes to a random shard of the given choice, creating the shard if it doesn't exist yet.
+    """
+    shard = random.randrange(get_shard_policy()[0])
+    shards = ChoiceShard.objects.filter(choice_id=choice_id, shard=shard)
+    if shards.update(votes=F('votes') + count):
+        return
+    try:
+        with transaction.atomic():
+            ChoiceShard.objects.create(choice_id=choice_id, shard=shard, votes=count)
+    except IntegrityError:
+        # another process created the shard first
+        shards.update(votes=F('votes') + count)
+
+
+def apply_votes(counts):
+    """
+    Write the given {(question_id, choice_id): number_of_votes} counts to the database in one transaction, along
+    with the matching increase of each question's votes_total and trending_score and the current minute's rollups,
+    then send the votes_applied signal. Votes for choices deleted since they were cast are dropped.
+
+    Rows are locked and updated in primary key order, so two processes flushing votes for the same questions wait
+    for each other rather than deadlock.
+    """
+    with transaction.atomic():
+        # a vote buffered for a choice that has since been deleted would make the shard and rollup INSERTs fail the
+        # foreign key, and with them the whole batch; the choices are locked so they can't go before the commit
+        existing = set(Choice.objects.select_for_update().filter(
+            pk__in={choice_id for question_id, choice_id in counts}
+        ).order_by('pk').values_list('pk', flat=True))
+        dropped = {key: n for key, n in counts.items() if key[1] not in existing}
+        if dropped:
+            logger.warning("Dropping %d votes for deleted choices: %r", sum(dropped.values()), dropped)
+            counts = {key: n for key, n in counts.items() if key not in dropped}
+        question_counts = Counter()
+        for (question_id, choice_id), n in counts.items():
+            question_counts[question_id] += n
+        sharded = set(Question.objects.filter(
+            pk__in=question_counts, sharded_votes=True
+        ).values_list('pk', flat=True))
+        newly_hot = _hot_questions(question_counts) - sharded
+        sharded |= newly_hot
+        for (question_id, choice_id), n in sorted(counts.items()):
+            if question_id in sharded:
+                add_to_shard(choice_id, n)
+            else:
+                Choice.objects.filter(pk=choice_id).update(votes=F('votes') + n)
+        now = timezone.now()
+        for question_id, n in sorted(question_counts.items()):
+            # sharded questions too: it is still only one UPDATE per question per flush
+            changes = {'trending_score': trending.add_votes(n, now)}
+            if question_id in newly_hot:
+                # switched over in the same UPDATE, so each question row is only locked once
+                changes['sharded_votes'] = True
+            # sharded questions get their total from the shards when they are compacted
+            if question_id not in sharded:
+                changes['votes_total'] = F('votes_total') + n
+            Question.objects.filter(pk=question_id).update(**changes)
+        rollups.add_votes(counts, now)
+    votes_applied.send(sender=apply_votes, counts=counts)
+
+
+def compact_shards():
+    """
+    Move the votes sitting in shards into Choice.votes and Question.votes_total, and return how many were moved.
+
+    Exactly the amount read is taken off each shard, so votes added to a shard while this runs are kept for the next
+    compaction. The shards are read with select_for_update(), which sends the read to the primary (a replica could be
+    behind what is taken off the primary's shards) and keeps two compactions from moving the same votes. Their choices
+    are locked first, in the same order as apply_votes() locks them, so the two can't deadlock.
+    """
+    with transaction.atomic():
+        choice_ids = list(Choice.objects.select_for_update().filter(
+            pk__in=ChoiceShard.objects.filter(votes__gt=0).values('choice_id')
+        ).order_by('pk').values_list('pk', flat=True))
+        shards = list(ChoiceShard.objects.select_for_update().filter(
+            choice__in=choice_ids, votes__gt=0
+        ).order_by('pk').values_list('pk', 'choice_id', 'choice__question_id', 'votes'))
+        choice_counts = Counter()
+        question_counts = Counter()
+        for pk, choice_id, question_id, n in shards:
+            ChoiceShard.objects.filter(pk=pk).update(votes=F('votes') - n)
+            choice_counts[choice_id] += n
+            question_counts[question_id] += n
+        for choice_id, n in sorted(choice_counts.items()):
+            Choice.objects.filter(pk=choice_id).update(votes=F('votes') + n)
+        for question_id, n in sorted(question_counts.items()):
+            Question.objects.filter(pk=question_id).update(votes_total=F('votes_total') + n)
+    return sum(question_counts.values())
+
+
+def reset_votes(question_ids):
+    """
+    Take every vote off the given questions, forgetting who voted and when, with one statement per table.
+    """
+    question_ids = list(question_ids)
+    author_ids = list(Question.objects.filter(pk__in=question_ids).values_list('author_id', flat=True))
+    with transaction.atomic():
+        Choice.objects.filter(question__in=question_ids).update(votes=0)
+        Question.objects.filter(pk__in=question_ids).update(
+            votes_total=0, trending_score=constants.TRENDING_NO_VOTES
+        )
+        ChoiceShard.objects.filter(choice__question__in=question_ids).delete()
+        VoteRollup.objects.filter(choice__question__in=question_ids).delete()
+        Vote.objects.filter(question__in=question_ids).delete()
+    for question_id in question_ids:
+        invalidate_question(question_id)
+    invalidate_author_summaries(author_ids)
+
+
+class VoteBuffer:
+    """
+    Collects votes in memory until the flush policy says they should be written.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = Counter()
+        # how many flushes in a row each (question_id, choice_id) has failed to be written in
+        self._failures = Counter()
+        self._size = 0
+        self._timer = None
+        self._pid = os.getpid()
+
+    def _check_process(self):
+        """
+        A buffer copied into a forked worker (e.g. gunicorn --preload) still holds the parent's votes. Those belong to
+        the parent, so the child starts with an empty buffer instead of writing them a second time.
+        """
+        if self._pid != os.getpid():
+            self._lock = threading.Lock()
+            self._pending = Counter()
+            self._failures = Counter()
+            self._size = 0
+            self._timer = None
+            self._pid = os.getpid()
+
+    def _start_timer(self):
+        """
+        Have the buffered votes flushed FLUSH_INTERVAL seconds from now, unless that is already due. Called with the
+        lock held.
+        """
+        if self._timer is None:
+            self._timer = threading.Timer(get_flush_policy()[1], self._flush_from_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def add(self, question_id, choice_id, count=1):
+        """
+        Buffer `count` votes for the given choice, flushing if the buffer is full.
+
+        The vote is counted once buffered, so a flush that fails is only logged: its votes stay buffered for the next
+        flush, and the voter isn't told their vote failed.
+        """
+        self._check_process()
+        max_pending = get_flush_policy()[0]
+        with self._lock:
+            self._pending[(question_id, choice_id)] += count
+            self._size += count
+            full = self._size >= max_pending
+            if not full:
+                self._start_timer()
+        if full:
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Could not flush buffered votes, will retry on the next flush.")
+
+    def flush(self):
+        """
+        Write every buffered vote to the database and return how many were written.
+
+        If the batch can't be written, each of its votes is tried on its own so one bad entry doesn't hold up the
+        rest. Entries that still fail are put back in the buffer for the next flush to retry (which is scheduled as
+        usual), until they have failed MAX_ATTEMPTS flushes in a row, when they are logged and dropped. The last error
+        is raised after the others have been written.
+        """
+        self._check_process()
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._size = 0
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+        try:
+            apply_votes(pending)
+        except Exception:
+            logger.warning("Could not write a batch of %d votes, writing them one by one.", sum(pending.values()),
+                           exc_info=True)
+        else:
+            with self._lock:
+                for key in pending:
+                    self._failures.pop(key, None)
+            return sum(pending.values())
+
+        written = 0
+        error = None
+        max_attempts = get_flush_policy()[2]
+        for key, n in pending.items():
+            try:
+                apply_votes({key: n})
+            except Exception as e:
+                error = e
+                with self._lock:
+                    self._failures[key] += 1
+                    if self._failures[key] >= max_attempts:
+                        del self._failures[key]
+                        logger.error("Dropping %d votes for %r after %d failed attempts to write them.", n, key,
+                                     max_attempts, exc_info=True)
+                    else:
+                        self._pending[key] += n
+                        self._size += n
+            else:
+                written += n
+                with self._lock:
+                    self._failures.pop(key, None)
+        with self._lock:
+            if self._pending:
+                self._start_timer()
+        if error is not None:
+            raise error
+        return written
+
+    def _flush_from_timer(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Could not flush buffered votes, will retry on the next flush.")
+        finally:
+            # the timer thread got its own database connection, don't leave it open
+            connections.close_all()
+
+    def __len__(self):
+        return self._size
+
+
+vote_buffer = VoteBuffer()
+
+
+def record_vote(question_id, choice_id):
+    """
+    Count a vote for the given choice. It is written to the database on the next flush.
+    """
+    vote_buffer.add(question_id, choice_id)
+
+
+def flush_votes():
+    """
+    Write all buffered votes now.
+    """
+    return vote_buffer.flush()
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        vote_buffer.flush()
+    except Exception:
+        logger.exception("Could not flush %d buffered votes at exit.", len(vote_buffer))